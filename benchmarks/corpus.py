@@ -0,0 +1,54 @@
+"""Fixture corpus and questions for the benchmarks."""
+import functools
+import random
+from typing import Dict, List
+
+VOCABULARY = [
+    "singleton", "factory", "observer", "decorator", "adapter", "strategy",
+    "recursion", "iteration", "closure", "generator", "iterator", "coroutine",
+    "thread", "process", "lock", "queue", "stack", "heap", "tree", "graph",
+    "hash", "table", "list", "array", "pointer", "reference", "object", "class",
+    "inheritance", "interface", "polymorphism", "encapsulation", "module",
+    "package", "function", "method", "variable", "constant", "scope", "memory",
+    "cache", "index", "query", "database", "transaction", "network", "socket",
+    "protocol", "request", "response", "compiler", "interpreter", "runtime",
+    "exception", "error", "test", "assertion", "sorting", "search", "complexity",
+]
+
+QUESTIONS = [
+    "What is a singleton in object oriented programming?",
+    "How does the factory pattern differ from the strategy pattern?",
+    "When should I use recursion instead of iteration?",
+    "What is a closure and how does it capture variables?",
+    "How do generators and iterators work together?",
+    "What is the difference between a thread and a process?",
+    "How does a hash table handle collisions?",
+    "Why is polymorphism useful in class design?",
+    "How does a database transaction keep data consistent?",
+    "What happens when a compiler finds a syntax error?",
+    "How do I test a function that raises an exception?",
+    "What is the complexity of sorting a list?",
+    "How does a socket send a request over the network?",
+    "What is the scope of a variable inside a module?",
+    "How does a cache decide which entry to evict?",
+    "What is the observer pattern used for?",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def build_corpus(size: int = 200, words_per_doc: int = 120, seed: int = 0) -> List[Dict]:
+    """Builds `size` documents, every tenth one is long enough to be chunked."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        length = words_per_doc * 40 if i % 10 == 0 else words_per_doc
+        words = [rng.choice(VOCABULARY) for _ in range(length)]
+        corpus.append(
+            {
+                "title": f"{words[0].title()} and {words[1]} explained ({i})",
+                "url": f"https://fixture.example.com/docs/{i}",
+                "snippet": " ".join(words) + ".",
+                "terms": set(words),
+            }
+        )
+    return corpus
@@ -0,0 +1,145 @@
+"""Deterministic stand-ins for the chat model and the search tools.
+
+`FakeChatModel` answers each prompt of the pipeline (search term, extract,
+combine, agent) with a well-formed response after a configurable latency, and
+`FixtureSearch` serves documents from the fixture corpus. Both are derived from
+a hash of their input, so two runs with the same settings do the same work.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from tutor_helper.tools.search.search import DuckDuckGoSearch
+
+from benchmarks.corpus import VOCABULARY, build_corpus
+
+SOURCE_PATTERN = re.compile(r"Source: (\S+)")
+
+
+def _rng(text: str) -> random.Random:
+    return random.Random(hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest())
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with a fixed latency and deterministic output."""
+
+    latency_seconds: float = 0.05
+    output_tokens: int = 64
+    streaming: bool = False
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-fake-chat"
+
+    def _words(self, prompt: str) -> str:
+        rng = _rng(prompt)
+        return " ".join(rng.choice(VOCABULARY) for _ in range(self.output_tokens))
+
+    def respond(self, prompt: str) -> str:
+        """Returns the response the pipeline expects for `prompt`."""
+        text = self._words(prompt)
+        if "$JSON_BLOB" in prompt:
+            # Agent: research first, answer once the scratchpad holds an observation
+            if "This was your previous work" in prompt:
+                action = {"action": "Final Answer", "action_input": {"content": text}}
+            else:
+                action = {
+                    "action": "knowledge_research",
+                    "action_input": {
+                        "similarity_search_term": "benchmark question",
+                        "request_raw_question_input": "benchmark question",
+                    },
+                }
+            return "Action:\n```json\n" + json.dumps(action) + "\n```"
+        if "KNOWLEDGE CONTENT" in prompt:
+            references = SOURCE_PATTERN.findall(prompt)[:3]
+            return "```json" + json.dumps(
+                {
+                    "content": text,
+                    "references": references,
+                    "response_outcome": "true",
+                    "response_rating": "8",
+                }
+            ) + "```"
+        if "search term" in prompt.lower():
+            return " ".join(text.split()[:6])
+        return f"Title: {text.split()[0]}\nContent: {text}"
+
+    def _prompt(self, messages: List[BaseMessage]) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+    def _result(self, content: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.calls += 1
+        content = self.respond(self._prompt(messages))
+        time.sleep(self.latency_seconds)
+        return self._result(content)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[Any] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        self.calls += 1
+        content = self.respond(self._prompt(messages))
+        if not (self.streaming and run_manager):
+            await asyncio.sleep(self.latency_seconds)
+            return self._result(content)
+
+        # Spread the latency over the tokens, like a streamed completion
+        tokens = re.findall(r"\S+\s*|\s+", content)
+        for token in tokens:
+            await asyncio.sleep(self.latency_seconds / len(tokens))
+            await run_manager.on_llm_new_token(token)
+        return self._result(content)
+
+
+class FixtureSearch(DuckDuckGoSearch):
+    """Search tool serving the fixture corpus, ranked by word overlap."""
+
+    name: str = "FixtureSearch"
+    display_name: str = "FixtureSearch"
+    latency_seconds: float = 0.1
+    corpus: List[Dict] = []
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if not self.corpus:
+            self.corpus = build_corpus()
+
+    def _get_matching_docs(
+        self, search_term: str, num_results: int = 8, **kwargs
+    ) -> List[Document]:
+        time.sleep(self.latency_seconds)
+        terms = set(search_term.lower().split())
+        ranked = sorted(
+            self.corpus,
+            key=lambda doc: (-len(terms & doc["terms"]), doc["url"]),
+        )
+        return [
+            Document(
+                page_content=doc["snippet"],
+                metadata={"title": doc["title"], "url": doc["url"], "snippet": doc["snippet"]},
+            )
+            for doc in ranked[:num_results]
+        ]
@@ -0,0 +1,336 @@
+"""Offline benchmarks of the search and research pipeline.
+
+The chat model and the search backend are replaced by the deterministic fakes
+of `benchmarks.fakes`, so runs need no network and can be compared with each
+other. Each scenario is called `--iterations` times, `--concurrency` at a
+time, and the latency percentiles, throughput and peak RSS are reported.
+
+    python -m benchmarks.run --concurrency 8 --iterations 64 --output run.json
+    python -m benchmarks.run --compare run.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import functools
+import json
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.corpus import QUESTIONS
+from benchmarks.fakes import FakeChatModel, FixtureSearch
+
+from tutor_helper.chains.extract_and_combine import ExtractAndCombine
+from tutor_helper.chains.knowledge_research import KnowledgeResearch
+from tutor_helper.chains.search_tools_parallel import SearchToolsParallel
+from tutor_helper.common.cache import MemoryStore, TieredStore
+from tutor_helper.common.llms import LlmLoader
+from tutor_helper.tools.contracts import document_picker
+from tutor_helper.tools.search import parallel_search, search_for_chain
+from tutor_helper.tools.search.parallel_search import ParallelSearch
+
+import logging
+logger = logging.getLogger(__name__)
+
+SCENARIOS: Dict[str, Callable] = {}
+
+
+def scenario(name: str, kind: str = "sync"):
+    """Registers a scenario factory, it returns the call measured per iteration."""
+
+    def register(factory):
+        SCENARIOS[name] = (kind, factory)
+        return factory
+
+    return register
+
+
+def install_fakes(args) -> FixtureSearch:
+    """Routes every LLM and search call of the pipeline to the fakes."""
+    # With the production callbacks, so that their overhead is measured too
+    model = FakeChatModel(
+        latency_seconds=args.llm_latency,
+        output_tokens=args.output_tokens,
+        callbacks=LlmLoader.default_callbacks(),
+    )
+    streaming_model = FakeChatModel(
+        latency_seconds=args.llm_latency,
+        output_tokens=args.output_tokens,
+        streaming=True,
+        callbacks=LlmLoader.default_callbacks(),
+    )
+    LlmLoader.create_chat_llm = staticmethod(
+        lambda *a, **kwargs: streaming_model if kwargs.get("streaming") else model
+    )
+    LlmLoader.create_llm = staticmethod(lambda *a, **kwargs: model)
+
+    tool = FixtureSearch(latency_seconds=args.search_latency)
+    parallel_search.TOOLS_MAP = {"english": [lambda: tool]}
+    search_for_chain.KnowledgeResearch = functools.partial(KnowledgeResearch, tools=[tool])
+    if not args.with_cache:
+        # Measure the searches themselves, not the result cache
+        document_picker._search_cache = TieredStore(MemoryStore(max_entries=0))
+    return tool
+
+
+def question(i: int) -> str:
+    return QUESTIONS[i % len(QUESTIONS)]
+
+
+@scenario("parallel_search")
+def parallel_search_scenario(args, tool):
+    return lambda i: ParallelSearch().search(question(i))
+
+
+@scenario("search_tools_parallel")
+def search_tools_parallel_scenario(args, tool):
+    chain = SearchToolsParallel([tool])
+
+    def call(i):
+        raw_docs = chain.run(question(i), [], [])
+        return chain.transform(chain.chunk(raw_docs))
+
+    return call
+
+
+@scenario("extract_and_combine")
+def extract_and_combine_scenario(args, tool):
+    chain = SearchToolsParallel([tool])
+    docs = {
+        q: chain.transform(chain.chunk(chain.run(q, [], []))) for q in QUESTIONS
+    }
+
+    def call(i):
+        return ExtractAndCombine(LlmLoader.create_chat_llm()).run(
+            docs=docs[question(i)],
+            search_term=question(i),
+            description=question(i),
+            tools=[tool],
+        )
+
+    return call
+
+
+def _research_inputs(i: int) -> Dict[str, str]:
+    return {"description": question(i), "revised_question": question(i), "notes": ""}
+
+
+@scenario("knowledge_research")
+def knowledge_research_scenario(args, tool):
+    return lambda i: KnowledgeResearch(tools=[tool])(_research_inputs(i))
+
+
+@scenario("knowledge_research_async", kind="async")
+def knowledge_research_async_scenario(args, tool):
+    async def call(i):
+        return await KnowledgeResearch(tools=[tool]).ainvoke(_research_inputs(i))
+
+    return call
+
+
+@scenario("api_search", kind="async")
+def api_search_scenario(args, tool):
+    import httpx
+    from tutor_helper.use_cases.fastapi import app
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    async def call(i):
+        response = await client.post("/search/ts", json={"query_search": question(i)})
+        response.raise_for_status()
+        return response.json()
+
+    return call
+
+
+@scenario("api_websocket")
+def api_websocket_scenario(args, tool):
+    from fastapi.testclient import TestClient
+    from tutor_helper.use_cases.fastapi import app
+
+    local = threading.local()
+
+    def call(i):
+        # One client and one chat session per worker thread
+        if not hasattr(local, "client"):
+            local.client = TestClient(app)
+            local.session_id = f"bench-{threading.get_ident()}"
+        with local.client.websocket_connect(f"/ws/{local.session_id}") as websocket:
+            websocket.send_text(question(i))
+            while True:
+                event = websocket.receive_json()
+                if event["type"] == "final":
+                    return event["response"]
+
+    return call
+
+
+def run_sync(call: Callable, iterations: int, concurrency: int) -> Tuple[List[float], int, float]:
+    def timed(i):
+        started_at = time.perf_counter()
+        try:
+            call(i)
+            return time.perf_counter() - started_at, None
+        except Exception as e:
+            return time.perf_counter() - started_at, e
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(iterations)))
+    return _collect(results, time.perf_counter() - started_at)
+
+
+async def run_async(call: Callable, iterations: int, concurrency: int) -> Tuple[List[float], int, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i):
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                await call(i)
+                return time.perf_counter() - started_at, None
+            except Exception as e:
+                return time.perf_counter() - started_at, e
+
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(timed(i) for i in range(iterations)))
+    return _collect(results, time.perf_counter() - started_at)
+
+
+def _collect(results, wall_seconds: float) -> Tuple[List[float], int, float]:
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        logger.warning(f"[benchmarks] - {len(errors)} failed calls, first: {errors[0]!r}")
+    return [latency for latency, _ in results], len(errors), wall_seconds
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Linear interpolation between the closest ranks."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(name: str, args, tool) -> Dict[str, Any]:
+    kind, factory = SCENARIOS[name]
+    call = factory(args, tool)
+    # One warm-up call so that imports and first-use setup are not measured
+    if kind == "async":
+        asyncio.run(call(0))
+        latencies, errors, wall_seconds = asyncio.run(
+            run_async(call, args.iterations, args.concurrency)
+        )
+    else:
+        call(0)
+        latencies, errors, wall_seconds = run_sync(call, args.iterations, args.concurrency)
+
+    return {
+        "scenario": name,
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_rps": round(args.iterations / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "max": round(max(latencies, default=0.0) * 1000, 2),
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(current: Dict, previous: Dict, threshold: float) -> List[str]:
+    """Returns the scenarios whose p95 latency or throughput regressed by more than `threshold`."""
+    previous_results = {result["scenario"]: result for result in previous["results"]}
+    regressions = []
+    print(f"\n{'scenario':<28}{'p95 ms':>12}{'before':>12}{'rps':>10}{'before':>10}")
+    for result in current["results"]:
+        before = previous_results.get(result["scenario"])
+        if before is None:
+            continue
+        p95, p95_before = result["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        rps, rps_before = result["throughput_rps"], before["throughput_rps"]
+        print(f"{result['scenario']:<28}{p95:>12}{p95_before:>12}{rps:>10}{rps_before:>10}")
+        if (p95_before and p95 > p95_before * (1 + threshold)) or (
+            rps_before and rps < rps_before * (1 - threshold)
+        ):
+            regressions.append(result["scenario"])
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per LLM call")
+    parser.add_argument("--output-tokens", type=int, default=64, help="words per LLM response")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="seconds per search")
+    parser.add_argument("--with-cache", action="store_true", help="keep the search result cache")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed regression ratio")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    tool = install_fakes(args)
+
+    results = []
+    for name in args.scenarios:
+        result = run_scenario(name, args, tool)
+        results.append(result)
+        latency = result["latency_ms"]
+        print(
+            f"{name:<28} p50 {latency['p50']:>9} ms  p95 {latency['p95']:>9} ms  "
+            f"p99 {latency['p99']:>9} ms  {result['throughput_rps']:>8} rps  "
+            f"errors {result['errors']}"
+        )
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare", "fail_on_regression")
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            regressions = compare(report, json.load(previous), args.threshold)
+        if regressions:
+            print(f"\nRegressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
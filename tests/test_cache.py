@@ -0,0 +1,47 @@
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from tutor_helper.common.cache import LlmResponseCache, MemoryStore, SQLiteStore
+
+
+class TestStores:
+    def test_memory_store_is_bounded(self):
+        store = MemoryStore(max_entries=2, ttl_seconds=None)
+        for key in ("a", "b", "c"):
+            store.set(key, key)
+        assert store.get("a") is None
+        assert store.get("c") == "c"
+        assert store.stats()["evictions"] == 1
+
+    def test_memory_store_expires(self):
+        store = MemoryStore(max_entries=2, ttl_seconds=-1)
+        store.set("a", "a")
+        assert store.get("a") is None
+        assert store.stats()["expired"] == 1
+
+    def test_sqlite_store_persists(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        store = SQLiteStore(path=path, max_entries=2)
+        for key in ("a", "b", "c"):
+            store.set(key, key)
+        reopened = SQLiteStore(path=path, max_entries=2)
+        assert len(reopened) == 2
+        assert reopened.get("c") == "c"
+        assert reopened.get("a") is None
+
+
+class TestLlmResponseCache:
+    def _assert_second_call_is_cached(self, store):
+        llm_cache = LlmResponseCache(store)
+        llm = FakeListChatModel(responses=["first", "second"], cache=llm_cache)
+        assert llm.invoke("What is a singleton?").content == "first"
+        assert llm.invoke("What is a singleton?").content == "first"
+        assert llm.invoke("What is a factory?").content == "second"
+        stats = llm_cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+
+    def test_memory_backend(self):
+        self._assert_second_call_is_cached(MemoryStore())
+
+    def test_sqlite_backend(self, tmp_path):
+        self._assert_second_call_is_cached(SQLiteStore(path=str(tmp_path / "cache.sqlite")))
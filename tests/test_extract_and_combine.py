@@ -0,0 +1,135 @@
+from langchain.docstore.document import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tutor_helper.chains import extract_and_combine
+from tutor_helper.chains.extract_and_combine import ExtractAndCombine
+from tutor_helper.tools.search.search import DuckDuckGoSearch
+from tutor_helper.tools.utilities import tokens
+import asyncio
+import time
+import pytest
+
+try:
+    tokens.get_encoding()
+except Exception as e:  # the BPE file is downloaded on first use
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+SOURCES = [f"https://example.com/{i}" for i in range(6)]
+reduce_calls = []
+
+
+class TreeChatModel(FakeListChatModel):
+    responses: list = []
+
+    def _call(self, messages, *args, **kwargs):
+        prompt = messages[-1].content
+        if "KNOWLEDGE CONTENT" in prompt:
+            references = [source for source in SOURCES if source in prompt]
+            return (
+                '```json{"content": "combined", "references": ' + str(references).replace("'", '"')
+                + ', "response_outcome": "true", "response_rating": "8"}```'
+            )
+        if "combine extracted parts" in prompt:
+            reduce_calls.append(prompt)
+            return "Singletons restrict a class to one instance."
+        topic = prompt.split("Title: ")[1].split("\n")[0]
+        return " ".join(f"{topic} detail number {i} is explained in full." for i in range(12))
+
+
+def make_docs():
+    return [
+        Document(
+            page_content=f"Title: Topic {i}\nSome content",
+            metadata={
+                "source": source,
+                "id": source,
+                "title": f"Topic {i}",
+                "url": source,
+                "pulled_by": "DuckDuckGoSearch",
+                "visibility": "public",
+            },
+        )
+        for i, source in enumerate(SOURCES)
+    ]
+
+
+class TestTreeReduce:
+    @pytest.fixture(autouse=True)
+    def small_budget(self, monkeypatch):
+        monkeypatch.setattr(extract_and_combine, "RELEVANCE_PREFILTER", False)
+        monkeypatch.setattr(extract_and_combine, "COMBINE_MAX_SUMMARY_TOKENS", 200)
+        monkeypatch.setattr(ExtractAndCombine, "_token_limit", lambda self: 32000)
+        reduce_calls.clear()
+
+    def test_fitting_summaries_are_combined_once(self, monkeypatch):
+        monkeypatch.setattr(extract_and_combine, "COMBINE_MAX_SUMMARY_TOKENS", 0)
+        chain = ExtractAndCombine(TreeChatModel())
+        response = chain.run(make_docs(), "singleton", "singleton", [DuckDuckGoSearch()])
+
+        assert reduce_calls == []
+        assert len(response["references"]) == len(SOURCES)
+
+    def test_large_summaries_are_reduced_first(self):
+        chain = ExtractAndCombine(TreeChatModel())
+        response = chain.run(make_docs(), "singleton", "singleton", [DuckDuckGoSearch()])
+
+        assert len(reduce_calls) == 1
+        assert all(f"Topic {i} detail" in reduce_calls[0] for i in range(6))
+        assert [ref["source"] for ref in response["references"]] == SOURCES
+
+    def test_async_batches_follow_the_reduce_budget(self, monkeypatch):
+        monkeypatch.setattr(ExtractAndCombine, "_reduce_budget", lambda self, description: 300)
+        chain = ExtractAndCombine(TreeChatModel())
+        response = asyncio.run(
+            chain.arun(make_docs(), "singleton", "singleton", [DuckDuckGoSearch()], max_concurrency=2)
+        )
+
+        assert len(reduce_calls) > 1
+        assert sorted(ref["source"] for ref in response["references"]) == SOURCES
+
+
+class SlowSourceChatModel(TreeChatModel):
+    def _call(self, messages, *args, **kwargs):
+        if "Title: Topic 5" in messages[-1].content:
+            time.sleep(1)
+        return super()._call(messages, *args, **kwargs)
+
+
+class TestStreaming:
+    @pytest.fixture(autouse=True)
+    def no_prefilter(self, monkeypatch):
+        monkeypatch.setattr(extract_and_combine, "RELEVANCE_PREFILTER", False)
+        monkeypatch.setattr(ExtractAndCombine, "_token_limit", lambda self: 32000)
+
+    def test_deadline_drops_stragglers(self):
+        cancelled_before = extract_and_combine.EXTRACT_CANCELLED.value(reason="deadline")
+        chain = ExtractAndCombine(SlowSourceChatModel())
+
+        started_at = time.monotonic()
+        response = chain.run(
+            make_docs(), "singleton", "singleton", [DuckDuckGoSearch()], deadline_seconds=0.3
+        )
+        assert time.monotonic() - started_at < 0.9
+        assert [ref["source"] for ref in response["references"]] == SOURCES[:5]
+        # The straggler was already running in a scheduler worker, it is not cancelled
+        assert extract_and_combine.EXTRACT_CANCELLED.value(reason="deadline") == cancelled_before
+
+    def test_async_deadline_drops_stragglers(self):
+        chain = ExtractAndCombine(SlowSourceChatModel())
+        response = asyncio.run(
+            chain.arun(
+                make_docs(), "singleton", "singleton", [DuckDuckGoSearch()], deadline_seconds=0.3
+            )
+        )
+        assert [ref["source"] for ref in response["references"]] == SOURCES[:5]
+
+    def test_combine_starts_when_the_budget_fills(self, monkeypatch):
+        monkeypatch.setattr(extract_and_combine, "EXTRACT_STREAMING", True)
+        monkeypatch.setattr(extract_and_combine, "COMBINE_MAX_SUMMARY_TOKENS", 120)
+        cancelled_before = extract_and_combine.EXTRACT_CANCELLED.value(reason="budget")
+        chain = ExtractAndCombine(TreeChatModel())
+
+        response = asyncio.run(
+            chain.arun(make_docs(), "singleton", "singleton", [DuckDuckGoSearch()], max_concurrency=1)
+        )
+        assert len(response["references"]) == 1
+        assert extract_and_combine.EXTRACT_CANCELLED.value(reason="budget") == cancelled_before + 5
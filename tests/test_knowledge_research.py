@@ -0,0 +1,67 @@
+from langchain.docstore.document import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tutor_helper.chains.knowledge_research import KnowledgeResearch
+from tutor_helper.tools.search.search import DuckDuckGoSearch
+from tutor_helper.tools.utilities import tokens
+import asyncio
+import pytest
+
+try:
+    tokens.get_encoding()
+except Exception as e:  # the BPE file is downloaded on first use
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+COMBINE_RESPONSE = (
+    '```json{"content": "A singleton restricts a class to one instance.", '
+    '"references": ["https://example.com/1"], "response_outcome": "true", '
+    '"response_rating": "8"}```'
+)
+
+
+class FixtureSearch(DuckDuckGoSearch):
+    def _get_matching_docs(self, search_term, num_results=8, **kwargs):
+        return [
+            Document(
+                page_content=f"Snippet {i} about {search_term}",
+                metadata={"title": f"Title {i}", "url": f"https://example.com/{i}"},
+            )
+            for i in range(3)
+        ]
+
+
+class FixtureChatModel(FakeListChatModel):
+    responses: list = []
+
+    def _call(self, messages, *args, **kwargs):
+        if "KNOWLEDGE CONTENT" in messages[-1].content:
+            return COMBINE_RESPONSE
+        return "A singleton has a single instance."
+
+
+class TestKnowledgeResearch:
+    @classmethod
+    def setup_class(cls):
+        cls.inputs = {
+            "description": "singleton pattern",
+            "revised_question": "What is a singleton?",
+            "notes": "",
+        }
+
+    @pytest.fixture(autouse=True)
+    def fixture_llm(self, monkeypatch):
+        monkeypatch.setattr(
+            KnowledgeResearch, "_create_llm", lambda self: FixtureChatModel()
+        )
+
+    def test_call(self):
+        response = KnowledgeResearch(tools=[FixtureSearch()]).invoke(self.inputs)
+        assert response["content"] == "A singleton restricts a class to one instance."
+        assert len(response["references"]) == 3
+
+    def test_acall(self):
+        chain = KnowledgeResearch(tools=[FixtureSearch()], max_concurrency=2)
+        response = asyncio.run(chain.ainvoke(self.inputs))
+        assert response["content"] == "A singleton restricts a class to one instance."
+        assert [ref["source"] for ref in response["references"]] == [
+            f"https://example.com/{i}" for i in range(3)
+        ]
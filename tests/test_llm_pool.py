@@ -0,0 +1,83 @@
+from tutor_helper.common.llm_pool import LlmClientRegistry
+from tutor_helper.common import llm_pool
+from tutor_helper.callbacks.structured_log import StructuredLogCallbackHandler
+from tutor_helper.common.llms import LlmLoader
+import asyncio
+import pytest
+
+
+class TestLlmClientRegistry:
+    @classmethod
+    def setup_class(cls):
+        cls.registry = LlmClientRegistry(max_size=2)
+
+    def setup_method(self):
+        self.registry.clear()
+
+    def test_hits_and_misses(self):
+        first = self.registry.get_or_create("a", object)
+        assert self.registry.get_or_create("a", object) is first
+        stats = self.registry.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_registry_is_bounded(self):
+        for key in ("a", "b", "c"):
+            self.registry.get_or_create(key, object)
+        stats = self.registry.stats()
+        assert stats["clients"] == 2
+        assert stats["evictions"] == 1
+
+    def test_clear_closes_both_clients(self):
+        pool = self.registry.http_pool("https://example.openai.azure.com/")
+        self.registry.clear()
+        assert pool.client.is_closed
+        assert pool.async_client.is_closed
+
+    def test_aclose_closes_both_clients(self):
+        pool = self.registry.http_pool("https://example.openai.azure.com/")
+        asyncio.run(self.registry.aclose())
+        assert pool.client.is_closed
+        assert pool.async_client.is_closed
+        assert self.registry.stats()["http_pools"] == 0
+
+
+class TestLlmLoader:
+    @classmethod
+    def setup_class(cls):
+        cls.monkeypatch = pytest.MonkeyPatch()
+        cls.monkeypatch.setenv("OPENAI_API_TYPE", "azure")
+        # langchain rejects OPENAI_API_BASE next to azure_endpoint, the endpoint
+        # is read from AZURE_OPENAI_ENDPOINT instead
+        cls.monkeypatch.delenv("OPENAI_API_BASE", raising=False)
+        cls.monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com/")
+        cls.monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+        cls.monkeypatch.setattr(llm_pool, "_registry", LlmClientRegistry())
+
+    @classmethod
+    def teardown_class(cls):
+        cls.monkeypatch.undo()
+
+    def test_same_configuration_is_reused(self):
+        llm = LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO)
+        assert LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO) is llm
+        assert LlmLoader.client_stats()["hits"] >= 1
+
+    def test_clients_are_not_shared_between_handlers(self):
+        first, second = StructuredLogCallbackHandler(), StructuredLogCallbackHandler()
+        llm = LlmLoader.create_chat_llm(callbacks=[first])
+        assert LlmLoader.create_chat_llm(callbacks=[first]) is llm
+        other = LlmLoader.create_chat_llm(callbacks=[second])
+        assert other is not llm
+        assert other.callbacks == [second]
+
+    def test_endpoint_http_pool_is_shared(self):
+        chat = LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO, temperature=0)
+        other = LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO_LG)
+        completion = LlmLoader.create_llm()
+        assert chat is not other
+        http_clients = {
+            id(llm.client._client._client) for llm in (chat, other, completion)
+        }
+        assert len(http_clients) == 1
+        assert other.async_client._client._client is chat.async_client._client._client
@@ -0,0 +1,65 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import SystemMessage
+import pytest
+
+from tutor_helper.common.cache import MemoryStore, SQLiteStore
+from tutor_helper.memory.summary_window import StoredChatMessageHistory, SummaryWindowMemory
+from tutor_helper.tools.utilities import tokens
+
+LONG_ANSWER = "A singleton is a class with a single instance, shared by all its callers. " * 3
+
+
+@pytest.fixture
+def encoding():
+    try:
+        tokens.get_encoding()
+    except Exception:
+        pytest.skip("tiktoken encoding not available offline")
+
+
+def ask(memory, question, answer=LONG_ANSWER):
+    memory.save_context({"input": question}, {"output": {"content": answer}})
+
+
+class TestStoredChatMessageHistory:
+    def test_history_is_kept_in_the_store(self, tmp_path):
+        path = str(tmp_path / "memory.sqlite")
+        memory = SummaryWindowMemory.for_session("a", SQLiteStore(path=path, table="memory"))
+        ask(memory, "What is a singleton?", "One instance.")
+
+        # Another worker, or the same session created again
+        history = StoredChatMessageHistory("a", SQLiteStore(path=path, table="memory"))
+        assert [message.content for message in history.messages] == ["What is a singleton?", "One instance."]
+        assert StoredChatMessageHistory("b", SQLiteStore(path=path, table="memory")).messages == []
+
+    def test_idle_sessions_are_evicted(self):
+        store = MemoryStore(max_entries=10, ttl_seconds=-1)
+        ask(SummaryWindowMemory.for_session("a", store), "What is a singleton?")
+        assert StoredChatMessageHistory("a", store).messages == []
+
+
+class TestSummaryWindowMemory:
+    def test_old_messages_are_summarized(self, encoding):
+        llm = FakeListChatModel(responses=["The user asked about singletons."])
+        memory = SummaryWindowMemory.for_session(
+            "a", MemoryStore(), max_token_limit=80, llm=llm, return_messages=True
+        )
+        for question in ("What is a singleton?", "Why use one?", "When to avoid it?"):
+            ask(memory, question)
+        memory.wait_for_summary(timeout=5)
+
+        messages = memory.load_memory_variables({})["history"]
+        assert isinstance(messages[0], SystemMessage)
+        assert "The user asked about singletons." in messages[0].content
+        # Only the last exchange fits next to the summary
+        assert [message.content for message in messages[1:]] == ["When to avoid it?", LONG_ANSWER]
+        assert memory.chat_memory.load()["pending"] == []
+
+    def test_evicted_messages_are_dropped_without_summary(self, encoding):
+        memory = SummaryWindowMemory.for_session("a", MemoryStore(), max_token_limit=80, summarize=False)
+        for question in ("What is a singleton?", "Why use one?"):
+            ask(memory, question)
+
+        state = memory.chat_memory.load()
+        assert [message.content for message in state["messages"]] == ["Why use one?", LONG_ANSWER]
+        assert state["pending"] == [] and state["summary"] == ""
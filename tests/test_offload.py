@@ -0,0 +1,49 @@
+from tutor_helper.common.offload import OffloadPool, OffloadQueueFull
+import asyncio
+import contextvars
+import threading
+import time
+import pytest
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+class TestOffloadPool:
+    def setup_method(self):
+        self.pool = OffloadPool(max_workers=2, max_queue=1)
+
+    def teardown_method(self):
+        self.pool.shutdown(wait=True)
+
+    def test_run(self):
+        result = asyncio.run(self.pool.run(sum, [1, 2, 3]))
+        assert result == 6
+        stats = self.pool.stats()
+        assert stats["completed"] == 1
+        assert stats["in_flight"] == 0
+
+    def test_rejects_when_queue_is_full(self):
+        release = threading.Event()
+        futures = [self.pool.submit(release.wait) for _ in range(3)]
+        with pytest.raises(OffloadQueueFull):
+            self.pool.submit(release.wait)
+        deadline = time.monotonic() + 5
+        while self.pool.stats()["queue_depth"] != 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert self.pool.stats()["queue_depth"] == 1
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert self.pool.stats()["rejected"] == 1
+
+    def test_failures_are_counted(self):
+        with pytest.raises(ZeroDivisionError):
+            asyncio.run(self.pool.run(lambda: 1 / 0))
+        assert self.pool.stats()["failed"] == 1
+
+    def test_context_is_propagated(self):
+        async def main():
+            request_id.set("abc")
+            return await self.pool.run(request_id.get)
+
+        assert asyncio.run(main()) == "abc"
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from tutor_helper.output_parsers import agent_parser
+from tutor_helper.output_parsers.agent_parser import NewAgentOutputFixingParser, NewAgentOutputParser
+from tutor_helper.output_parsers.json import JSON_PARSES, JsonRepairer, parse_json_markdown, repair_json
+from tutor_helper.schema.agent import AgentAction, AgentFinish
+
+
+class TestJsonRepair:
+    @pytest.mark.parametrize(
+        "text, expected",
+        [
+            ('```json\n{"a": [1, 2,], "b": 3,}\n```', {"a": [1, 2], "b": 3}),
+            ('{"answer": "line one\nline two"}', {"answer": "line one\nline two"}),
+            ("{'a': True, 'b': None, 'c': 'it\\'s'}", {"a": True, "b": None, "c": "it's"}),
+            ('{"path": "C:\\Users"}', {"path": "C:\\Users"}),
+            ('Thought: search\n```json\n{"action": "Search", "action_input": {"q": "sing', {"action": "Search", "action_input": {"q": "sing"}}),
+            ('```json\n{"a": 1, "b"\n```', {"a": 1, "b": None}),
+            ('{"a": {"b": ', {"a": {"b": None}}),
+            ('{"a": "True"} and then {"b": 2}', {"a": "True"}),
+        ],
+    )
+    def test_repairs(self, text, expected):
+        assert json.loads(repair_json(text)) == expected
+        assert parse_json_markdown(text) == expected
+
+    def test_valid_json_is_not_rewritten(self):
+        valid_before = JSON_PARSES.value(outcome="valid")
+        assert parse_json_markdown('```json\n{"a": [1, {"b": "c"}]}\n```') == {"a": [1, {"b": "c"}]}
+        assert JSON_PARSES.value(outcome="valid") == valid_before + 1
+
+    def test_streamed_chunks(self):
+        repairer = JsonRepairer()
+        chunks = ['Sure:\n```json\n{"act', 'ion": "Final Answer", "action_', 'input": "done"}', "\n```"]
+        assert [repairer.feed(chunk) for chunk in chunks] == [False, False, True, True]
+        assert json.loads(repairer.close()) == {"action": "Final Answer", "action_input": "done"}
+        assert not repairer.repaired
+
+    def test_unrepairable_text_raises(self):
+        with pytest.raises(json.JSONDecodeError):
+            parse_json_markdown("no json here")
+
+
+class TestAgentOutputParser:
+    def test_action_with_python_literals(self):
+        action = NewAgentOutputParser().parse(
+            '```json\n{"action": "Search", "action_input": {"exact": True, "q": "True story"},}\n```'
+        )
+        assert isinstance(action, AgentAction)
+        assert action.tool_input == {"exact": True, "q": "True story"}
+
+    def test_text_without_code_block_is_final(self):
+        finish = NewAgentOutputParser().parse("A singleton has one instance.")
+        assert isinstance(finish, AgentFinish)
+        assert finish.return_values["output"] == "A singleton has one instance."
+
+    def test_fixing_parser_only_calls_the_llm_when_local_repair_fails(self, monkeypatch):
+        fixed = []
+
+        class FakeFixingParser:
+            def parse(self, text):
+                fixed.append(text)
+                return AgentFinish({"output": "fixed"}, text)
+
+        monkeypatch.setattr(NewAgentOutputFixingParser, "_fixing_parser", staticmethod(FakeFixingParser))
+        parser = NewAgentOutputFixingParser()
+        fallbacks_before = agent_parser.AGENT_OUTPUT_PARSES.value(outcome="llm_fallback")
+
+        finish = parser.parse('```json\n{"action": "Final Answer", "action_input": "ok",\n```')
+        assert finish.return_values["output"] == "ok"
+        assert fixed == []
+
+        assert parser.parse("```json\n[]\n```").return_values["output"] == "fixed"
+        assert len(fixed) == 1
+        assert agent_parser.AGENT_OUTPUT_PARSES.value(outcome="llm_fallback") == fallbacks_before + 1
@@ -0,0 +1,66 @@
+import pytest
+
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.packing import dedupe_passages, pack, water_fill
+from tutor_helper.tools.utilities.utils import num_tokens_from_string
+
+try:
+    tokens.get_encoding()
+    encoding_error = None
+except Exception as e:  # the BPE file is downloaded on first use
+    encoding_error = e
+
+requires_encoding = pytest.mark.skipif(
+    encoding_error is not None, reason=f"tiktoken encoding unavailable: {encoding_error}"
+)
+
+PARAGRAPH = "The singleton pattern restricts the instantiation of a class to one single instance."
+
+
+def sentences(topic, count):
+    return " ".join(f"Sentence {i} explains how {topic} works in practice." for i in range(count))
+
+
+class TestWaterFill:
+    def test_short_texts_are_kept_whole(self):
+        assert water_fill([10, 500, 500], [1, 1, 1], 310) == [10, 150, 150]
+
+    def test_budget_follows_weights(self):
+        assert water_fill([500, 500], [3, 1], 400) == [300, 100]
+
+    def test_everything_fits(self):
+        assert water_fill([10, 20, 0], [1, 1, 1], 1000) == [10, 20, 0]
+
+
+class TestDedupe:
+    def test_repeated_passages_are_kept_once(self):
+        texts = [
+            f"{PARAGRAPH}\n\nFirst text only.",
+            f"{PARAGRAPH.lower()}\n\nSecond text has its own passage about factories and builders.",
+            PARAGRAPH,
+        ]
+        deduped = dedupe_passages(texts)
+        assert deduped[0] == texts[0]
+        assert deduped[1] == "Second text has its own passage about factories and builders."
+        assert deduped[2] == ""
+
+
+@requires_encoding
+class TestPack:
+    def test_fits_the_budget(self):
+        texts = [sentences("caching", 100), sentences("queues", 100), "short note"]
+        packed = pack(texts, 300, weights=[0.9, 0.3, 0.1], overheads=[5, 5, 5])
+
+        assert [i for i, _ in packed] == [0, 1, 2]
+        assert packed[2][1] == "short note"
+        assert sum(num_tokens_from_string(text) + 5 for _, text in packed) <= 300
+        assert num_tokens_from_string(packed[0][1]) > num_tokens_from_string(packed[1][1])
+
+    def test_least_relevant_texts_are_dropped_when_starved(self):
+        texts = [sentences(topic, 50) for topic in ("caching", "queues", "threads")]
+        packed = pack(texts, 200, weights=[0.2, 1.0, 0.5], min_tokens=48)
+        assert [i for i, _ in packed] == [1, 2]
+
+    def test_duplicates_are_returned_empty(self):
+        packed = pack([PARAGRAPH, "Another text", PARAGRAPH], 500, weights=[0.5, 0.1, 1.0])
+        assert packed == [(2, PARAGRAPH), (1, "Another text"), (0, "")]
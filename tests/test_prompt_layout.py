@@ -0,0 +1,88 @@
+from os.path import commonprefix
+
+from langchain.agents.structured_chat.base import StructuredChatAgent
+from langchain.prompts import MessagesPlaceholder
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import Tool
+import pytest
+
+from tutor_helper.agents.tutor_assistant import prompt_chat_agent
+from tutor_helper.chains.extract_and_combine import ExtractAndCombine
+from tutor_helper.prompts.layout import static_first, static_prefix
+from tutor_helper.prompts.templates.chat_agent import ChatResponseWithKB
+
+TOOLS = [
+    Tool(name="knowledge_research", func=lambda query: query, description="Researches a question on the web"),
+    Tool(name="SearchTerm", func=lambda query: query, description="Generates a search term"),
+]
+
+
+def rendered(messages):
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+
+def agent_prompts():
+    default = StructuredChatAgent.create_prompt(
+        TOOLS,
+        prefix=prompt_chat_agent.PREFIX,
+        suffix=prompt_chat_agent.SUFFIX,
+        human_message_template=prompt_chat_agent.HUMAN_MESSAGE_TEMPLATE,
+        format_instructions=prompt_chat_agent.FORMAT_INSTRUCTIONS,
+        input_variables=prompt_chat_agent.INPUT_VARIABLES,
+    )
+    session = StructuredChatAgent.create_prompt(
+        TOOLS,
+        prefix=ChatResponseWithKB.SYSTEM_MESSAGE_WITH_TOOLS_PREFIX,
+        human_message_template=ChatResponseWithKB.HUMAN_MESSAGE_TEMPLATE,
+        format_instructions=ChatResponseWithKB.FORMAT_INSTRUCTIONS_FOR_AGENT,
+        input_variables=ChatResponseWithKB.INPUT_VARIABLES,
+        memory_prompts=[MessagesPlaceholder(variable_name="chat_history")],
+    )
+    return default, session
+
+
+class TestStaticFirst:
+    def test_static_sections_hold_no_variables(self):
+        assert static_first(["Be concise. {{x}}", "{format}"], ["{question}"], partials=["format"]) == (
+            "Be concise. {{x}}\n{format}\n{question}"
+        )
+        with pytest.raises(ValueError):
+            static_first(["Answer {question}"], ["{context}"])
+
+
+class TestPrefixStability:
+    def test_extract_calls_share_their_prefix(self):
+        chain = ExtractAndCombine(FakeListChatModel(responses=["a"]))
+        prompts = [
+            chain.extract_prompt.format(question="What is a singleton?", context=context)
+            for context in ("A singleton has one instance.", "Factories create objects.")
+        ]
+        prefix = static_prefix(chain.extract_prompt)
+        assert "DOCUMENT NOT RELATED" in prefix
+        # Only the document differs between the extract calls of a request
+        assert commonprefix(prompts).endswith("What is a singleton?```\n=========\n```")
+
+    def test_combine_prompt_starts_with_the_instructions(self):
+        chain = ExtractAndCombine(FakeListChatModel(responses=["a"]))
+        prefix = static_prefix(chain.chat_prompt)
+        assert chain.format_instructions in prefix
+        assert "KNOWLEDGE CONTENT:\n```" in prefix
+        assert "Only use content provided by the tools." in static_prefix(chain.combine_prompt)
+
+    @pytest.mark.parametrize("index", [0, 1])
+    def test_agent_prompts_keep_the_tools_and_format_first(self, index):
+        prompt = agent_prompts()[index]
+        prefix = static_prefix(prompt)
+        assert "knowledge_research: Researches a question on the web" in prefix
+        assert "Provide only ONE action per $JSON_BLOB" in prefix
+
+        requests = [
+            ([], "What is a singleton?", ""),
+            ([HumanMessage(content="Hi"), AIMessage(content="Hello!")], "What is a factory?", "Thought: search"),
+        ]
+        renders = [
+            rendered(prompt.format_messages(chat_history=history, input=question, agent_scratchpad=scratchpad))
+            for history, question, scratchpad in requests
+        ]
+        assert len(commonprefix(renders)) >= len(prefix)
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from tutor_helper.chains.extract_and_combine import ExtractAndCombine
+from tutor_helper.prompts.registry import get_chain, get_chat_prompt, get_prompt, render_static
+
+FORMAT_INSTRUCTIONS = '```json\n{\n\t"content": string\n}\n```'
+
+
+class TestPromptRegistry:
+    def test_prompts_are_compiled_once(self):
+        assert get_prompt("Q: {question}") is get_prompt("Q: {question}")
+        assert get_prompt("Q: {question}") is not get_prompt("Question: {question}")
+
+    def test_static_values_are_rendered_in(self):
+        assert render_static("{a} {b}", a="{x}") == "{{x}} {b}"
+
+        prompt = get_chat_prompt("System", "{question}\n{format_instructions}", format_instructions=FORMAT_INSTRUCTIONS)
+        assert prompt.input_variables == ["question"]
+        assert prompt.format_messages(question="Why?")[1].content == "Why?\n" + FORMAT_INSTRUCTIONS
+
+    def test_chains_are_shared_per_client_and_prompt(self):
+        llm, other_llm = FakeListChatModel(responses=["a"]), FakeListChatModel(responses=["b"])
+        prompt = get_prompt("Q: {question}")
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            chains = set(map(id, executor.map(lambda _: get_chain(llm, prompt), range(32))))
+        assert len(chains) == 1
+        assert get_chain(other_llm, prompt) is not get_chain(llm, prompt)
+        assert get_chain(llm, prompt, verbose=True) is not get_chain(llm, prompt)
+        assert get_chain(llm, prompt).invoke({"question": "Why?"})["text"] == "a"
+
+    def test_combine_messages_match_the_templates(self):
+        chain = ExtractAndCombine(FakeListChatModel(responses=["a"]))
+        system, human = chain._combine_messages("What is a singleton?", "One instance.")
+        assert system.content.startswith("Your task is to return the following knowledge content")
+        assert "One instance." in human.content and "What is a singleton?" in human.content
+        assert chain.format_instructions in human.content
+        assert ExtractAndCombine(FakeListChatModel(responses=["a"])).chat_prompt is chain.chat_prompt
@@ -0,0 +1,56 @@
+from langchain.docstore.document import Document
+
+from tutor_helper.tools.utilities.relevance import bm25_scores, prefilter_docs, tokenize
+
+
+def make_docs(contents):
+    return [
+        Document(page_content=content, metadata={"source": f"doc-{i}"})
+        for i, content in enumerate(contents)
+    ]
+
+
+class TestBm25:
+    def test_tokenize_drops_stopwords(self):
+        assert tokenize("What is the Singleton pattern?") == ["singleton", "pattern"]
+
+    def test_matching_texts_score_higher(self):
+        scores = bm25_scores(
+            "singleton pattern",
+            [
+                "The singleton pattern restricts a class to a single instance.",
+                "A queue is a first in first out data structure.",
+                "Patterns such as the factory create objects.",
+            ],
+        )
+        assert scores[0] > scores[2] >= scores[1] == 0
+
+    def test_rare_terms_weigh_more(self):
+        scores = bm25_scores(
+            "python singleton",
+            ["python singleton", "python lists", "python dicts", "python sets"],
+        )
+        assert scores[0] == scores.max()
+        assert scores[1] == scores[2] == scores[3]
+
+
+class TestPrefilter:
+    def test_drops_unrelated_chunks(self):
+        docs = make_docs(
+            ["singleton class instance"] + [f"unrelated text number {i}" for i in range(5)]
+        )
+        kept = prefilter_docs(docs, "what is a singleton class", top_k=10, min_score_ratio=0.2, min_keep=1)
+        assert [doc.metadata["source"] for doc in kept] == ["doc-0"]
+        assert kept[0].metadata["relevance_score"] == 1.0
+
+    def test_top_k_and_min_keep(self):
+        docs = make_docs([f"singleton {'instance ' * i}" for i in range(6)])
+        assert len(prefilter_docs(docs, "singleton instance", top_k=2, min_keep=1)) == 2
+
+        docs = make_docs([f"unrelated {i}" for i in range(6)])
+        assert len(prefilter_docs(docs, "singleton", top_k=2, min_keep=3)) == 3
+
+    def test_docs_added_by_id_are_kept(self):
+        docs = make_docs(["singleton", "unrelated", "unrelated too"])
+        kept = prefilter_docs(docs, "singleton", top_k=1, min_keep=0, keep_sources=["doc-2"])
+        assert sorted(doc.metadata["source"] for doc in kept) == ["doc-0", "doc-2"]
@@ -0,0 +1,222 @@
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+
+from tutor_helper.common import llm_pool, llms, retry
+from tutor_helper.common.llm_pool import LlmClientRegistry
+from tutor_helper.common.llms import LlmLoader
+
+
+def api_error(status_code, headers=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def completion(content):
+    return {
+        "id": "test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-35-turbo",
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+        ],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def mock_transport(llm, handler):
+    """Sends the requests of `llm` to `handler` instead of the network."""
+    for name in ("client", "async_client"):
+        resource = getattr(llm, name)
+        client_class = httpx.Client if name == "client" else httpx.AsyncClient
+        http_client = client_class(transport=httpx.MockTransport(handler))
+        setattr(llm, name, type(resource)(resource._client.with_options(http_client=http_client)))
+    return llm
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(retry, "LLM_RETRY_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(retry, "_breakers", {})
+
+
+class TestRetryAfter:
+    def test_headers(self):
+        assert retry.retry_after_seconds(api_error(429, {"retry-after-ms": "250"})) == 0.25
+        assert retry.retry_after_seconds(api_error(429, {"retry-after": "3"})) == 3.0
+        assert retry.retry_after_seconds(api_error(429)) is None
+
+    def test_reasons(self):
+        assert retry.retry_reason(api_error(429)) == "status_429"
+        assert retry.retry_reason(api_error(400)) is None
+        assert retry.retry_reason(httpx.ConnectError("down")) == "connection"
+
+
+class TestCallWithRetry:
+    def test_retries_until_success(self):
+        outcomes = [api_error(429, {"retry-after-ms": "1"}), api_error(503)]
+        retries_before = retry.RETRIES.value(deployment="d1", reason="status_429")
+
+        def call():
+            if outcomes:
+                raise outcomes.pop(0)
+            return "ok"
+
+        assert retry.call_with_retry("d1", call, max_retries=2) == "ok"
+        assert retry.RETRIES.value(deployment="d1", reason="status_429") == retries_before + 1
+
+    def test_client_errors_are_not_retried(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            raise api_error(400)
+
+        with pytest.raises(openai.APIStatusError):
+            retry.call_with_retry("d2", call, max_retries=3, fallback=lambda: "fallback")
+        assert len(calls) == 1
+
+    def test_breaker_opens_and_falls_back(self, monkeypatch):
+        monkeypatch.setattr(retry, "_breakers", {"d3": retry.CircuitBreaker("d3", failure_threshold=2)})
+        calls = []
+
+        def call():
+            calls.append(1)
+            raise api_error(500)
+
+        assert retry.call_with_retry("d3", call, max_retries=5, fallback=lambda: "fallback") == "fallback"
+        assert len(calls) == 2
+        assert retry.retry_stats()["d3"]["state"] == "open"
+
+        # Open: fails fast, without calling the deployment
+        assert retry.call_with_retry("d3", call, max_retries=5, fallback=lambda: "fallback") == "fallback"
+        assert len(calls) == 2
+        with pytest.raises(retry.CircuitOpenError):
+            retry.call_with_retry("d3", call, max_retries=5)
+
+    def test_async_retries(self):
+        outcomes = [httpx.ReadTimeout("slow")]
+
+        async def call():
+            if outcomes:
+                raise outcomes.pop(0)
+            return "ok"
+
+        assert asyncio.run(retry.acall_with_retry("d4", call, max_retries=1)) == "ok"
+
+
+    def test_cancelled_trial_releases_the_breaker(self, monkeypatch):
+        breaker = retry.CircuitBreaker("d5", failure_threshold=1, cooldown_seconds=0.01)
+        monkeypatch.setattr(retry, "_breakers", {"d5": breaker})
+
+        def fail():
+            raise api_error(500)
+
+        with pytest.raises(openai.APIStatusError):
+            retry.call_with_retry("d5", fail, max_retries=0)
+        assert breaker.state == "open"
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def ok():
+            return "ok"
+
+        async def cancel_trial_then_call():
+            await asyncio.sleep(0.02)
+            trial = asyncio.ensure_future(retry.acall_with_retry("d5", hang, max_retries=0))
+            await asyncio.sleep(0)
+            assert breaker.trial_in_flight
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+            return await retry.acall_with_retry("d5", ok, max_retries=0)
+
+        assert asyncio.run(cancel_trial_then_call()) == "ok"
+        assert breaker.state == "closed" and not breaker.trial_in_flight
+
+
+class BrokenStream(httpx.AsyncByteStream):
+    """Server sent events cut by a connection error after the first chunk."""
+
+    async def __aiter__(self):
+        chunk = completion("")
+        chunk.update(object="chat.completion.chunk", usage=None)
+        chunk["choices"] = [{"index": 0, "delta": {"role": "assistant", "content": "Hello"}, "finish_reason": None}]
+        yield f"data: {json.dumps(chunk)}\n\n".encode()
+        raise httpx.ReadError("connection lost")
+
+
+class TestLlmLoaderRetries:
+    @classmethod
+    def setup_class(cls):
+        cls.monkeypatch = pytest.MonkeyPatch()
+        cls.monkeypatch.setenv("OPENAI_API_TYPE", "azure")
+        cls.monkeypatch.delenv("OPENAI_API_BASE", raising=False)
+        cls.monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com/")
+        cls.monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+        cls.monkeypatch.setattr(llm_pool, "_registry", LlmClientRegistry())
+        cls.monkeypatch.setattr(llms, "LLM_FALLBACK_DEPLOYMENTS", {"primary": "sibling"})
+
+    @classmethod
+    def teardown_class(cls):
+        cls.monkeypatch.undo()
+
+    def test_sibling_deployments(self):
+        assert LlmLoader.sibling_deployment("gpt-35-turbo") == "gpt-35-turbo-16k"
+        assert LlmLoader.sibling_deployment("gpt-4") is None
+        assert LlmLoader.sibling_deployment("primary") == "sibling"
+
+    def test_invalid_fallback_deployments_are_ignored(self, monkeypatch):
+        monkeypatch.setenv("LLM_FALLBACK_DEPLOYMENTS", "{gpt-35-turbo: gpt-4}")
+        assert llms._fallback_deployments() == {}
+        monkeypatch.setenv("LLM_FALLBACK_DEPLOYMENTS", '["gpt-4"]')
+        assert llms._fallback_deployments() == {}
+
+    def test_rate_limited_call_is_retried(self):
+        responses = [
+            httpx.Response(429, headers={"retry-after-ms": "1"}, json={"error": {"message": "quota"}}),
+            httpx.Response(200, json=completion("answer")),
+        ]
+        llm = LlmLoader.create_chat_llm(model="gpt-35-turbo", cache=False)
+        mock_transport(llm, lambda request: responses.pop(0))
+
+        assert llm.invoke("question").content == "answer"
+        assert responses == []
+
+    def test_failing_deployment_falls_back_to_sibling(self):
+        sibling = LlmLoader.create_chat_llm(model="sibling", cache=False, fallback=False)
+        mock_transport(sibling, lambda request: httpx.Response(200, json=completion("from sibling")))
+        llm = LlmLoader.create_chat_llm(model="primary", cache=False)
+        mock_transport(llm, lambda request: httpx.Response(500, json={"error": {"message": "down"}}))
+
+        fallbacks_before = retry.FALLBACKS.value(source="primary", target="sibling")
+        assert asyncio.run(llm.ainvoke("question")).content == "from sibling"
+        assert retry.FALLBACKS.value(source="primary", target="sibling") == fallbacks_before + 1
+
+    def test_stream_is_not_restarted_after_its_first_chunk(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=BrokenStream())
+
+        llm = LlmLoader.create_chat_llm(model="primary", cache=False, streaming=True)
+        mock_transport(llm, handler)
+        tokens = []
+
+        class Tokens(BaseCallbackHandler):
+            def on_llm_new_token(self, token, **kwargs):
+                tokens.append(token)
+
+        with pytest.raises(httpx.ReadError):
+            asyncio.run(llm.ainvoke("question", config={"callbacks": [Tokens()]}))
+        # Neither retried nor sent to the sibling, the token was not repeated
+        assert len(requests) == 1
+        assert tokens == ["Hello"]
@@ -0,0 +1,43 @@
+import pytest
+
+from tutor_helper.agents.tutor_assistant import router
+from tutor_helper.agents.tutor_assistant.router import route_message
+
+
+class TestRouteMessage:
+    @pytest.mark.parametrize(
+        "message",
+        [
+            "What is the singleton pattern?",
+            "how do I reverse a linked list in python",
+            "Explain gradient descent",
+            "binary search tree balancing",
+        ],
+    )
+    def test_research_questions_take_the_fast_path(self, message):
+        assert route_message(message).fast_path
+
+    @pytest.mark.parametrize(
+        "message, reason",
+        [
+            ("Thanks!", "small_talk"),
+            ("hello", "small_talk"),
+            ("What is a heap? And how does heapsort use it?", "multi_step"),
+            ("Summarize the water cycle and then write a quiz", "multi_step"),
+            ("word " * 80, "long"),
+        ],
+    )
+    def test_conversational_turns_go_to_the_agent(self, message, reason):
+        assert route_message(message) == (False, reason)
+
+    def test_follow_ups_need_the_history(self):
+        message = "Can you explain that with an example?"
+        assert route_message(message).fast_path
+        assert route_message(message, history=["What is recursion?", "Recursion is..."]) == (
+            False,
+            "follow_up",
+        )
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(router, "FAST_PATH_ENABLED", False)
+        assert route_message("What is the singleton pattern?") == (False, "disabled")
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from tutor_helper.common import scheduler as scheduler_module
+from tutor_helper.common.scheduler import LlmScheduler, estimate_tokens, report_usage
+from tutor_helper.tools.utilities import tokens
+
+
+class TestLlmScheduler:
+    def test_global_in_flight_limit(self):
+        scheduler = LlmScheduler(max_in_flight=2)
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def call():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+        futures = [scheduler.submit(call, resource="gpt") for _ in range(8)]
+        for future in futures:
+            future.result(timeout=5)
+        assert peak == 2
+        assert scheduler.stats()["in_flight"] == 0
+
+    def test_requests_are_served_round_robin(self):
+        scheduler = LlmScheduler(max_in_flight=1)
+        order = []
+        blocker = threading.Event()
+
+        # Hold the only slot while both requests queue their calls
+        first = scheduler.submit(blocker.wait, resource="gpt", request_key="busy")
+        futures = [
+            scheduler.submit(order.append, f"a{i}", resource="gpt", request_key="a")
+            for i in range(3)
+        ] + [
+            scheduler.submit(order.append, f"b{i}", resource="gpt", request_key="b")
+            for i in range(3)
+        ]
+        blocker.set()
+        for future in [first] + futures:
+            future.result(timeout=5)
+        assert order == ["a0", "b0", "a1", "b1", "a2", "b2"]
+
+    def test_cancelled_calls_never_run(self):
+        scheduler = LlmScheduler(max_in_flight=1)
+        blocker = threading.Event()
+        calls = []
+
+        first = scheduler.submit(blocker.wait, resource="gpt")
+        queued = scheduler.submit(calls.append, "queued", resource="gpt")
+        assert queued.cancel()
+        blocker.set()
+        first.result(timeout=5)
+        scheduler.submit(calls.append, "next", resource="gpt").result(timeout=5)
+
+        assert calls == ["next"]
+        assert scheduler.stats()["in_flight"] == 0
+        assert scheduler.stats()["queued"] == 0
+
+    def test_requests_per_minute_budget(self):
+        # 600 a minute refills one request every 0.1 seconds
+        scheduler = LlmScheduler(max_in_flight=4, budgets={"gpt": {"rpm": 600}})
+        scheduler._resource("gpt").requests.level = 1
+
+        started_at = time.monotonic()
+        futures = [scheduler.submit(time.monotonic, resource="gpt") for _ in range(3)]
+        starts = sorted(future.result(timeout=5) - started_at for future in futures)
+        assert starts[0] < 0.05
+        assert starts[2] >= 0.18
+        assert scheduler.stats()["resources"]["gpt"]["delayed"] == 2
+
+    def test_token_usage_is_settled_on_release(self):
+        scheduler = LlmScheduler(budgets={"gpt": {"tpm": 1000}})
+        with scheduler.slot("gpt", tokens=100):
+            report_usage(400)
+        assert scheduler._resource("gpt").tokens.level == pytest.approx(600, abs=5)
+
+    def test_estimate_uses_token_counts(self, monkeypatch):
+        monkeypatch.setattr(tokens, "count_tokens_batch", lambda texts: [3 for _ in texts])
+        expected = 6 + scheduler_module.SCHEDULER_COMPLETION_TOKENS
+        assert estimate_tokens("first prompt", "second prompt") == expected
+
+    def test_errors_release_the_slot(self):
+        scheduler = LlmScheduler(max_in_flight=1)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            scheduler.submit(fail, resource="gpt").result(timeout=5)
+        assert scheduler.submit(lambda: "ok", resource="gpt").result(timeout=5) == "ok"
+
+    def test_cancelled_waiters_are_skipped(self):
+        scheduler = LlmScheduler(max_in_flight=1)
+
+        async def main():
+            async with scheduler.aslot("gpt"):
+                waiter = asyncio.create_task(scheduler.aslot("gpt").__aenter__())
+                await asyncio.sleep(0.01)
+                waiter.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await waiter
+            async with scheduler.aslot("gpt"):
+                return scheduler.stats()
+
+        stats = asyncio.run(main())
+        assert stats["in_flight"] == 1
+        assert stats["queued"] == 0
+
+    def test_waiter_cancelled_while_granted_from_a_thread(self, monkeypatch):
+        scheduler = LlmScheduler(max_in_flight=1)
+        holder = scheduler.acquire("gpt").future.result(timeout=5)
+        in_gap, cancelled = threading.Event(), threading.Event()
+
+        class GatedHistogram:
+            # Called between marking the grant running and resolving it
+            def observe(self, value, **labels):
+                in_gap.set()
+                cancelled.wait(timeout=5)
+
+        monkeypatch.setattr(scheduler_module, "WAIT_SECONDS", GatedHistogram())
+
+        async def main():
+            waiter = asyncio.create_task(scheduler.aslot("gpt").__aenter__())
+            await asyncio.sleep(0.01)
+            releasing = threading.Thread(target=scheduler.release, args=(holder,))
+            releasing.start()
+            await asyncio.to_thread(in_gap.wait, 5)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            cancelled.set()
+            await asyncio.to_thread(releasing.join, 5)
+
+        asyncio.run(main())
+        assert scheduler.stats()["in_flight"] == 0
+        assert scheduler.acquire("gpt").future.result(timeout=5)
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from langchain.docstore.document import Document
+import pytest
+
+from tutor_helper.common.cache import MemoryStore, SQLiteStore, TieredStore
+from tutor_helper.common.single_flight import SingleFlight
+from tutor_helper.tools.contracts import document_picker
+from tutor_helper.tools.search.search import DuckDuckGoSearch
+
+
+class CountingSearch(DuckDuckGoSearch):
+    def _get_matching_docs(self, search_term, num_results=8, **kwargs):
+        CountingSearch.calls += 1
+        time.sleep(0.05)
+        return [
+            Document(
+                page_content=f"Snippet {i} about {search_term}",
+                metadata={"title": f"Title {i}", "url": f"https://example.com/{i}"},
+            )
+            for i in range(num_results)
+        ]
+
+
+class TestSearchCache:
+    def setup_method(self):
+        CountingSearch.calls = 0
+        self.monkeypatch = pytest.MonkeyPatch()
+        self.monkeypatch.setattr(
+            document_picker, "_search_cache", TieredStore(MemoryStore(max_entries=8))
+        )
+        self.monkeypatch.setattr(document_picker, "_search_flight", SingleFlight("search"))
+
+    def teardown_method(self):
+        self.monkeypatch.undo()
+
+    def test_normalized_queries_share_an_entry(self):
+        tool = CountingSearch()
+        tool.get_matching_docs("Singleton Pattern", 3)
+        docs = tool.get_matching_docs("singleton pattern", 3)
+        assert len(docs) == 3
+        assert CountingSearch.calls == 1
+        tool.get_matching_docs("singleton pattern", 4)
+        assert CountingSearch.calls == 2
+
+    def test_cached_docs_are_copies(self):
+        tool = CountingSearch()
+        tool.get_matching_docs("singleton", 1)[0].metadata["title"] = "changed"
+        assert tool.get_matching_docs("singleton", 1)[0].metadata["title"] == "Title 0"
+
+    def test_concurrent_searches_are_coalesced(self):
+        tool = CountingSearch()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: tool.from_description("factory"), range(4)))
+        assert CountingSearch.calls == 1
+        assert all(result == results[0] for result in results)
+        assert document_picker._search_flight.stats()["shared"] == 3
+
+    def test_disk_tier(self, tmp_path):
+        disk = SQLiteStore(path=str(tmp_path / "search.sqlite"), table="search_cache")
+        store = TieredStore(MemoryStore(), disk)
+        store.set("key", [{"title": "Title"}])
+        store.memory.clear()
+        assert store.get("key") == [{"title": "Title"}]
+        assert len(store.memory) == 1
@@ -0,0 +1,100 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from tutor_helper.agents.tutor_assistant.session import SessionRegistry
+from tutor_helper.common.cache import MemoryStore
+from tutor_helper.common.llms import LlmLoader
+from tutor_helper.memory import summary_window
+import asyncio
+import pytest
+
+FINAL_ANSWER = '```json{"action": "Final Answer", "action_input": {"content": "Hello!"}}```'
+
+
+class TestSessionRegistry:
+    @pytest.fixture(autouse=True)
+    def fake_llm(self, monkeypatch):
+        monkeypatch.setattr(
+            LlmLoader,
+            "create_chat_llm",
+            lambda *args, **kwargs: FakeListChatModel(responses=[FINAL_ANSWER]),
+        )
+        monkeypatch.setattr(summary_window, "_store", MemoryStore())
+
+    def test_session_is_reused(self):
+        registry = SessionRegistry()
+        session = registry.get("a")
+        assert registry.get("a") is session
+        assert registry.get("b").agent is not session.agent
+        assert registry.get("b").agent.agent.llm_chain.llm is session.agent.agent.llm_chain.llm
+
+    def test_memory_is_kept_across_messages(self):
+        session = SessionRegistry().get("a")
+
+        async def ask(question):
+            async with session.lock:
+                return await session.agent.arun(input=question)
+
+        assert asyncio.run(ask("Hi")) == {"content": "Hello!"}
+        asyncio.run(ask("Hi again"))
+        messages = session.memory.chat_memory.messages
+        assert [message.content for message in messages] == [
+            "Hi",
+            "Hello!",
+            "Hi again",
+            "Hello!",
+        ]
+
+    def test_research_questions_skip_the_agent(self, monkeypatch):
+        session = SessionRegistry().get("a")
+        research_inputs = []
+
+        async def research(inputs, callbacks=None):
+            research_inputs.append(inputs)
+            return {"content": "A singleton has one instance.", "references": [], "response_rating": "8"}
+
+        monkeypatch.setattr(session, "research_tool", type("Tool", (), {"arun": staticmethod(research)}))
+
+        async def ask(question):
+            async with session.lock:
+                return await session.arun(question)
+
+        assert asyncio.run(ask("What is a singleton?")) == {
+            "content": "A singleton has one instance.",
+            "references": [],
+        }
+        assert research_inputs == [
+            {"similarity_search_term": "What is a singleton?", "request_raw_question_input": "What is a singleton?"}
+        ]
+        # Small talk still goes to the agent, which sees the research turn in its history
+        assert asyncio.run(ask("Thanks!")) == {"content": "Hello!"}
+        assert [message.content for message in session.memory.chat_memory.messages] == [
+            "What is a singleton?",
+            "A singleton has one instance.",
+            "Thanks!",
+            "Hello!",
+        ]
+
+    def test_idle_sessions_are_evicted(self):
+        registry = SessionRegistry(idle_timeout_seconds=10)
+        session = registry.get("a")
+        assert registry.evict_idle(now=session.last_used_at + 5) == 0
+        assert registry.evict_idle(now=session.last_used_at + 11) == 1
+        assert len(registry) == 0
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        registry = SessionRegistry(max_sessions=2)
+        registry.get("a")
+        registry.get("b")
+        registry.get("a")
+        registry.get("c")
+        assert registry.stats()["evicted_capacity"] == 1
+        assert registry.get("a") is not None
+        assert registry.stats()["created"] == 3
+
+    def test_history_outlives_the_session(self):
+        registry = SessionRegistry(idle_timeout_seconds=10)
+        session = registry.get("a")
+        session.memory.save_context({"input": "Hi"}, {"output": {"content": "Hello!"}})
+        registry.evict_idle(now=session.last_used_at + 11)
+
+        assert registry.get("a") is not session
+        assert [message.content for message in registry.get("a").memory.chat_memory.messages] == ["Hi", "Hello!"]
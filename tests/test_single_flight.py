@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+import pytest
+
+from tutor_helper.common.single_flight import SingleFlight
+from tutor_helper.tools.search import search_for_chain
+
+
+class SlowResearch:
+    calls = 0
+
+    def __call__(self, inputs):
+        SlowResearch.calls += 1
+        time.sleep(0.05)
+        return {"content": f"About {inputs['description']}", "references": []}
+
+    async def ainvoke(self, inputs, config=None):
+        SlowResearch.calls += 1
+        await asyncio.sleep(0.05)
+        return {"content": f"About {inputs['description']}", "references": []}
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+
+        def slow():
+            time.sleep(0.05)
+            return object()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: flight.do("key", slow), range(4)))
+        assert all(result is results[0] for result in results)
+        stats = flight.stats()
+        assert stats["executions"] == 1
+        assert stats["shared"] == 3
+        assert stats["in_flight"] == 0
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError("search failed")
+
+        async def run():
+            return await asyncio.gather(
+                flight.ado("key", failing), flight.ado("key", failing), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.stats()["executions"] == 1
+
+
+class TestKnowledgeResearchCoalescing:
+    def setup_method(self):
+        SlowResearch.calls = 0
+        self.monkeypatch = pytest.MonkeyPatch()
+        self.monkeypatch.setattr(search_for_chain, "KnowledgeResearch", SlowResearch)
+        self.monkeypatch.setattr(
+            search_for_chain, "research_flight", SingleFlight("knowledge_research")
+        )
+
+    def teardown_method(self):
+        self.monkeypatch.undo()
+
+    def test_identical_questions_are_researched_once(self):
+        async def run():
+            return await asyncio.gather(
+                search_for_chain.aknowledge_research("Singleton pattern", "What is a singleton?"),
+                search_for_chain.aknowledge_research("singleton pattern", "What is a singleton?"),
+                search_for_chain.aknowledge_research("factory pattern", "What is a factory?"),
+            )
+
+        first, second, other = asyncio.run(run())
+        assert SlowResearch.calls == 2
+        assert first == second
+        assert first is not second
+        assert search_for_chain.research_flight.stats()["shared"] == 1
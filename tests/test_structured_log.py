@@ -0,0 +1,88 @@
+from langchain_core.language_models.fake import FakeListLLM
+import json
+import logging
+
+import pytest
+
+from tutor_helper.callbacks.structured_log import LogEventWriter, StructuredLogCallbackHandler
+from tutor_helper.common import telemetry
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class FailingLLM(FakeListLLM):
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        raise RuntimeError("deployment unavailable")
+
+
+@pytest.fixture
+def output():
+    return ListHandler()
+
+
+def make_writer(output, level="INFO", max_queue_size=100):
+    return LogEventWriter(output, level=level, max_queue_size=max_queue_size, name="tests.llm_events")
+
+
+def events(writer, output):
+    writer.stop()
+    return [json.loads(line) for line in output.lines]
+
+
+class TestStructuredLogCallbackHandler:
+    def test_summary_has_no_prompt_bodies(self, output):
+        writer = make_writer(output)
+        llm = FakeListLLM(responses=["an answer"], callbacks=[StructuredLogCallbackHandler(writer=writer)])
+        llm.invoke("a secret prompt")
+
+        start, end = events(writer, output)
+        assert (start["event"], end["event"]) == ("llm_start", "llm_end")
+        assert start["prompt_chars"] == len("a secret prompt")
+        assert "a secret prompt" not in json.dumps(start)
+        assert end["response_chars"] == len("an answer")
+
+    def test_bodies_are_truncated_per_level(self, output, monkeypatch):
+        monkeypatch.setattr("tutor_helper.callbacks.structured_log.LLM_LOG_TRUNCATE_INFO", 10)
+        monkeypatch.setattr("tutor_helper.callbacks.structured_log.LLM_LOG_TRUNCATE_DEBUG", 20)
+        prompt = "x" * 50
+
+        writer = make_writer(output, level="INFO")
+        handler = StructuredLogCallbackHandler(verbosity="prompts", writer=writer)
+        FakeListLLM(responses=["ok"], callbacks=[handler]).invoke(prompt)
+        assert events(writer, output)[0]["prompts"] == ["x" * 10 + "... [40 chars truncated]"]
+
+        output.lines.clear()
+        writer = make_writer(output, level="DEBUG")
+        handler = StructuredLogCallbackHandler(verbosity="prompts", writer=writer)
+        FakeListLLM(responses=["ok"], callbacks=[handler]).invoke(prompt)
+        assert events(writer, output)[0]["prompts"] == ["x" * 20 + "... [30 chars truncated]"]
+
+    def test_sampling_keeps_whole_traces_and_all_errors(self, output):
+        writer = make_writer(output)
+        handler = StructuredLogCallbackHandler(sample_rate=0.0, writer=writer)
+        with telemetry.span("research") as research:
+            FakeListLLM(responses=["ok"], callbacks=[handler]).invoke("prompt")
+            with pytest.raises(RuntimeError):
+                FailingLLM(responses=["ok"], callbacks=[handler]).invoke("prompt")
+
+        (error,) = events(writer, output)
+        assert error["event"] == "llm_error"
+        assert error["level"] == "WARNING"
+        assert error["trace_id"] == research.trace_id
+        assert error["error_type"] == "RuntimeError"
+
+    def test_full_queue_drops_instead_of_blocking(self, output):
+        writer = make_writer(output, max_queue_size=1)
+        writer.listener.stop()
+        handler = StructuredLogCallbackHandler(writer=writer)
+        for _ in range(3):
+            FakeListLLM(responses=["ok"], callbacks=[handler]).invoke("prompt")
+        assert writer.stats()["enqueued"] == 1
+        assert writer.stats()["dropped"] == 5
@@ -0,0 +1,92 @@
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import asyncio
+
+from tutor_helper.callbacks.metrics import MetricsCallbackHandler
+from tutor_helper.common import telemetry
+from tutor_helper.common.cache import LlmResponseCache, MemoryStore
+
+
+class UsageChatModel(FakeListChatModel):
+    """Reports token usage like the OpenAI chat models do."""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.responses[0]))],
+            llm_output={"token_usage": {"prompt_tokens": 12, "completion_tokens": 5}},
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self._generate(messages, stop=stop, **kwargs)
+
+
+def find_spans(name, trace_id):
+    return [
+        span
+        for span in telemetry.recent_spans()
+        if span["name"] == name and span["trace_id"] == trace_id
+    ]
+
+
+class TestSpans:
+    def test_counters_roll_up_to_the_parent(self):
+        with telemetry.span("research") as parent:
+            with telemetry.span("extract"):
+                telemetry.add_to_span(prompt_tokens=3, retries=1)
+            with telemetry.span("extract"):
+                telemetry.add_to_span(prompt_tokens=4)
+        assert parent.counters == {"prompt_tokens": 7, "retries": 1}
+        assert [span["parent_span_id"] for span in find_spans("extract", parent.trace_id)] == [
+            parent.span_id,
+            parent.span_id,
+        ]
+
+    def test_errors_are_recorded(self):
+        errors_before = telemetry.STAGE_ERRORS.value(stage="failing")
+        try:
+            with telemetry.span("failing"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        assert telemetry.STAGE_ERRORS.value(stage="failing") == errors_before + 1
+
+    def test_prometheus_exposition(self):
+        with telemetry.span('quoted "stage"'):
+            pass
+        text = telemetry.get_metrics_registry().render()
+        assert "# TYPE tutor_helper_stage_duration_seconds histogram" in text
+        assert 'stage="quoted \\"stage\\"",le="+Inf"' in text
+
+
+class TestMetricsCallbackHandler:
+    def test_llm_calls_are_spans_of_their_stage(self):
+        llm = UsageChatModel(responses=["answer"], callbacks=[MetricsCallbackHandler()])
+
+        async def extract_all():
+            async def extract(i):
+                with telemetry.span("extract"):
+                    return await llm.ainvoke(f"document {i}")
+
+            with telemetry.span("research") as research:
+                await asyncio.gather(*(extract(i) for i in range(3)))
+            return research
+
+        research = asyncio.run(extract_all())
+        assert research.counters["llm_calls"] == 3
+        assert research.counters["prompt_tokens"] == 36
+        assert research.counters["completion_tokens"] == 15
+        assert len(find_spans("llm", research.trace_id)) == 3
+
+    def test_cache_hits_are_counted(self):
+        llm = UsageChatModel(
+            responses=["answer"],
+            callbacks=[MetricsCallbackHandler()],
+            cache=LlmResponseCache(MemoryStore()),
+        )
+        with telemetry.span("combine") as combine:
+            llm.invoke("same prompt")
+            llm.invoke("same prompt")
+        assert combine.counters["cache_hits"] == 1
+        assert combine.counters["cache_misses"] == 1
+        assert combine.counters["prompt_tokens"] == 12
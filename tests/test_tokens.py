@@ -0,0 +1,59 @@
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.utils import (
+    num_tokens_from_string,
+    num_tokens_from_strings,
+    split_by_token,
+)
+import pytest
+
+try:
+    tokens.get_encoding()
+except Exception as e:  # the BPE file is downloaded on first use
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+
+class TestTokenCounter:
+    @classmethod
+    def setup_class(cls):
+        cls.counter = tokens.TokenCounter(max_size=3)
+
+    def setup_method(self):
+        self.counter.clear()
+
+    def test_encoder_is_shared(self):
+        assert tokens.get_encoding() is tokens.get_encoding()
+        assert tokens.encoding_for_model("gpt-35-turbo") is tokens.get_encoding()
+
+    def test_count_matches_encoder(self):
+        text = "What is a singleton in object oriented programming?"
+        assert self.counter.count(text) == len(tokens.get_encoding().encode(text))
+
+    def test_batch_counts_are_cached(self):
+        texts = ["alpha beta", "gamma", "alpha beta"]
+        first = self.counter.count_batch(texts)
+        second = self.counter.count_batch(texts)
+        assert first == second
+        info = self.counter.cache_info()
+        assert info["misses"] == 3
+        assert info["hits"] == 3
+
+    def test_cache_is_bounded(self):
+        self.counter.count_batch(["a", "b", "c", "d", "e"])
+        assert self.counter.cache_info()["size"] == 3
+
+    def test_special_tokens_are_counted_as_text(self):
+        assert self.counter.count("<|endoftext|>") > 1
+
+
+class TestUtils:
+    def test_num_tokens_from_strings(self):
+        texts = ["one", "two three", ""]
+        assert num_tokens_from_strings(texts) == [
+            num_tokens_from_string(text) for text in texts
+        ]
+
+    def test_split_by_token(self):
+        text = "word " * 100
+        chunks = split_by_token(text, chunk_length=30)
+        assert all(num_tokens_from_string(chunk) <= 30 for chunk in chunks)
+        assert "".join(chunks) == text
@@ -0,0 +1,63 @@
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.trimming import (
+    split_to_token_chunks,
+    trim_batch,
+    trim_to_token_count,
+)
+from tutor_helper.tools.utilities.utils import num_tokens_from_string
+import pytest
+
+try:
+    tokens.get_encoding()
+except Exception as e:  # the BPE file is downloaded on first use
+    pytest.skip(f"tiktoken encoding unavailable: {e}", allow_module_level=True)
+
+LONG_TEXT = " ".join(
+    f"Sentence number {i} explains how the singleton pattern restricts instantiation."
+    for i in range(200)
+)
+# No whitespace to snap to and characters spread over several tokens
+CJK_TEXT = "単一のインスタンスだけを生成するデザインパターン。" * 40
+
+
+class TestTrimming:
+    def test_short_text_is_unchanged(self):
+        assert trim_to_token_count("short text", 50) == "short text"
+
+    def test_trimmed_text_fits_budget(self):
+        for budget in (1, 5, 17, 250):
+            trimmed = trim_to_token_count(LONG_TEXT, budget)
+            assert num_tokens_from_string(trimmed) <= budget
+
+    def test_trim_snaps_to_word_boundary(self):
+        trimmed = trim_to_token_count(LONG_TEXT, 40)
+        assert trimmed.endswith("...")
+        last_word = trimmed[:-3].split()[-1]
+        assert last_word in LONG_TEXT.split()
+
+    def test_trim_batch(self):
+        texts = ["short", LONG_TEXT, "also short"]
+        trimmed = trim_batch(texts, 30)
+        assert trimmed[0] == "short"
+        assert trimmed[2] == "also short"
+        assert num_tokens_from_string(trimmed[1]) <= 30
+
+    def test_split_to_token_chunks(self):
+        chunks = split_to_token_chunks(LONG_TEXT, 100)
+        assert len(chunks) > 1
+        assert "".join(chunks) == LONG_TEXT
+        assert all(num_tokens_from_string(chunk) <= 100 for chunk in chunks)
+        # chunks end on a sentence boundary
+        assert all(chunk.endswith(".") for chunk in chunks[:-1])
+
+    def test_split_does_not_break_characters(self):
+        chunks = split_to_token_chunks(CJK_TEXT, 7, boundary=None)
+        assert len(chunks) > 1
+        assert "".join(chunks) == CJK_TEXT
+        assert all("\ufffd" not in chunk for chunk in chunks)
+
+    def test_trim_does_not_break_characters(self):
+        for budget in (1, 5, 17):
+            trimmed = trim_to_token_count(CJK_TEXT, budget, boundary=None)
+            assert CJK_TEXT.startswith(trimmed[:-3])
+            assert num_tokens_from_string(trimmed) <= budget
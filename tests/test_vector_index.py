@@ -0,0 +1,113 @@
+from typing import List
+
+from langchain.schema import Document
+import numpy as np
+import pytest
+
+from tutor_helper import tools
+from tutor_helper.common.vector_index import FlatVectorIndex
+from tutor_helper.tools.contracts.document_picker import DocumentPickerTool
+from tutor_helper.tools.search import local_index
+from tutor_helper.tools.search.local_index import LocalIndexSearch, hashing_embeddings
+
+
+def unit(*values):
+    return np.array(values, dtype=np.float32)
+
+
+class TestFlatVectorIndex:
+    def test_search_orders_by_similarity(self):
+        index = FlatVectorIndex(dim=2, embedder="test")
+        index.add(["a", "b", "c"], np.stack([unit(1, 0), unit(0, 1), unit(1, 1)]), [{"id": i} for i in "abc"])
+
+        hits = index.search(unit(1, 0.1), k=2)
+        assert [payload["id"] for _, payload in hits] == ["a", "c"]
+        assert hits[0][0] > hits[1][0]
+        assert len(index.search(unit(1, 0), k=10)) == 3
+
+    def test_same_id_is_replaced(self):
+        index = FlatVectorIndex(dim=2, embedder="test")
+        index.add(["a", "a"], np.stack([unit(1, 0), unit(0, 1)]), [{"v": 1}, {"v": 2}])
+        index.add(["a"], np.stack([unit(0, 1)]), [{"v": 3}])
+
+        assert len(index) == 1
+        assert index.search(unit(0, 1), k=1) == [(pytest.approx(1.0), {"v": 3})]
+
+    def test_oldest_documents_are_evicted(self):
+        index = FlatVectorIndex(dim=2, embedder="test", max_docs=2)
+        for doc_id in "abc":
+            index.add([doc_id], np.stack([unit(1, 0)]), [{"id": doc_id}])
+
+        assert len(index) == 2
+        assert sorted(payload["id"] for _, payload in index.search(unit(1, 0), k=3)) == ["b", "c"]
+
+    def test_save_and_load(self, tmp_path):
+        index = FlatVectorIndex(dim=2, embedder="test", path=str(tmp_path))
+        index.add(["a", "b"], np.stack([unit(1, 0), unit(0, 1)]), [{"id": "a"}, {"id": "b"}])
+        index.save()
+
+        loaded = FlatVectorIndex(dim=2, embedder="test", path=str(tmp_path))
+        assert loaded.search(unit(0, 1), k=1)[0][1] == {"id": "b"}
+        # Built with another embedder, not loaded
+        assert len(FlatVectorIndex(dim=2, embedder="other", path=str(tmp_path))) == 0
+
+
+live_searches: List[str] = []
+
+
+class FakeLiveSearch(DocumentPickerTool):
+    name: str = "FakeLiveSearch"
+    description: str = "Fake web search"
+
+    def _get_matching_docs(self, search_term: str, num_results: int = 8, **kwargs) -> List[Document]:
+        live_searches.append(search_term)
+        return [
+            Document(
+                page_content=f"{search_term} explained, part {i}",
+                metadata={"title": f"{search_term} {i}", "url": f"https://example.com/{search_term}/{i}"},
+            )
+            for i in range(num_results)
+        ]
+
+    def _transform_docs(self, docs: List) -> List:
+        return [
+            {"tool": self.name, "title": doc.metadata["title"], "description": doc.page_content, "url": doc.metadata["url"]}
+            for doc in docs
+        ]
+
+
+class TestLocalIndexSearch:
+    @pytest.fixture(autouse=True)
+    def index(self, monkeypatch):
+        index = FlatVectorIndex(dim=local_index.HASHING_DIM, embedder="test")
+        monkeypatch.setattr(local_index, "_index", index)
+        monkeypatch.setattr(local_index, "LOCAL_INDEX_ENABLED", True)
+        monkeypatch.setitem(tools.TOOL_MAPPING, "FakeLiveSearch", FakeLiveSearch)
+        live_searches.clear()
+        return index
+
+    def test_hashing_embeddings_match_shared_words(self):
+        query, close, far = hashing_embeddings(
+            ["singleton pattern", "the singleton design pattern", "queues and stacks"]
+        )
+        assert query @ close > query @ far
+
+    def test_reads_through_to_the_live_tools(self, index):
+        tool = LocalIndexSearch(live_tools=["FakeLiveSearch"], min_hits=2, min_score=0.3)
+
+        docs = tool._get_matching_docs("singleton", num_results=3)
+        assert len(docs) == 3 and live_searches == ["singleton"]
+        local_index._index_writer.submit(lambda: None).result()
+        assert len(index) == 3
+
+        docs = tool._get_matching_docs("singleton", num_results=3)
+        assert live_searches == ["singleton"]
+        assert all(doc.metadata["url"].startswith("https://example.com/singleton/") for doc in docs)
+        assert docs[0].metadata["score"] >= 0.3
+
+    def test_own_results_are_not_indexed(self, index):
+        local_index.index_documents(
+            [{"tool": "LocalIndexSearch", "title": "t", "description": "d", "url": "u"}], wait=True
+        )
+        local_index.index_documents([{"tool": "FakeLiveSearch", "title": "t", "description": "d"}], wait=True)
+        assert len(index) == 0
@@ -0,0 +1,121 @@
+from fastapi.testclient import TestClient
+from langchain_core.language_models.chat_models import agenerate_from_stream
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+import asyncio
+import pytest
+
+from tutor_helper.agents.tutor_assistant import router
+from tutor_helper.agents.tutor_assistant import session as session_module
+from tutor_helper.callbacks.websocket_stream import FinalAnswerStream
+from tutor_helper.common.llms import LlmLoader
+from tutor_helper.use_cases import fastapi as fastapi_module
+from tutor_helper.use_cases.fastapi import app
+
+FINAL_ANSWER = (
+    '```json{"action": "Final Answer", "action_input": '
+    '{"content": "A \\"singleton\\"\\nhas one instance \\u2713"}}```'
+)
+
+
+class StreamingFakeChatModel(FakeListChatModel):
+    """Streams like AzureChatOpenAI(streaming=True) does."""
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def stream():
+            async for chunk in self._astream(messages, stop=stop, **kwargs):
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+        return await agenerate_from_stream(stream())
+
+
+class TestFinalAnswerStream:
+    def test_content_is_decoded_across_tokens(self):
+        stream = FinalAnswerStream()
+        # Split escape sequences over several tokens
+        tokens = [FINAL_ANSWER[i : i + 3] for i in range(0, len(FINAL_ANSWER), 3)]
+        content = "".join(stream.feed(token) for token in tokens)
+        assert content == 'A "singleton"\nhas one instance ✓'
+
+    def test_tool_actions_are_not_streamed(self):
+        stream = FinalAnswerStream()
+        blob = '{"action": "knowledge_research", "action_input": {"content": "x"}}'
+        assert stream.feed(blob) == ""
+
+
+class TestWebsocketStreaming:
+    @pytest.fixture(autouse=True)
+    def fake_llm(self, monkeypatch):
+        monkeypatch.setattr(
+            LlmLoader,
+            "create_chat_llm",
+            lambda *args, **kwargs: StreamingFakeChatModel(responses=[FINAL_ANSWER]),
+        )
+        monkeypatch.setattr(session_module, "_registry", session_module.SessionRegistry())
+        # The final answer tokens are those of the agent
+        monkeypatch.setattr(router, "FAST_PATH_ENABLED", False)
+
+    def test_tokens_are_sent_before_the_final_response(self):
+        client = TestClient(app)
+        with client.websocket_connect("/ws/stream") as websocket:
+            websocket.send_text("What is a singleton?")
+            events = []
+            while True:
+                event = websocket.receive_json()
+                events.append(event)
+                if event["type"] == "final":
+                    break
+
+        tokens = [event["content"] for event in events if event["type"] == "token"]
+        assert len(tokens) > 1
+        assert "".join(tokens) == events[-1]["response"]["content"]
+
+
+class ClosedWebSocket:
+    """A socket closed by the client without a disconnect message."""
+
+    async def accept(self):
+        pass
+
+    async def receive_text(self):
+        return "What is a singleton?"
+
+    async def send_json(self, data):
+        raise RuntimeError("Cannot call send once a close message has been sent.")
+
+
+class SlowSession:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.cancelled = False
+
+    def touch(self):
+        pass
+
+    async def arun(self, question, callbacks):
+        callbacks[0].on_tool_start({"name": "knowledge_research"}, question, run_id=None)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class TestWebsocketTask:
+    def test_failed_send_cancels_the_research(self, monkeypatch):
+        session = SlowSession()
+
+        class Registry:
+            def get(self, session_id):
+                return session
+
+        monkeypatch.setattr(fastapi_module, "get_session_registry", Registry)
+
+        async def main():
+            with pytest.raises(RuntimeError):
+                await fastapi_module.websocket_endpoint(ClosedWebSocket(), "closed")
+            # Let the cancellation reach the task, before asyncio.run cancels it anyway
+            await asyncio.sleep(0)
+            return session.cancelled
+
+        assert asyncio.run(main())
@@ -11,10 +11,10 @@ from langchain.agents.agent_types import AgentType
 from langchain.agents import initialize_agent
 
 from langchain.base_language import BaseLanguageModel
+from langchain.memory.chat_memory import BaseChatMemory
 from langchain.agents.agent_toolkits.base import BaseToolkit
 
 from tutor_helper.common.llms import LlmLoader
-from tutor_helper.callbacks.stdout_all import StdOutAllCallbackHandler
 from tutor_helper.agents.tutor_assistant.toolkit import (
     SimplifiedToolkit,
 )
@@ -24,6 +24,7 @@ from tutor_helper.agents.tutor_assistant.prompt_chat_agent import (
     PREFIX,
     SUFFIX,
     FORMAT_INSTRUCTIONS,
+    HUMAN_MESSAGE_TEMPLATE,
     INPUT_VARIABLES,
 )
 
@@ -32,8 +33,7 @@ from tutor_helper.output_parsers.agent_parser import NewAgentOutputFixingParser
 # from langchain.chains.conversation.memory import ConversationSummaryBufferMemory
 from langchain.prompts import MessagesPlaceholder
 
-from langchain.memory import ConversationBufferMemory
-# from tutor_helper.memory.buffer import ConversationBufferMemory
+from tutor_helper.memory.summary_window import SummaryWindowMemory
 
 import uuid
 
@@ -43,10 +43,8 @@ def chat_agent(
     toolkit: BaseToolkit = None,  # <- Toolkit for KB Drafter, will be loading default if not provided
     format_instructions: str = FORMAT_INSTRUCTIONS,  # <- Default format instructions for the comms with LLM (langchain)
     verbose: bool = False,
-    memory: Optional[ConversationBufferMemory] = ConversationBufferMemory(
-        memory_key="chat_history", return_messages=True
-    ),
-    callbacks: Callbacks = [StdOutAllCallbackHandler()],
+    memory: Optional[BaseChatMemory] = None,  # <- a new bounded memory is created if not provided
+    callbacks: Callbacks = None,  # <- LlmLoader's default callbacks if not provided
     llm_kwargs: Optional[dict] = None,
     agent_executor_kwargs: Optional[Dict[str, Any]] = None,
     agent_kwargs: Optional[Dict[str, Any]] = None,
@@ -65,12 +63,18 @@ def chat_agent(
     tools = toolkit_set.get_tools()
     output_parser = NewAgentOutputFixingParser()
 
+    # The memory belongs to the executor, it loads and saves the chat history
+    if memory is None:
+        memory = SummaryWindowMemory.for_session(
+            str(uuid.uuid4()), memory_key="chat_history", return_messages=True, llm=llm
+        )
+
     if not agent_kwargs:
         agent_kwargs = {
-            "memory": memory,
             "prefix": PREFIX,
             "format_instructions": FORMAT_INSTRUCTIONS,
             "suffix": SUFFIX,
+            "human_message_template": HUMAN_MESSAGE_TEMPLATE,
             "output_parser": output_parser,
             "input_variables": INPUT_VARIABLES,
             "return_intermediate_steps": True,
@@ -83,7 +87,7 @@ def chat_agent(
         callbacks=callbacks,
         verbose=verbose,
         agent_kwargs=agent_kwargs,
-        **(agent_executor_kwargs or {}),
+        **{"memory": memory, **(agent_executor_kwargs or {})},
     )
 
     return executor
@@ -5,11 +5,6 @@ and recognizing if a new request has been made. You have the ability to consider
 accurate responses. However, you are programmed to maintain honesty and integrity; you should not fabricate or make up answers.
 You are expected to provide responses based on the knowledge you have been trained on.
 
-User:
-```
-{input}
-```
-
 Here the list of available tools:
 """
 
@@ -56,12 +51,20 @@ SUFFIX = """
 Remember to assess the user's input in the context of previous messages, identify if it's a new request, consider necessary tools for an accurate response, and always ensure your responses are based on factual information.
 Begin! Reminder to ALWAYS respond with a valid json blob of a single action.
 Respond directly if appropriate. Format is Action:```$JSON_BLOB```then Observation:.
+"""
 
-Chat History:
+# The variable content goes in the human message, after the static system message
+# holding the tools and the format instructions, see `tutor_helper.prompts.layout`
+HUMAN_MESSAGE_TEMPLATE = """Chat History:
 ```
 {chat_history}
 ```
 
+User:
+```
+{input}
+```
+
 Thought:
 
 {agent_scratchpad}
@@ -0,0 +1,89 @@
+"""Local routing of the chat messages, before any LLM call.
+
+Most messages are plain research questions: the agent would spend one LLM
+call deciding to call `knowledge_research` and another one copying its answer
+into a "Final Answer". `route_message` recognizes them with rules, so that
+they go to the research tool directly. Greetings, follow-ups on the
+conversation and multi-step requests still go to the agent.
+"""
+import os
+import re
+from typing import List, NamedTuple
+
+from tutor_helper.common.telemetry import get_metrics_registry
+
+import logging
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+# Longer messages are rarely a single question
+FAST_PATH_MAX_WORDS = int(os.getenv("FAST_PATH_MAX_WORDS", "60"))
+
+ROUTES = get_metrics_registry().counter(
+    "tutor_helper_message_routes_total",
+    "Chat messages routed to the research fast path or to the agent, by reason.",
+)
+
+WORD_PATTERN = re.compile(r"[\w'-]+")
+SMALL_TALK = re.compile(
+    r"^(hi|hello|hey|thanks?( you)?|thank you( very much| so much)?|ok(ay)?|cool|great|nice|"
+    r"yes|no|yep|nope|sure|bye|goodbye|good (morning|afternoon|evening|night)|how are you)\b[\s!.?]*$",
+    re.IGNORECASE,
+)
+# The message builds on the previous turns
+FOLLOW_UP = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|above|previous|previously|earlier|again|"
+    r"you said|your (answer|response|last)|more detail|elaborate|go on|continue|instead|"
+    r"the (first|second|third|last) one)\b",
+    re.IGNORECASE,
+)
+# The message asks for an action on text, or for several steps
+AGENT_REQUEST = re.compile(
+    r"\b(translate|rewrite|rephrase|summari[sz]e|shorten|format|draft|write (me )?(an? )?"
+    r"(email|letter|essay|poem)|and then|after that|step by step plan|first .* then)\b",
+    re.IGNORECASE,
+)
+# How a research question usually starts
+QUESTION_START = re.compile(
+    r"^(what|what's|whats|which|who|whom|whose|when|where|why|how|is|are|was|were|can|could|"
+    r"does|do|did|should|would|will|explain|describe|define|tell me about|give me|list|show me|"
+    r"compare|difference between)\b",
+    re.IGNORECASE,
+)
+
+
+class Route(NamedTuple):
+    fast_path: bool
+    reason: str
+
+
+def route_message(message: str, history: List = ()) -> Route:
+    """Whether `message` is a plain research question, for the fast path.
+
+    Args:
+        message (str): the message of the user
+        history (List): the previous messages of the conversation
+
+    Returns:
+        Route: the decision and its reason
+    """
+    text = message.strip()
+    words = WORD_PATTERN.findall(text)
+    if not FAST_PATH_ENABLED:
+        route = Route(False, "disabled")
+    elif not words or SMALL_TALK.match(text):
+        route = Route(False, "small_talk")
+    elif len(words) > FAST_PATH_MAX_WORDS:
+        route = Route(False, "long")
+    elif text.count("?") > 1 or AGENT_REQUEST.search(text):
+        route = Route(False, "multi_step")
+    elif history and FOLLOW_UP.search(text):
+        route = Route(False, "follow_up")
+    elif QUESTION_START.match(text) or text.endswith("?"):
+        route = Route(True, "question")
+    else:
+        # Neither a question nor a chat message, the agent would search it too
+        route = Route(True, "search_query")
+    ROUTES.inc(route="research" if route.fast_path else "agent", reason=route.reason)
+    logger.info(f"[router] - Routed to {'research' if route.fast_path else 'agent'}: {route.reason}")
+    return route
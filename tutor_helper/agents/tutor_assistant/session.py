@@ -0,0 +1,207 @@
+"""Chat agent sessions kept across the messages of a websocket session.
+
+The agent executor and its memory are built once per `session_id` and reused
+for every message, while the toolkit, the chat model and the output parser
+are shared by all sessions of the process. Sessions idle for longer than
+`idle_timeout_seconds` are evicted, as are the least recently used ones once
+`max_sessions` is reached. The chat history is kept in the memory store, see
+`summary_window`, a session created again picks it up.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from langchain.agents.agent import AgentExecutor
+from langchain.callbacks.manager import Callbacks
+from langchain.prompts import MessagesPlaceholder
+from langchain.tools import BaseTool
+
+from tutor_helper.agents.tutor_assistant.base import chat_agent
+from tutor_helper.agents.tutor_assistant.router import route_message
+from tutor_helper.agents.tutor_assistant.toolkit import SimplifiedToolkit
+from tutor_helper.common.llms import LlmLoader
+from tutor_helper.memory.summary_window import SummaryWindowMemory, get_memory_store
+from tutor_helper.output_parsers.agent_parser import NewAgentOutputFixingParser
+from tutor_helper.prompts.templates.chat_agent import ChatResponseWithKB
+
+import logging
+logger = logging.getLogger(__name__)
+
+SESSION_IDLE_TIMEOUT_SECONDS = int(os.getenv("SESSION_IDLE_TIMEOUT_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "500"))
+
+
+class AgentSession:
+    def __init__(
+        self,
+        session_id: str,
+        agent: AgentExecutor,
+        memory: Any,
+        research_tool: Optional[BaseTool] = None,
+    ):
+        self.session_id = session_id
+        self.agent = agent
+        self.memory = memory
+        # Called directly for plain research questions, see `router`
+        self.research_tool = research_tool
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        # Messages of a session are answered one at a time, in order
+        self.lock = asyncio.Lock()
+
+    def touch(self) -> None:
+        self.last_used_at = time.monotonic()
+
+    @property
+    def in_use(self) -> bool:
+        return self.lock.locked()
+
+    async def arun(self, message: str, callbacks: Callbacks = None) -> Any:
+        """Answers `message`, skipping the agent when it is a plain research question."""
+        inputs = {"similarity_search_term": message, "request_raw_question_input": message}
+        route = route_message(message, self.memory.chat_memory.messages)
+        if self.research_tool is None or not route.fast_path:
+            return await self.agent.arun(input=inputs, callbacks=callbacks)
+
+        answer = await self.research_tool.arun(inputs, callbacks=callbacks)
+        response = {"content": answer["content"], "references": answer["references"]}
+        # Kept in the history as if the agent had answered
+        self.memory.save_context({"input": message}, {"output": response})
+        return response
+
+
+class SessionRegistry:
+    def __init__(
+        self,
+        idle_timeout_seconds: int = SESSION_IDLE_TIMEOUT_SECONDS,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+    ):
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._toolkit = None
+        self._chat_model = None
+        self._output_parser = None
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+
+    def _shared_components(self):
+        # Built once per process and shared by every session
+        with self._lock:
+            if self._toolkit is None:
+                self._toolkit = SimplifiedToolkit()
+                # Streamed, so that the final answer can be sent as it is written
+                self._chat_model = LlmLoader.create_chat_llm(
+                    model=LlmLoader.DEPLOYMENT_35_TURBO_LG,
+                    temperature=0.5,
+                    top_p=0.5,
+                    streaming=True,
+                )
+                self._output_parser = NewAgentOutputFixingParser()
+            return self._toolkit, self._chat_model, self._output_parser
+
+    def _create_session(self, session_id: str) -> AgentSession:
+        toolkit, chat_model, output_parser = self._shared_components()
+        # Bounded and kept in the memory store, so that it outlives the session
+        memory = SummaryWindowMemory.for_session(
+            session_id, memory_key="chat_history", return_messages=True, llm=chat_model
+        )
+        agent_kwargs = {
+            "prefix": ChatResponseWithKB.SYSTEM_MESSAGE_WITH_TOOLS_PREFIX,
+            "format_instructions": ChatResponseWithKB.FORMAT_INSTRUCTIONS_FOR_AGENT,
+            "human_message_template": ChatResponseWithKB.HUMAN_MESSAGE_TEMPLATE,
+            "output_parser": output_parser,
+            "input_variables": ChatResponseWithKB.INPUT_VARIABLES,
+            "memory_prompts": [MessagesPlaceholder(variable_name="chat_history")],
+        }
+        # Initialize the agent with the tools and language model
+        agent = chat_agent(
+            llm=chat_model,
+            toolkit=toolkit,
+            verbose=True,
+            memory=memory,
+            agent_kwargs=agent_kwargs,
+        )
+        research_tool = next(
+            (tool for tool in toolkit.get_tools() if tool.name == "knowledge_research"), None
+        )
+        return AgentSession(session_id, agent, memory, research_tool)
+
+    def get(self, session_id: str) -> AgentSession:
+        """Returns the session of `session_id`, creating it if needed."""
+        self.evict_idle()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._create_session(session_id)
+                self._sessions[session_id] = session
+                self.created += 1
+                logger.info(f"[SessionRegistry] - Created session {session_id}")
+                self._evict_over_capacity()
+            self._sessions.move_to_end(session_id)
+            session.touch()
+            return session
+
+    def close(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Evicts the sessions idle for longer than the timeout."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [
+                session_id
+                for session_id, session in self._sessions.items()
+                if now - session.last_used_at > self.idle_timeout_seconds
+                and not session.in_use
+            ]
+            for session_id in expired:
+                del self._sessions[session_id]
+            self.evicted_idle += len(expired)
+        if expired:
+            logger.info(f"[SessionRegistry] - Evicted {len(expired)} idle sessions")
+        return len(expired)
+
+    def _evict_over_capacity(self) -> None:
+        # Least recently used first, sessions answering a message are kept
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not self._sessions[session_id].in_use:
+                del self._sessions[session_id]
+                self.evicted_capacity += 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_timeout_seconds": self.idle_timeout_seconds,
+                "created": self.created,
+                "evicted_idle": self.evicted_idle,
+                "evicted_capacity": self.evicted_capacity,
+                "memory": get_memory_store().stats(),
+            }
+
+
+_registry: Optional[SessionRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry() -> SessionRegistry:
+    """Returns the process-wide session registry, created on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SessionRegistry()
+    return _registry
@@ -0,0 +1,117 @@
+"""Callback Handler that records spans and metrics of the LLM calls."""
+from typing import Any, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from tutor_helper.common import telemetry
+
+# Initialize the logger module
+import logging
+logger = logging.getLogger(__name__)
+
+LLM_DURATION = telemetry.get_metrics_registry().histogram(
+    "tutor_helper_llm_duration_seconds", "Duration of the LLM calls."
+)
+LLM_CALLS = telemetry.get_metrics_registry().counter(
+    "tutor_helper_llm_calls_total", "LLM calls by deployment and outcome."
+)
+
+DEPLOYMENT_KEYS = ("deployment_name", "azure_deployment", "model", "model_name")
+
+
+def llm_deployment(serialized: Dict[str, Any], invocation_params: Dict[str, Any]) -> str:
+    for key in DEPLOYMENT_KEYS:
+        if invocation_params.get(key):
+            return str(invocation_params[key])
+    for key in DEPLOYMENT_KEYS:
+        if (serialized or {}).get("kwargs", {}).get(key):
+            return str(serialized["kwargs"][key])
+    return ((serialized or {}).get("id") or ["unknown"])[-1]
+
+
+def _count_tokens(texts: List[str]) -> int:
+    # Imported here, tutor_helper.tools imports the LlmLoader that uses this handler
+    from tutor_helper.tools.utilities import tokens
+
+    try:
+        return sum(tokens.count_tokens_batch(texts))
+    except Exception as e:
+        # The encoding may be unavailable, metrics must never fail a call
+        logger.debug(f"[MetricsCallbackHandler] - Could not count tokens: {e}")
+        return 0
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Callback Handler that opens an `llm` span around every LLM call.
+
+    The span is a child of the pipeline stage making the call and records its
+    deployment, prompt and completion tokens, cache hits and HTTP retries.
+    """
+
+    # Called in the context of the LLM call, so that the span nests under its stage
+    run_inline = True
+
+    def __init__(self) -> None:
+        """Initialize callback handler."""
+        self._runs: Dict[UUID, Tuple[telemetry.Span, Any, List[str]]] = {}
+
+    def _start(
+        self, serialized: Dict[str, Any], prompts: List[str], run_id: UUID, kwargs: Dict[str, Any]
+    ) -> None:
+        deployment = llm_deployment(serialized, kwargs.get("invocation_params") or {})
+        span, token = telemetry.start_span("llm", deployment=deployment)
+        self._runs[run_id] = (span, token, prompts)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(serialized, prompts, run_id, kwargs)
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        prompts = ["\n".join(str(m.content) for m in batch) for batch in messages]
+        self._start(serialized, prompts, run_id, kwargs)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        span, token, prompts = run
+        deployment = span.attributes["deployment"]
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        if span.counters.get("cache_hits"):
+            # Answered from the response cache, no tokens were spent
+            prompt_tokens, completion_tokens = 0, 0
+        elif prompt_tokens is None:
+            # Streamed responses come without usage, count them here
+            prompt_tokens = _count_tokens(prompts)
+            completion_tokens = _count_tokens(
+                [g.text for generations in response.generations for g in generations]
+            )
+
+        span.add("llm_calls")
+        span.add("prompt_tokens", prompt_tokens)
+        span.add("completion_tokens", completion_tokens or 0)
+        # The first request of a call is not a retry
+        span.add("retries", max(span.counters.get("http_requests", 0) - 1, 0))
+        telemetry.LLM_TOKENS.inc(prompt_tokens, deployment=deployment, kind="prompt")
+        telemetry.LLM_TOKENS.inc(completion_tokens or 0, deployment=deployment, kind="completion")
+        LLM_CALLS.inc(deployment=deployment, outcome="ok")
+        LLM_DURATION.observe(span.duration, deployment=deployment)
+        telemetry.end_span(span, token)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        span, token, _ = run
+        LLM_CALLS.inc(deployment=span.attributes["deployment"], outcome="error")
+        telemetry.end_span(span, token, error)
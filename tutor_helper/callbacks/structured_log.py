@@ -0,0 +1,304 @@
+"""Callback Handler that writes sampled, structured LLM events to a log queue.
+
+Events are JSON lines written by a background `QueueListener`, so the calling
+thread only truncates the payload and enqueues it. Configuration:
+
+- `LLM_LOG_VERBOSITY`: `errors`, `summary` (default, no prompt bodies),
+  `prompts` (prompt and response bodies) or `full` (tool and agent events too).
+- `LLM_LOG_SAMPLE_RATE`: fraction of the traces whose events are written.
+  Errors are always written.
+- `LLM_LOG_TRUNCATE_INFO` / `LLM_LOG_TRUNCATE_DEBUG`: characters kept of the
+  bodies when the events logger is at INFO or at DEBUG level.
+- `LLM_LOG_LEVEL`, `LLM_LOG_FILE` and `LLM_LOG_QUEUE_SIZE`: level, output file
+  (stderr when empty) and size of the queue, events are dropped when it is full.
+"""
+from typing import Any, Dict, List, Optional, Union
+from uuid import UUID
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+from tutor_helper.callbacks.metrics import llm_deployment
+from tutor_helper.common import telemetry
+
+# Initialize the logger module
+logger = logging.getLogger(__name__)
+
+LLM_LOG_VERBOSITY = os.getenv("LLM_LOG_VERBOSITY", "summary")
+LLM_LOG_SAMPLE_RATE = float(os.getenv("LLM_LOG_SAMPLE_RATE", "1.0"))
+LLM_LOG_TRUNCATE_INFO = int(os.getenv("LLM_LOG_TRUNCATE_INFO", "500"))
+LLM_LOG_TRUNCATE_DEBUG = int(os.getenv("LLM_LOG_TRUNCATE_DEBUG", "8000"))
+LLM_LOG_LEVEL = os.getenv("LLM_LOG_LEVEL", "INFO")
+LLM_LOG_FILE = os.getenv("LLM_LOG_FILE", "")
+LLM_LOG_QUEUE_SIZE = int(os.getenv("LLM_LOG_QUEUE_SIZE", "10000"))
+
+EVENTS_LOGGER = "tutor_helper.llm_events"
+VERBOSITY_LEVELS = ("errors", "summary", "prompts", "full")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record and its `payload` as one JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            **getattr(record, "payload", {}),
+        }
+        return json.dumps(line, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, record_queue: queue.Queue):
+        super().__init__(record_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The payload is serialized by the listener, not in the calling thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogEventWriter:
+    """A logger whose records are written by a background `QueueListener`."""
+
+    def __init__(
+        self,
+        handler: Optional[logging.Handler] = None,
+        level: Union[int, str] = LLM_LOG_LEVEL,
+        max_queue_size: int = LLM_LOG_QUEUE_SIZE,
+        name: str = EVENTS_LOGGER,
+    ):
+        if handler is None:
+            handler = logging.FileHandler(LLM_LOG_FILE) if LLM_LOG_FILE else logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonLinesFormatter())
+
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize=max_queue_size))
+        self.listener = logging.handlers.QueueListener(self.queue_handler.queue, handler)
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+        self.logger.handlers = [self.queue_handler]
+        self.listener.start()
+
+    def truncation_limit(self) -> int:
+        """Characters kept of the bodies at the level the events logger is set to."""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            return LLM_LOG_TRUNCATE_DEBUG
+        return LLM_LOG_TRUNCATE_INFO
+
+    def write(self, level: int, event: str, payload: Dict[str, Any]) -> None:
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, extra={"payload": payload})
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.queue_handler.queue.qsize(),
+            "enqueued": self.queue_handler.enqueued,
+            "dropped": self.queue_handler.dropped,
+        }
+
+    def stop(self) -> None:
+        """Writes the queued events and stops the listener."""
+        self.listener.stop()
+
+
+_writer: Optional[LogEventWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer() -> LogEventWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogEventWriter()
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def log_writer_stats() -> Dict[str, int]:
+    return _writer.stats() if _writer is not None else {"queue_depth": 0, "enqueued": 0, "dropped": 0}
+
+
+def _truncate(text: Any, limit: int) -> str:
+    text = text if isinstance(text, str) else str(text)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"... [{len(text) - limit} chars truncated]"
+
+
+class StructuredLogCallbackHandler(BaseCallbackHandler):
+    """Callback Handler that logs one structured event per LLM call stage.
+
+    Unlike `StdOutAllCallbackHandler` it never prints, does not log the
+    streamed tokens one by one and only writes prompt bodies, truncated, when
+    the verbosity asks for them.
+    """
+
+    # Called in the context of the LLM call, so that events carry its trace id
+    run_inline = True
+
+    def __init__(
+        self,
+        verbosity: str = LLM_LOG_VERBOSITY,
+        sample_rate: float = LLM_LOG_SAMPLE_RATE,
+        writer: Optional[LogEventWriter] = None,
+    ) -> None:
+        """Initialize callback handler."""
+        if verbosity not in VERBOSITY_LEVELS:
+            logger.warning(f"[StructuredLogCallbackHandler] - Unknown verbosity {verbosity}, using summary")
+            verbosity = "summary"
+        self.verbosity = VERBOSITY_LEVELS.index(verbosity)
+        self.sample_rate = sample_rate
+        self.writer = writer or get_log_writer()
+        # run_id -> started_at, trace_id, sampled, streamed tokens, first token delay
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def _is_sampled(self, trace_id: str) -> bool:
+        # Decided on the trace id, so that all the events of a request are kept together
+        if self.sample_rate >= 1:
+            return True
+        return int(trace_id[:8], 16) / 0xFFFFFFFF < self.sample_rate
+
+    def _trace_id(self, run_id: UUID) -> str:
+        span = telemetry.current_span()
+        return span.trace_id if span is not None else run_id.hex
+
+    def _write(self, level: int, event: str, run_id: UUID, **payload: Any) -> None:
+        self.writer.write(level, event, {"run_id": str(run_id), **payload})
+
+    def _start(self, serialized: Dict[str, Any], prompts: List[str], run_id: UUID, kwargs: Dict[str, Any]) -> None:
+        trace_id = self._trace_id(run_id)
+        run = {
+            "started_at": time.perf_counter(),
+            "trace_id": trace_id,
+            "sampled": self._is_sampled(trace_id),
+            "deployment": llm_deployment(serialized, kwargs.get("invocation_params") or {}),
+            "tokens": 0,
+            "first_token_ms": None,
+        }
+        self._runs[run_id] = run
+        if not run["sampled"] or self.verbosity < VERBOSITY_LEVELS.index("summary"):
+            return
+
+        payload = {
+            "trace_id": trace_id,
+            "deployment": run["deployment"],
+            "prompt_chars": sum(len(prompt) for prompt in prompts),
+        }
+        if self.verbosity >= VERBOSITY_LEVELS.index("prompts"):
+            limit = self.writer.truncation_limit()
+            payload["prompts"] = [_truncate(prompt, limit) for prompt in prompts]
+        self._write(logging.INFO, "llm_start", run_id, **payload)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(serialized, prompts, run_id, kwargs)
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        prompts = ["\n".join(str(m.content) for m in batch) for batch in messages]
+        self._start(serialized, prompts, run_id, kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        # Only counted, the tokens end up in the response of `llm_end`
+        run = self._runs.get(run_id)
+        if run is not None:
+            if run["first_token_ms"] is None:
+                run["first_token_ms"] = round((time.perf_counter() - run["started_at"]) * 1000, 1)
+            run["tokens"] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None or not run["sampled"] or self.verbosity < VERBOSITY_LEVELS.index("summary"):
+            return
+
+        texts = [g.text for generations in response.generations for g in generations]
+        payload = {
+            "trace_id": run["trace_id"],
+            "deployment": run["deployment"],
+            "duration_ms": round((time.perf_counter() - run["started_at"]) * 1000, 1),
+            "response_chars": sum(len(text) for text in texts),
+            "token_usage": (response.llm_output or {}).get("token_usage"),
+        }
+        if run["tokens"]:
+            payload["streamed_tokens"] = run["tokens"]
+            payload["first_token_ms"] = run["first_token_ms"]
+        if self.verbosity >= VERBOSITY_LEVELS.index("prompts"):
+            limit = self.writer.truncation_limit()
+            payload["responses"] = [_truncate(text, limit) for text in texts]
+        self._write(logging.INFO, "llm_end", run_id, **payload)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        # Errors are written whatever the sampling and the verbosity
+        run = self._runs.pop(run_id, None) or {}
+        started_at = run.get("started_at")
+        self._write(
+            logging.WARNING,
+            "llm_error",
+            run_id,
+            trace_id=run.get("trace_id") or self._trace_id(run_id),
+            deployment=run.get("deployment"),
+            duration_ms=round((time.perf_counter() - started_at) * 1000, 1) if started_at else None,
+            error_type=type(error).__name__,
+            error=_truncate(error, LLM_LOG_TRUNCATE_INFO),
+        )
+
+    def _write_full(self, event: str, run_id: UUID, **payload: Any) -> None:
+        if self.verbosity < VERBOSITY_LEVELS.index("full"):
+            return
+        trace_id = self._trace_id(run_id)
+        if self._is_sampled(trace_id):
+            limit = self.writer.truncation_limit()
+            payload = {key: _truncate(value, limit) for key, value in payload.items()}
+            self._write(logging.DEBUG, event, run_id, trace_id=trace_id, **payload)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._write_full("tool_start", run_id, tool=(serialized or {}).get("name"), input=input_str)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._write_full("tool_end", run_id, output=output)
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._write(
+            logging.WARNING,
+            "tool_error",
+            run_id,
+            trace_id=self._trace_id(run_id),
+            error_type=type(error).__name__,
+            error=_truncate(error, LLM_LOG_TRUNCATE_INFO),
+        )
+
+    def on_agent_action(self, action: AgentAction, *, run_id: UUID, **kwargs: Any) -> None:
+        self._write_full("agent_action", run_id, tool=action.tool, input=action.tool_input)
+
+    def on_agent_finish(self, finish: AgentFinish, *, run_id: UUID, **kwargs: Any) -> None:
+        self._write_full("agent_finish", run_id, output=finish.return_values)
@@ -0,0 +1,176 @@
+"""Callback Handler that streams agent events to a websocket client."""
+import asyncio
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.manager import Callbacks
+from langchain_core.callbacks.manager import adispatch_custom_event
+
+# Initialize the logger module
+import logging
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVENT = "research_progress"
+
+JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+async def adispatch_progress(callbacks: Callbacks, stage: str, **data: Any) -> None:
+    """Reports the progress of a research `stage` to the handlers of `callbacks`."""
+    if callbacks is None:
+        return
+    try:
+        await adispatch_custom_event(
+            PROGRESS_EVENT, {"stage": stage, **data}, config={"callbacks": callbacks}
+        )
+    except Exception as e:
+        # Progress is informative only, never fail the research because of it
+        logger.debug(f"[adispatch_progress] - Could not report progress: {e}")
+
+
+def _decode_json_string(buffer: str, position: int) -> Tuple[str, int, bool]:
+    """Decodes the JSON string content of `buffer` from `position`.
+
+    Returns the decoded text, the position to resume from and whether the closing
+    quote was reached. Escape sequences split across tokens are left for later.
+    """
+    text = []
+    while position < len(buffer):
+        char = buffer[position]
+        if char == '"':
+            return "".join(text), position + 1, True
+        if char != "\\":
+            text.append(char)
+            position += 1
+            continue
+        if position + 1 >= len(buffer):
+            break
+        escape = buffer[position + 1]
+        if escape == "u":
+            code = buffer[position + 2 : position + 6]
+            if len(code) < 4:
+                break
+            try:
+                text.append(chr(int(code, 16)))
+            except ValueError:
+                text.append(code)
+            position += 6
+        else:
+            text.append(JSON_ESCAPES.get(escape, escape))
+            position += 2
+    return "".join(text), position, False
+
+
+class FinalAnswerStream:
+    """Extracts the answer content from the streamed tokens of the agent's JSON blob."""
+
+    FINAL_ANSWER_CONTENT = re.compile(
+        r'"action"\s*:\s*"Final Answer".*?"content"\s*:\s*"', re.DOTALL
+    )
+
+    def __init__(self):
+        self._buffer = ""
+        self._position: Optional[int] = None
+        self._done = False
+
+    def feed(self, token: str) -> str:
+        """Returns the part of the final answer completed by `token`."""
+        if self._done:
+            return ""
+        self._buffer += token
+        if self._position is None:
+            match = self.FINAL_ANSWER_CONTENT.search(self._buffer)
+            if match is None:
+                return ""
+            self._position = match.end()
+        text, self._position, self._done = _decode_json_string(
+            self._buffer, self._position
+        )
+        return text
+
+
+class WebsocketStreamCallbackHandler(BaseCallbackHandler):
+    """Callback Handler that queues tool, progress and final answer events.
+
+    Events are plain dicts ready for `send_json`. Handlers may be called from
+    worker threads, so events are handed over to the event loop thread-safely.
+    """
+
+    # Called in place rather than in an executor to keep the tokens in order
+    run_inline = True
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Initialize callback handler."""
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._answers: Dict[UUID, FinalAnswerStream] = {}
+        self._tools: Dict[UUID, str] = {}
+
+    def _put(self, event: Dict[str, Any]) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._answers[run_id] = FinalAnswerStream()
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._answers[run_id] = FinalAnswerStream()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        answer = self._answers.get(run_id)
+        if answer is None:
+            return
+        content = answer.feed(token)
+        if content:
+            self._put({"type": "token", "content": content})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._answers.pop(run_id, None)
+
+    def on_llm_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._answers.pop(run_id, None)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        tool = serialized.get("name", "tool")
+        self._tools[run_id] = tool
+        self._put({"type": "tool_start", "tool": tool, "input": input_str})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._put({"type": "tool_end", "tool": self._tools.pop(run_id, "tool")})
+
+    def on_tool_error(
+        self, error: Union[Exception, KeyboardInterrupt], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._put(
+            {"type": "tool_error", "tool": self._tools.pop(run_id, "tool"), "error": str(error)}
+        )
+
+    def on_custom_event(self, name: str, data: Any, **kwargs: Any) -> None:
+        if name == PROGRESS_EVENT:
+            self._put({"type": "progress", **data})
+
+    async def events(self, task: "asyncio.Future") -> AsyncIterator[Dict[str, Any]]:
+        """Yields the queued events until `task` is done and the queue is drained."""
+        while True:
+            getter = asyncio.ensure_future(self.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            # Let the events handed over from worker threads reach the queue
+            await asyncio.sleep(0)
+            while not self.queue.empty():
+                yield self.queue.get_nowait()
+            return
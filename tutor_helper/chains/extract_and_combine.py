@@ -1,73 +1,151 @@
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from langchain.callbacks.manager import Callbacks
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from langchain.output_parsers import ResponseSchema
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
+import asyncio
 import concurrent.futures
+import os
+import time
 
 from langchain.chains.summarize import load_summarize_chain
 
-from tutor_helper.tools.utilities.utils import num_tokens_from_string, split_by_token
+from tutor_helper.tools.utilities.utils import (
+    num_tokens_from_string,
+    num_tokens_from_strings,
+)
+from tutor_helper.callbacks.websocket_stream import adispatch_progress
+from tutor_helper.common.llms import LlmLoader
+from tutor_helper.common.scheduler import (
+    estimate_tokens,
+    get_scheduler,
+    llm_resource,
+    report_usage,
+)
+from tutor_helper.common.telemetry import get_metrics_registry, span
+from tutor_helper.prompts.layout import static_first
+from tutor_helper.prompts.registry import get_chain, get_chat_prompt, get_prompt
+from tutor_helper.tools.utilities.packing import dedupe_passages, pack
+from tutor_helper.tools.utilities.relevance import RELEVANCE_PREFILTER, prefilter_docs
 from tutor_helper.output_parsers.structured import StructuredOutputParser
 
 import logging 
 logger = logging.getLogger(__name__)
 
-EXTRACT_PROMPT = """You are an experienced tutor.
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("EXTRACT_MAX_CONCURRENCY", "8"))
+# Tokens left for the combine answer, out of the token limit of the deployment
+COMBINE_COMPLETION_TOKENS = int(os.getenv("COMBINE_COMPLETION_TOKENS", "1024"))
+# Caps the summaries below the token limit of the deployment, 0 for no cap
+COMBINE_MAX_SUMMARY_TOKENS = int(os.getenv("COMBINE_MAX_SUMMARY_TOKENS", "0"))
+# Token limit of deployments missing from `LlmLoader.TOKEN_LIMITS_`
+DEFAULT_TOKEN_LIMIT = 4000
+# Levels of intermediate combine calls when the summaries exceed the budget
+COMBINE_TREE_MAX_LEVELS = int(os.getenv("COMBINE_TREE_MAX_LEVELS", "3"))
+# Start the combine call as soon as the related extracts fill its budget
+EXTRACT_STREAMING = os.getenv("EXTRACT_STREAMING", "false").lower() == "true"
+# Seconds after which the combine starts with the extracts done so far, 0 for no deadline
+EXTRACT_DEADLINE_SECONDS = float(os.getenv("EXTRACT_DEADLINE_SECONDS", "0"))
+
+PREFILTERED_CHUNKS = get_metrics_registry().counter(
+    "tutor_helper_prefilter_chunks_total", "Chunks kept or dropped by the relevance prefilter."
+)
+EXTRACT_CANCELLED = get_metrics_registry().counter(
+    "tutor_helper_extract_cancelled_total",
+    "Extract calls cancelled by the extract deadline or a full summary budget.",
+)
+
+# Instructions first and the question before the document, so that the extract
+# calls of a request share their prompt prefix, see `tutor_helper.prompts.layout`
+EXTRACT_PROMPT = static_first(
+    [
+        """You are an experienced tutor.
 Return the title and content of the document if it is relevant to the question and remove non relevant content.
-=========
-```{context}```
-=========
-QUESTION: ```{question}```
 If the relevant text is the entire document, return all of it's content and title.
 Extract the relevant content to answer the question, keeping notes, details and howto access/run actions.
 Make the content as concise as possible.
-If document is not related ... return DOCUMENT NOT RELATED (<reason why is not related or relevant>)."""
+If document is not related ... return DOCUMENT NOT RELATED (<reason why is not related or relevant>).""",
+    ],
+    [
+        """QUESTION: ```{question}```
+=========
+```{context}```
+=========""",
+    ],
+)
 
-COMBINE_PROMPT = """You are an experienced tutor.
+COMBINE_PROMPT = static_first(
+    [
+        """You are an experienced tutor.
 Your task is to combine extracted parts of a long document for further processing. All given documents are related to the question.
 Include recommendation notes if available, along with the reasons behind them. Keeping details and howto access/run actions.
 Remove duplicate content.
 Only use content provided by the tools.
-
-QUESTION: ```{question}```
-=========
-```{summaries}```
-=========
 Your response should be in markdown format.
 At the bottom of the response you should include #References section with a list of documents and their ID's used to compose your answer.
 Also indicate in percent how much each document contributed to the answer.
 Sample References section:
 # References (percent contribution)
 [ID1 (10%),ID2 (45%), ID3 (5%), ....]
-"""
+""",
+    ],
+    [
+        """QUESTION: ```{question}```
+=========
+```{summaries}```
+=========
+""",
+    ],
+)
 
 SYSTEM_PROMPT = """Your task is to return the following knowledge content,
 be aware that below knowledge details might contain additional or irrelevant information not related to the question scope/implementation,
 these details were collected from internal knowledge articles, that might not be 100% related to the question.
 """
 
-HUMAN_PROMPT = """Return the knowledge content in minimized HTML with inline HTML elements styling.
+HUMAN_PROMPT = static_first(
+    [
+        """Return the knowledge content in minimized HTML with inline HTML elements styling.
 Replace/Remove competitor or other vendors names/instructions if not part of the question.
 
 Do not include documents in the references that were not used in the answer.
 
-KNOWLEDGE CONTENT:
+IMPORTANT: If "KNOWLEDGE CONTENT" is empty, just indicate no info found. Don't try to make up an answer.
+
+FORMAT INSTRUCTIONS:
+{format_instructions}
+""",
+    ],
+    [
+        """KNOWLEDGE CONTENT:
 ```{research_summary}```
 
 QUESTION:
 ```{question}```
+""",
+    ],
+    partials=["format_instructions"],
+)
 
-FORMAT INSTRUCTIONS:
-{format_instructions}
 
-IMPORTANT: If "KNOWLEDGE CONTENT" is empty, just indicate no info found. Don't try to make up an answer.
-"""
+class ExtractBuffer:
+    """The extracts of a run, collected as they finish.
+
+    With a `budget`, the buffer is full once the related extracts reach that
+    many tokens, more of them would not fit the combine prompt.
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.extracted_docs: List[Tuple[str, str]] = []
+        self.related_tokens = 0
+
+    def add(self, doc_id: str, content: str) -> None:
+        self.extracted_docs.append((doc_id, content))
+        if self.budget is not None and """DOCUMENT NOT RELATED""" not in content:
+            self.related_tokens += num_tokens_from_string(content)
+
+    @property
+    def full(self) -> bool:
+        return self.budget is not None and self.related_tokens >= self.budget
 
 
 class ExtractAndCombine:
@@ -102,15 +180,346 @@ class ExtractAndCombine:
     ):
         self.llm = llm
 
-        self.extract_prompt = PromptTemplate(
-            template=extract_prompt,
-            input_variables=["context", "question"],
+        # Compiled once per process, see `tutor_helper.prompts.registry`
+        self.extract_prompt = get_prompt(extract_prompt)
+        self.combine_prompt = get_prompt(combine_prompt)
+        self.chat_prompt = get_chat_prompt(
+            SYSTEM_PROMPT, HUMAN_PROMPT, format_instructions=self.format_instructions
         )
 
-        self.combine_prompt = PromptTemplate(
-            template=combine_prompt,
-            input_variables=["summaries", "question"],
-            # partial_variables = {"format_instructions": self.format_instructions},
+    def _extract_inputs(self, doc, question: str) -> Dict[str, str]:
+        return {
+            "context": doc.page_content + "\nVISIBILITY:" + doc.metadata["visibility"],
+            "question": question,
+        }
+
+    def _extract_tokens(self, inputs: Dict[str, str]) -> int:
+        # Estimate the scheduler charges to the tokens-per-minute budget up front
+        return estimate_tokens(self.extract_prompt.template, *inputs.values())
+
+    def _prefilter(self, docs: List, search_term: str, description: str, docs_by_id: List) -> List:
+        """Drops the chunks unlikely to be related before they cost an extract call."""
+        if not RELEVANCE_PREFILTER:
+            return docs
+        with span("prefilter", chunks=len(docs)) as prefilter_span:
+            kept = prefilter_docs(docs, f"{description}\n{search_term}", keep_sources=docs_by_id)
+            prefilter_span.set("kept", len(kept))
+        PREFILTERED_CHUNKS.inc(len(kept), outcome="kept")
+        PREFILTERED_CHUNKS.inc(len(docs) - len(kept), outcome="dropped")
+        logger.info(f"[extract_and_combine] - Prefilter kept {len(kept)} of {len(docs)} chunks")
+        return kept
+
+    def _extract_buffer(self, description: str) -> ExtractBuffer:
+        return ExtractBuffer(self._summary_budget(description) if EXTRACT_STREAMING else None)
+
+    @staticmethod
+    def _deadline(deadline_seconds: Optional[float]) -> Optional[float]:
+        seconds = EXTRACT_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds
+        return time.monotonic() + seconds if seconds > 0 else None
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    @staticmethod
+    def _cancel_stragglers(pending: set, reason: str) -> None:
+        if not pending:
+            return
+        # Extracts already running in the scheduler workers cannot be cancelled
+        cancelled = sum(1 for future in pending if future.cancel())
+        running = len(pending) - cancelled
+        if cancelled:
+            EXTRACT_CANCELLED.inc(cancelled, reason=reason)
+            logger.warning(
+                f"[extract_and_combine] - Combining without {cancelled} cancelled extracts, reason: {reason}"
+            )
+        if running:
+            logger.warning(
+                f"[extract_and_combine] - Combining without {running} extracts left running, reason: {reason}"
+            )
+
+    def _collect_extracts(
+        self, future_results: List, buffer: ExtractBuffer, deadline: Optional[float]
+    ) -> List:
+        """Adds the extracts to `buffer` as they finish, until it is full or the deadline passes.
+
+        The extracts still pending then are cancelled.
+        """
+        pending = set(future_results)
+        reason = "budget"
+        try:
+            while pending and not buffer.full:
+                done, pending = concurrent.futures.wait(
+                    pending,
+                    timeout=self._remaining(deadline),
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                if not done:
+                    reason = "deadline"
+                    break
+                for future in done:
+                    buffer.add(*future.result())
+        except BaseException:
+            reason = "error"
+            raise
+        finally:
+            self._cancel_stragglers(pending, reason)
+        return buffer.extracted_docs
+
+    async def _acollect_extracts(
+        self, tasks: List, buffer: ExtractBuffer, deadline: Optional[float]
+    ) -> List:
+        """Async version of `_collect_extracts`."""
+        pending = set(tasks)
+        reason = "budget"
+        try:
+            while pending and not buffer.full:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self._remaining(deadline),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    reason = "deadline"
+                    break
+                for task in done:
+                    buffer.add(*task.result())
+        except BaseException:
+            reason = "error"
+            raise
+        finally:
+            self._cancel_stragglers(pending, reason)
+            # Let the cancelled calls give their scheduler slots back
+            await asyncio.gather(*pending, return_exceptions=True)
+        return buffer.extracted_docs
+
+    def _token_limit(self) -> int:
+        return LlmLoader.TOKEN_LIMITS_.get(llm_resource(self.llm), DEFAULT_TOKEN_LIMIT)
+
+    def _summary_budget(self, description: str) -> int:
+        """Tokens the summaries can take in the combine prompt of the deployment."""
+        prompt_tokens = sum(
+            num_tokens_from_strings(
+                [message.content for message in self._combine_messages(description, "")]
+            )
+        )
+        budget = self._token_limit() - prompt_tokens - COMBINE_COMPLETION_TOKENS
+        if COMBINE_MAX_SUMMARY_TOKENS:
+            budget = min(budget, COMBINE_MAX_SUMMARY_TOKENS)
+        return max(budget, 0)
+
+    def _reduce_budget(self, description: str) -> int:
+        """Tokens the summaries can take in an intermediate combine prompt."""
+        prompt_tokens = num_tokens_from_string(
+            self.combine_prompt.format(summaries="", question=description)
+        )
+        return max(self._token_limit() - prompt_tokens - COMBINE_COMPLETION_TOKENS, 0)
+
+    @staticmethod
+    def _relevance_by_source(docs: List) -> Dict[str, float]:
+        # A source split into chunks is as relevant as its best chunk
+        relevance = {}
+        for doc in docs:
+            score = doc.metadata.get("relevance_score")
+            if score is not None:
+                source = doc.metadata["source"]
+                relevance[source] = max(score, relevance.get(source, score))
+        return relevance
+
+    @staticmethod
+    def _related(extracted_docs: List) -> List[Tuple[List[str], str]]:
+        """(sources, content) of the extracts related to the question."""
+        return [
+            ([doc_id], content)
+            for doc_id, content in extracted_docs
+            if """DOCUMENT NOT RELATED""" not in content
+        ]
+
+    @staticmethod
+    def _summary_weight(sources: List[str], relevance: Dict[str, float]) -> float:
+        return max((relevance[source] for source in sources if source in relevance), default=1.0)
+
+    @staticmethod
+    def _summary_overheads(related: List) -> List[int]:
+        # The source line and separator of each summary count against the budget
+        return num_tokens_from_strings(
+            [f"Content: \nSource: {', '.join(sources)}\n\n" for sources, _ in related]
+        )
+
+    def _reduce_batches(
+        self, related: List, budget: int, reduce_budget: int, relevance: Dict[str, float]
+    ) -> List[List]:
+        """Groups the summaries into batches of at most `reduce_budget` tokens.
+
+        Returns no batches when the summaries, once deduplicated, already fit
+        `budget`, the single combine call is enough then.
+        """
+        if len(related) < 2:
+            return []
+        related = sorted(related, key=lambda item: -self._summary_weight(item[0], relevance))
+        sizes = [
+            content_tokens + overhead
+            for content_tokens, overhead in zip(
+                num_tokens_from_strings(dedupe_passages([content for _, content in related])),
+                self._summary_overheads(related),
+            )
+        ]
+        if sum(sizes) <= budget:
+            return []
+
+        batches, batch_tokens = [[]], 0
+        for item, size in zip(related, sizes):
+            if batches[-1] and batch_tokens + size > reduce_budget:
+                batches.append([])
+                batch_tokens = 0
+            batches[-1].append(item)
+            batch_tokens += size
+        return batches
+
+    def _reduce_inputs(
+        self, batch: List, description: str, reduce_budget: int, relevance: Dict[str, float]
+    ) -> Dict[str, str]:
+        summaries, _ = self._build_summaries(batch, reduce_budget, relevance)
+        return {"summaries": summaries, "question": description}
+
+    def _tree_reduce(self, related: List, description: str, relevance: Dict[str, float]) -> List:
+        """Combines the summaries in parallel batches, level by level, until they fit.
+
+        Each batch is combined with `combine_prompt` into one summary of all
+        its sources, at most `COMBINE_TREE_MAX_LEVELS` times.
+        """
+        budget = self._summary_budget(description)
+        reduce_budget = self._reduce_budget(description)
+        reduce_chain = get_chain(self.llm, self.combine_prompt)
+        scheduler = get_scheduler()
+        resource = llm_resource(self.llm)
+
+        def reduce_task(level, batch, inputs):
+            sources = [source for batch_sources, _ in batch for source in batch_sources]
+            with span("combine.reduce", level=level, summaries=len(batch)) as reduce_span:
+                content = reduce_chain.run(**inputs)
+            report_usage(
+                reduce_span.counters.get("prompt_tokens", 0)
+                + reduce_span.counters.get("completion_tokens", 0)
+            )
+            return sources, content
+
+        for level in range(COMBINE_TREE_MAX_LEVELS):
+            batches = self._reduce_batches(related, budget, reduce_budget, relevance)
+            if not batches:
+                break
+            logger.info(
+                f"[extract_and_combine] - Reducing {len(related)} summaries in {len(batches)} batches"
+            )
+            future_results = []
+            for batch in batches:
+                inputs = self._reduce_inputs(batch, description, reduce_budget, relevance)
+                future_results.append(
+                    scheduler.submit(
+                        reduce_task,
+                        level,
+                        batch,
+                        inputs,
+                        resource=resource,
+                        tokens=estimate_tokens(self.combine_prompt.template, *inputs.values()),
+                    )
+                )
+            related = [future.result() for future in future_results]
+        return related
+
+    async def _atree_reduce(
+        self,
+        related: List,
+        description: str,
+        relevance: Dict[str, float],
+        max_concurrency: int,
+        callbacks: Callbacks = None,
+    ) -> List:
+        """Async version of `_tree_reduce`, reporting each level to `callbacks`."""
+        budget = self._summary_budget(description)
+        reduce_budget = self._reduce_budget(description)
+        reduce_chain = get_chain(self.llm, self.combine_prompt)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        scheduler = get_scheduler()
+        resource = llm_resource(self.llm)
+        config = {"callbacks": callbacks}
+
+        async def reduce_task(level, batch):
+            inputs = self._reduce_inputs(batch, description, reduce_budget, relevance)
+            tokens = estimate_tokens(self.combine_prompt.template, *inputs.values())
+            async with semaphore, scheduler.aslot(resource, tokens):
+                with span("combine.reduce", level=level, summaries=len(batch)) as reduce_span:
+                    response = await reduce_chain.ainvoke(inputs, config=config)
+                report_usage(
+                    reduce_span.counters.get("prompt_tokens", 0)
+                    + reduce_span.counters.get("completion_tokens", 0)
+                )
+            sources = [source for batch_sources, _ in batch for source in batch_sources]
+            return sources, response[reduce_chain.output_key]
+
+        for level in range(COMBINE_TREE_MAX_LEVELS):
+            batches = self._reduce_batches(related, budget, reduce_budget, relevance)
+            if not batches:
+                break
+            logger.info(
+                f"[extract_and_combine] - Reducing {len(related)} summaries in {len(batches)} batches"
+            )
+            await adispatch_progress(callbacks, "reduce", level=level, total=len(batches))
+            related = list(await asyncio.gather(*(reduce_task(level, batch) for batch in batches)))
+        return related
+
+    def _build_summaries(
+        self, related: List, budget: int, relevance: Optional[Dict[str, float]] = None
+    ) -> Tuple[str, List]:
+        """Packs the related summaries into the summaries of a combine prompt.
+
+        Args:
+            related (List): (sources, content) of each related summary
+            budget (int): tokens the summaries can take
+            relevance (Dict[str, float], optional): relevance score of each source
+
+        Returns:
+            Tuple[str, List]: the summaries and the sources they were extracted from
+        """
+        relevance = relevance or {}
+
+        with span("combine.pack", summaries=len(related), budget=budget) as pack_span:
+            packed = pack(
+                [content for _, content in related],
+                budget,
+                weights=[self._summary_weight(sources, relevance) for sources, _ in related]
+                if relevance
+                else None,
+                overheads=self._summary_overheads(related),
+            )
+            pack_span.set("kept", sum(1 for _, content in packed if content))
+
+        # Extracts repeating another one are still related, and referenced
+        sumamry_id_list = [source for i, _ in packed for source in related[i][0]]
+        summary_list = [
+            f"Content: {content}\nSource: {', '.join(related[i][0])}"
+            for i, content in packed
+            if content
+        ]
+
+        summaries = "\n\n".join(summary_list)
+
+        summaries = "NO INFO FOUND" if summaries == "" else summaries
+
+        logger.info(f"[extract_and_combine.run] - SUMMARY: {summaries}")
+        logger.info(
+            f"[extract_and_combine.run] - SUMMARY Length: {num_tokens_from_string(summaries)} of {budget}"
+        )
+        logger.info(
+            f"[extract_and_combine.run] - SUMMARY kept {len(summary_list)} of {len(related)} related summaries"
+        )
+
+        return summaries, sumamry_id_list
+
+    def _combine_messages(self, description: str, summaries: str) -> List:
+        # Generate response json with the knowledge and references
+        return self.chat_prompt.format_messages(
+            question=description, research_summary=summaries
         )
 
     def run(
@@ -120,6 +529,7 @@ class ExtractAndCombine:
         description: str,
         tools: List,
         docs_by_id: List = [],
+        deadline_seconds: Optional[float] = None,
     ):
         """Give a list of searched docs, extract the relevant content and combine it.
 
@@ -129,97 +539,155 @@ class ExtractAndCombine:
             description (str): the full description of user's inquiry
             tools (List): the tool that extracted the Documents, to format and detremine whether to display the reference
             docs_by_id (List, optional): docs that were given by IDs. Defaults to [].
+            deadline_seconds (float, optional): seconds after which the combine starts with
+                the extracts done so far. Defaults to `EXTRACT_DEADLINE_SECONDS`.
 
         Returns:
             _type_: _description_
         """
-        # Creating extract chain
-        extract_chain = LLMChain(
-            verbose=True,
-            llm=self.llm,
-            prompt=self.extract_prompt,
-        )
+        # Shared extract chain
+        extract_chain = get_chain(self.llm, self.extract_prompt, verbose=True)
         logger.info(f"tools: {[tool.__str__() for tool in tools]}")
 
-        ## Running summaries parallel
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Define a function to be executed by ThreadPoolExecutor
-            def extract_task(doc, search_term):
-                
+        deadline = self._deadline(deadline_seconds)
+        extract_docs = self._prefilter(docs, search_term, description, docs_by_id)
+
+        ## Running summaries parallel, in the shared scheduler
+        scheduler = get_scheduler()
+        resource = llm_resource(self.llm)
+
+        def extract_task(doc, search_term):
+            with span("extract", source=doc.metadata["source"]) as extract_span:
                 task_response = doc.metadata["source"], extract_chain.run(
-                    context=doc.page_content
-                    + "\nVISIBILITY:"
-                    + doc.metadata["visibility"],
-                    question=search_term,
+                    **self._extract_inputs(doc, search_term)
                 )
+            report_usage(
+                extract_span.counters.get("prompt_tokens", 0)
+                + extract_span.counters.get("completion_tokens", 0)
+            )
+            return task_response
+
+        future_results = [
+            scheduler.submit(
+                extract_task,
+                doc=doc,
+                search_term=description,
+                resource=resource,
+                tokens=self._extract_tokens(self._extract_inputs(doc, description)),
+            )
+            for doc in extract_docs
+        ]
 
-                return task_response
+        # Collect the results as they complete
+        extracted_docs = self._collect_extracts(
+            future_results, self._extract_buffer(description), deadline
+        )
+        # Get summary
+        relevance = self._relevance_by_source(extract_docs)
+        related = self._tree_reduce(self._related(extracted_docs), description, relevance)
+        summaries, sumamry_id_list = self._build_summaries(
+            related, self._summary_budget(description), relevance
+        )
 
-            # Submit the tasks to the executor
-            future_results = [
-                executor.submit(extract_task, doc=doc, search_term=description)
-                for doc in docs
-            ]
+        combine_messages = self._combine_messages(description, summaries)
+        combine_tokens = estimate_tokens(*(message.content for message in combine_messages))
+        with scheduler.slot(resource, combine_tokens), span(
+            "combine", summaries=len(sumamry_id_list)
+        ):
+            response = self.llm(combine_messages)
 
-            # Collect the results as they complete
-            extracted_docs = [
-                future.result()
-                for future in concurrent.futures.as_completed(future_results)
-            ]
-        # Get summary
-        summaries = ""
-        sumamry_id_list = []
-        summary_list = []
-        summary_tokens = 0
-        summary_tokens_list = []
-        for doc_id, content in extracted_docs:
-            if """DOCUMENT NOT RELATED""" not in content:
-                summary_list.append(f"Content: {content}\nSource: {doc_id}")
-                sumamry_id_list.append(doc_id)
-                summary_tokens += num_tokens_from_string(content)
-                summary_tokens_list.append(num_tokens_from_string(content))
-
-        target_tokens = 2048
-        if summary_tokens > target_tokens:
-            # truncate
-            target_tokens = int(target_tokens / len(summary_tokens_list))
-            summary_list = [
-                split_by_token(string=summary, chunk_length=target_tokens)[0]
-                for summary in summary_list
-            ]
+        return self._format_response(
+            response.content, docs, tools, docs_by_id, sumamry_id_list
+        )
 
-        summaries = "\n\n".join(summary_list)
+    async def arun(
+        self,
+        docs: List,
+        search_term: str,
+        description: str,
+        tools: List,
+        docs_by_id: List = [],
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        callbacks: Callbacks = None,
+        deadline_seconds: Optional[float] = None,
+    ):
+        """Async version of `run`.
+
+        The extract calls are awaited concurrently, at most `max_concurrency` at
+        a time for this request and within the budgets of the shared scheduler,
+        and the combine call runs once all of them are done, or earlier when
+        the deadline passes or, with `EXTRACT_STREAMING`, when the extracts fill
+        the summary budget. Progress is reported to `callbacks` after each
+        extracted document.
+        """
+        extract_chain = get_chain(self.llm, self.extract_prompt, verbose=True)
+        logger.info(f"tools: {[tool.__str__() for tool in tools]}")
 
-        summaries = "NO INFO FOUND" if summaries == "" else summaries
+        deadline = self._deadline(deadline_seconds)
+        extract_docs = self._prefilter(docs, search_term, description, docs_by_id)
+        await adispatch_progress(callbacks, "extract", done=0, total=len(extract_docs))
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        scheduler = get_scheduler()
+        resource = llm_resource(self.llm)
+        config = {"callbacks": callbacks}
+        extracted_count = 0
+
+        async def extract_task(doc):
+            nonlocal extracted_count
+            inputs = self._extract_inputs(doc, description)
+            async with semaphore, scheduler.aslot(resource, self._extract_tokens(inputs)):
+                with span("extract", source=doc.metadata["source"]) as extract_span:
+                    response = await extract_chain.ainvoke(inputs, config=config)
+                report_usage(
+                    extract_span.counters.get("prompt_tokens", 0)
+                    + extract_span.counters.get("completion_tokens", 0)
+                )
+            extracted_count += 1
+            await adispatch_progress(
+                callbacks,
+                "extract",
+                done=extracted_count,
+                total=len(extract_docs),
+                source=doc.metadata["source"],
+            )
+            return doc.metadata["source"], response[extract_chain.output_key]
 
-        logger.info(f"[extract_and_combine.run] - SUMMARY: {summaries}")
-        logger.info(
-            f"[extract_and_combine.run] - SUMMARY Length: {num_tokens_from_string(summaries)}"
-        )
-        logger.info(
-            f"[extract_and_combine.run] - SUMMARY Length of each: {summary_tokens_list}"
+        extracted_docs = await self._acollect_extracts(
+            [asyncio.ensure_future(extract_task(doc)) for doc in extract_docs],
+            self._extract_buffer(description),
+            deadline,
         )
 
-        # Generate response json with the knowledge and references
-        system_message_prompt = SystemMessagePromptTemplate.from_template(
-            template=SYSTEM_PROMPT
+        relevance = self._relevance_by_source(extract_docs)
+        related = await self._atree_reduce(
+            self._related(extracted_docs), description, relevance, max_concurrency, callbacks
         )
-        human_message_prompt = HumanMessagePromptTemplate.from_template(
-            HUMAN_PROMPT, output_parser=self.output_parser
+        summaries, sumamry_id_list = self._build_summaries(
+            related, self._summary_budget(description), relevance
         )
 
-        chat_prompt = ChatPromptTemplate.from_messages(
-            [system_message_prompt, human_message_prompt]
-        )
-        response = self.llm(
-            chat_prompt.format_prompt(
-                question=description,
-                research_summary=summaries,
-                format_instructions=self.format_instructions,
-            ).to_messages()
+        await adispatch_progress(callbacks, "combine", total=len(sumamry_id_list))
+        combine_messages = self._combine_messages(description, summaries)
+        combine_tokens = estimate_tokens(*(message.content for message in combine_messages))
+        async with scheduler.aslot(resource, combine_tokens):
+            with span("combine", summaries=len(sumamry_id_list)):
+                response = await self.llm.ainvoke(combine_messages, config=config)
+
+        return self._format_response(
+            response.content, docs, tools, docs_by_id, sumamry_id_list
         )
 
-        response_json = self.output_parser.parse(response.content)
+    def _format_response(
+        self,
+        response_content: str,
+        docs: List,
+        tools: List,
+        docs_by_id: List,
+        sumamry_id_list: List,
+    ) -> Dict[str, Any]:
+        with span("combine.parse"):
+            response_json = self.output_parser.parse(response_content)
 
         # Formatting references and removing duplicates just in case
         logger.info(f"response_json: {response_json}")
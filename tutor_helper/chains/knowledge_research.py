@@ -9,10 +9,15 @@ from langchain.callbacks.manager import (
     CallbackManagerForChainRun,
 )
 from langchain.chains.base import Chain
-from tutor_helper.chains.extract_and_combine import ExtractAndCombine
+from tutor_helper.callbacks.websocket_stream import adispatch_progress
+from tutor_helper.chains.extract_and_combine import (
+    DEFAULT_MAX_CONCURRENCY,
+    ExtractAndCombine,
+)
 from tutor_helper.chains.search_tools_parallel import SearchToolsParallel
 
 from tutor_helper.common.llms import LlmLoader
+from tutor_helper.common.telemetry import traced
 
 
 from tutor_helper.tools.search.search import (
@@ -37,6 +42,11 @@ class KnowledgeResearch(Chain):
         "notes",
     ]
     output_variables: List[str] = ["content", "references"]
+    # Maximum number of extract calls in flight per research run (async only)
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    # Seconds the extract calls may take before the answer is combined without
+    # the stragglers, None for EXTRACT_DEADLINE_SECONDS
+    extract_deadline_seconds: Optional[float] = None
 
     class Config:
         """Configuration for this pydantic object."""
@@ -60,23 +70,35 @@ class KnowledgeResearch(Chain):
         """
         return self.output_variables
 
-    def _call(
-        self,
-        inputs: Dict[str, Any],
-        run_manager: Optional[CallbackManagerForChainRun] = None,
-    ) -> Dict[str, str]:
-
+    @staticmethod
+    def _parse_notes(notes: Optional[str]) -> List[str]:
         # Engineer notes
-        if inputs["notes"] is not None:
+        if notes is not None:
             # Extracting ids from the notes [hash format or KB article id]
             notes = re.findall(
-                r"([a-fA-F\d]{32})|(\d{9})", inputs["notes"]
+                r"([a-fA-F\d]{32})|(\d{9})", notes
             )
-            notes = [
+            return [
                 item[0] or item[1] for item in notes if item[0] or item[1]
             ]
-        else:
-            notes = []
+        return []
+
+    def _create_llm(self):
+        ## Creating Chat version of the 3.5
+        return LlmLoader.create_chat_llm(
+            model=LlmLoader.DEPLOYMENT_35_TURBO,
+            verbose=True,
+            request_timeout_seconds=60
+        )
+
+    @traced("knowledge_research")
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, str]:
+
+        notes = self._parse_notes(inputs["notes"])
 
         # Searching for docs
         # LLM | Getting the search term
@@ -106,12 +128,7 @@ class KnowledgeResearch(Chain):
         )
         logger.info(f"[chains.ts.int_research._call] - Found docs: {len(docs)}")
 
-        ## Creating Chat version of the 3.5
-        llm = LlmLoader.create_chat_llm(
-            model=LlmLoader.DEPLOYMENT_35_TURBO,
-            verbose=True,
-            request_timeout_seconds=60
-        )
+        llm = self._create_llm()
 
         # Extract and summarize the content
         extractAndCombine = ExtractAndCombine(llm)
@@ -124,6 +141,7 @@ class KnowledgeResearch(Chain):
                 description=inputs["revised_question"],
                 tools=self.tools,
                 docs_by_id=notes,
+                deadline_seconds=self.extract_deadline_seconds,
             )
         except Exception as e:
             logger.error(f"Error running ExtractAndCombine: {e}")
@@ -132,31 +150,55 @@ class KnowledgeResearch(Chain):
 
         return response_json
 
+    @traced("knowledge_research")
     async def _acall(
         self,
         inputs: Dict[str, Any],
         run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
     ) -> Dict[str, str]:
-        # Your custom chain logic goes here
-        # This is just an example that mimics LLMChain
-        prompt_value = self.prompt.format_prompt(**inputs)
-
-        # Whenever you call a language model, or another chain, you should pass
-        # a callback manager to it. This allows the inner run to be tracked by
-        # any callbacks that are registered on the outer run.
-        # You can always obtain a callback manager for this by calling
-        # `run_manager.get_child()` as shown below.
-        response = await self.llm.agenerate_prompt(
-            [prompt_value], callbacks=run_manager.get_child() if run_manager else None
+        notes = self._parse_notes(inputs["notes"])
+        callbacks = run_manager.get_child() if run_manager else None
+
+        search_term = inputs["description"]
+        logger.info(f"[chains.ts.int_research._acall] - Search term: {search_term}")
+        await adispatch_progress(callbacks, "search", search_term=search_term)
+
+        # Tool searches are awaited concurrently
+        search_tools_parallel_chain = SearchToolsParallel(self.tools)
+        raw_docs = await search_tools_parallel_chain.arun(
+            search_term, [], notes
         )
+        raw_docs = search_tools_parallel_chain.chunk(raw_docs)
+        docs = search_tools_parallel_chain.transform(raw_docs)
 
-        # If you want to log something about this run, you can do so by calling
-        # methods on the `run_manager`, as shown below. This will trigger any
-        # callbacks that are registered for that event.
-        if run_manager:
-            await run_manager.on_text("Log something about this run")
+        logger.info(
+            f"[chains.ts.int_research._acall] - Found raw_docs: {len(raw_docs)}"
+        )
+        logger.info(f"[chains.ts.int_research._acall] - Found docs: {len(docs)}")
+
+        llm = self._create_llm()
 
-        return {self.output_key: response.generations[0][0].text}
+        # Extract calls run concurrently, bounded by max_concurrency
+        extractAndCombine = ExtractAndCombine(llm)
+        # Default response here to avoid error
+        response_json = extractAndCombine.output_parser.get_default_response()
+        try:
+            response_json = await extractAndCombine.arun(
+                docs=docs,
+                search_term=search_term,
+                description=inputs["revised_question"],
+                tools=self.tools,
+                docs_by_id=notes,
+                max_concurrency=self.max_concurrency,
+                callbacks=callbacks,
+                deadline_seconds=self.extract_deadline_seconds,
+            )
+        except Exception as e:
+            logger.error(f"Error running ExtractAndCombine: {e}")
+
+        logger.info(response_json)
+
+        return response_json
 
     @property
     def _chain_type(self) -> str:
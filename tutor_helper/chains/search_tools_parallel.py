@@ -1,8 +1,13 @@
-from tutor_helper.tools.utilities.utils import num_tokens_from_string, split_by_token
+from tutor_helper.tools.utilities.utils import num_tokens_from_strings
+from tutor_helper.tools.utilities.trimming import split_to_token_chunks
+from tutor_helper.common.scheduler import get_scheduler
+from tutor_helper.common.telemetry import current_span, traced
+from tutor_helper.tools.search.local_index import index_documents
 from langchain.docstore.document import Document
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from typing import Any, Dict, List, Optional
+import asyncio
 import concurrent.futures
 import unicodedata
 import re
@@ -13,24 +18,29 @@ class SearchToolsParallel:
     def __init__(self, tools: List):
         self.tools = tools
 
+    @traced("search.run")
     def run(self, search_term: str, product: str, docs_by_id: List = []):
         raw_docs = []
 
-        # Create tasks for each tool and gather the results
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # Submit the tasks to the executor
-            future_results = [
-                executor.submit(
-                    self.execute_tool_with_trace, tool, search_term, product, docs_by_id
-                )
-                for tool in self.tools
-            ]
+        # Create tasks for each tool in the shared scheduler and gather the results
+        scheduler = get_scheduler()
+        future_results = [
+            scheduler.submit(
+                self.execute_tool_with_trace,
+                tool,
+                search_term,
+                product,
+                docs_by_id,
+                resource=self.tool_resource(tool),
+            )
+            for tool in self.tools
+        ]
 
-            # Collect the results as they complete
-            response_docs = [
-                future.result()
-                for future in concurrent.futures.as_completed(future_results)
-            ]
+        # Collect the results as they complete
+        response_docs = [
+            future.result()
+            for future in concurrent.futures.as_completed(future_results)
+        ]
 
         # Flatten the results
         for docs in response_docs:
@@ -38,7 +48,36 @@ class SearchToolsParallel:
 
         return raw_docs
 
+    @traced("search.run")
+    async def arun(self, search_term: str, product: str, docs_by_id: List = []):
+        """Async version of `run`, the tool searches are awaited concurrently."""
+        # Tools search over blocking HTTP clients, run each one in the scheduler workers
+        scheduler = get_scheduler()
+        response_docs = await asyncio.gather(
+            *(
+                scheduler.run(
+                    self.execute_tool_with_trace,
+                    tool,
+                    search_term,
+                    product,
+                    docs_by_id,
+                    resource=self.tool_resource(tool),
+                )
+                for tool in self.tools
+            )
+        )
+
+        # Flatten the results
+        return [doc for docs in response_docs for doc in docs]
+
+    @staticmethod
+    def tool_resource(tool) -> str:
+        """Scheduler resource of a search tool, budgets are set per tool."""
+        return f"search:{tool.name}"
+
+    @traced("search.tool")
     def execute_tool_with_trace(self, tool, search_term, product, docs_by_id):
+        current_span().set("tool", tool.name)
         response = tool.from_description(search_term)
 
         if len(docs_by_id) > 0:
@@ -46,26 +85,27 @@ class SearchToolsParallel:
 
             response.extend(from_notes)
 
-
+        index_documents(response)
         return response
 
+    @traced("search.chunk")
     def chunk(self, docs: List, token_length: int = 3072):
         # Splitting documents which content is > than XXXX tokens
         # Create multiple documents with the same metadata and splitted content
         # This is to avoid the 2048 tokens limit of the LLM
 
         new_docs = []
-        for doc in docs:
-            content_length = num_tokens_from_string(doc["content"])
+        content_lengths = num_tokens_from_strings([doc["content"] for doc in docs])
+        for doc, content_length in zip(docs, content_lengths):
             if content_length > token_length:
                 # Split the content into chunks
-                # TODO: remove the fallback if split_by_token is stable
+                # TODO: remove the fallback if split_to_token_chunks is stable
                 try:
-                    splitted_content = split_by_token(
-                        string=doc["content"], chunk_length=token_length
+                    splitted_content = split_to_token_chunks(
+                        doc["content"], chunk_length=token_length
                     )
                 except Exception as e:
-                    print(f"Error while calling split_by_token(): {e}")
+                    print(f"Error while calling split_to_token_chunks(): {e}")
                     content_words = doc["content"].split()
                     splitted_content = [
                         " ".join(content_words[i : i + token_length])
@@ -83,6 +123,7 @@ class SearchToolsParallel:
 
         return new_docs
 
+    @traced("search.transform")
     def transform(self, docs: List):
 
         transformed_docs = []
@@ -95,12 +136,18 @@ class SearchToolsParallel:
                 content,
             )
 
+            metadata = {k: v for k, v in doc.items() if k != "content"}
+            # Extract & combine identify and reference docs by these keys
+            metadata.setdefault("source", doc["id"])
+            metadata.setdefault("pulled_by", doc["tool"])
+            metadata.setdefault("visibility", "public")
+
             doc_object = Document(
                 page_content="Title: "
                 + doc["title"]
                 + "\n"
                 + content,
-                metadata={k: v for k, v in doc.items() if k != "content"},
+                metadata=metadata,
             )
 
             transformed_docs.append(doc_object)
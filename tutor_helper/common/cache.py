@@ -0,0 +1,339 @@
+"""Response caches with TTL and size-based eviction.
+
+`MemoryStore` (in-process LRU) and `SQLiteStore` (on disk, shared between
+workers and restarts) hold values under string keys, `TieredStore` chains
+them. `LlmResponseCache`
+puts either store behind langchain's `BaseCache` interface, so that it can be
+set as the `cache` of the clients built by `LlmLoader` and every chain reuses
+answers to prompts it has already sent with the same deployment and params.
+
+The backend is selected with `LLM_CACHE_BACKEND` (memory | sqlite | none).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+from tutor_helper.common.telemetry import record_cache_lookup
+
+import logging
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # memory | sqlite | none
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_SQLITE_PATH = os.getenv(
+    "LLM_CACHE_SQLITE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "tutor_helper", "llm_cache.sqlite"),
+)
+
+
+def cache_key(*parts: str) -> str:
+    """Stable hash of the given parts, used as the cache key."""
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class CacheStats:
+    """Hit/miss counters shared by the stores."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "updates": self.updates,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MemoryStore:
+    """In-process LRU store with a TTL per entry."""
+
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl_seconds: Optional[float] = LLM_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = CacheStats()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at and expires_at < now:
+                del self._entries[key]
+                self.counters.expired += 1
+                self.counters.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else 0.0
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            self.counters.updates += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                **self.counters.as_dict(),
+            }
+
+
+class SQLiteStore:
+    """On-disk store with a TTL per entry, least recently used entries are evicted first."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_SQLITE_PATH,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        ttl_seconds: Optional[float] = LLM_CACHE_TTL_SECONDS,
+        table: str = "llm_cache",
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.table = table
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)"
+        )
+        self._connection.commit()
+        self._lock = threading.Lock()
+        self.counters = CacheStats()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.counters.misses += 1
+                return None
+            value, expires_at = row
+            if expires_at and expires_at < now:
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._connection.commit()
+                self.counters.expired += 1
+                self.counters.misses += 1
+                return None
+            self._connection.execute(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+            self.counters.hits += 1
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else 0.0
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self.counters.updates += 1
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        self._connection.execute(
+            f"DELETE FROM {self.table} WHERE expires_at > 0 AND expires_at < ?", (now,)
+        )
+        (count,) = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        if count > self.max_entries:
+            self._connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.counters.evictions += count - self.max_entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table}")
+            self._connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            **self.counters.as_dict(),
+        }
+
+
+class TieredStore:
+    """Memory store in front of an optional on-disk store.
+
+    Disk hits are promoted to memory. Values are kept as objects in memory and
+    serialized with `serialize`/`deserialize` on disk.
+    """
+
+    def __init__(
+        self,
+        memory: MemoryStore,
+        disk: Optional[SQLiteStore] = None,
+        serialize: Callable[[Any], str] = json.dumps,
+        deserialize: Callable[[str], Any] = json.loads,
+    ):
+        self.memory = memory
+        self.disk = disk
+        self.serialize = serialize
+        self.deserialize = deserialize
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        serialized = self.disk.get(key)
+        if serialized is None:
+            return None
+        try:
+            value = self.deserialize(serialized)
+        except Exception as e:
+            logger.warning(f"[TieredStore] - Ignoring unreadable cache entry: {e}")
+            return None
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, self.serialize(value))
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.memory.stats()
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+class LlmResponseCache(BaseCache):
+    """langchain cache keyed by a hash of the llm configuration and the rendered prompt."""
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return cache_key(llm_string, prompt)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self.store.get(self._key(prompt, llm_string))
+        record_cache_lookup(value is not None)
+        if value is None or isinstance(self.store, MemoryStore):
+            return value
+        try:
+            return [loads(generation) for generation in json.loads(value)]
+        except Exception as e:
+            logger.warning(f"[LlmResponseCache] - Ignoring unreadable cache entry: {e}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key(prompt, llm_string)
+        if isinstance(self.store, MemoryStore):
+            self.store.set(key, return_val)
+        else:
+            self.store.set(key, json.dumps([dumps(generation) for generation in return_val]))
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if isinstance(self.store, MemoryStore):
+            return self.lookup(prompt, llm_string)
+        return await super().alookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if isinstance(self.store, MemoryStore):
+            return self.update(prompt, llm_string, return_val)
+        return await super().aupdate(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self.store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.store.stats()
+
+
+_llm_cache: Optional[LlmResponseCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LlmResponseCache]:
+    """Returns the process-wide LLM response cache, None when disabled."""
+    global _llm_cache
+    if _llm_cache is None and LLM_CACHE_BACKEND != "none":
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                if LLM_CACHE_BACKEND == "sqlite":
+                    store = SQLiteStore()
+                else:
+                    store = MemoryStore()
+                _llm_cache = LlmResponseCache(store)
+                logger.info(f"[cache] - Created LLM response cache: {_llm_cache.stats()}")
+    return _llm_cache
@@ -0,0 +1,182 @@
+"""Process-wide pool of LLM clients.
+
+`LlmLoader` used to build a new client, each with its own HTTP connection
+pool, on every call. Clients are now memoized by their configuration and all
+clients of an endpoint share one keep-alive HTTP pool, so hot paths reuse
+open TLS connections instead of opening new ones.
+
+Clients are shared between threads and requests: per-request state such as
+streaming callbacks must be passed at call time (`config={"callbacks": ...}`),
+not at construction.
+"""
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import httpx
+
+from tutor_helper.common.telemetry import record_http_response
+
+import logging
+logger = logging.getLogger(__name__)
+
+LLM_CLIENT_POOL_SIZE = int(os.getenv("LLM_CLIENT_POOL_SIZE", "32"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+def callbacks_key(callbacks: Any) -> tuple:
+    """Identifies callbacks by their handler instances.
+
+    Clients built with different handlers are kept apart. A pooled client holds
+    its handlers, so their ids are not reused while the client is in the pool.
+    """
+    handlers = getattr(callbacks, "handlers", callbacks) or []
+    return tuple(id(handler) for handler in handlers)
+
+
+def _on_response(response: httpx.Response) -> None:
+    record_http_response(response.status_code)
+
+
+async def _aon_response(response: httpx.Response) -> None:
+    record_http_response(response.status_code)
+
+
+class HttpPool:
+    """Sync and async keep-alive HTTP clients of one endpoint."""
+
+    def __init__(self, endpoint: str, limits: httpx.Limits):
+        self.endpoint = endpoint
+        # Every response is counted, which makes the client's retries visible
+        self.client = httpx.Client(limits=limits, event_hooks={"response": [_on_response]})
+        self.async_client = httpx.AsyncClient(
+            limits=limits, event_hooks={"response": [_aon_response]}
+        )
+
+    def close(self) -> None:
+        """Closes both clients, the async one on the running loop if there is one."""
+        self.client.close()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.async_client.aclose())
+        else:
+            loop.create_task(self.async_client.aclose())
+
+    async def aclose(self) -> None:
+        self.client.close()
+        await self.async_client.aclose()
+
+
+class LlmClientRegistry:
+    def __init__(
+        self,
+        max_size: int = LLM_CLIENT_POOL_SIZE,
+        max_connections: int = LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_HTTP_KEEPALIVE_EXPIRY,
+    ):
+        self.max_size = max_size
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._http_pools: Dict[str, HttpPool] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def http_pool(self, endpoint: str) -> HttpPool:
+        with self._lock:
+            pool = self._http_pools.get(endpoint)
+            if pool is None:
+                pool = HttpPool(endpoint, self.limits)
+                self._http_pools[endpoint] = pool
+            return pool
+
+    def share_http_pool(self, llm: Any, endpoint: str) -> Any:
+        """Rebinds the OpenAI clients of `llm` onto the shared pool of `endpoint`."""
+        pool = self.http_pool(endpoint)
+        for attr, http_client in (
+            ("client", pool.client),
+            ("async_client", pool.async_client),
+        ):
+            resource = getattr(llm, attr, None)
+            openai_client = getattr(resource, "_client", None)
+            if openai_client is None:
+                continue
+            shared_client = openai_client.with_options(http_client=http_client)
+            setattr(llm, attr, type(resource)(shared_client))
+        return llm
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Returns the client of `key`, building it with `factory` on a miss."""
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+            self.misses += 1
+
+            client = factory()
+            self._clients[key] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "clients": len(self._clients),
+                "max_size": self.max_size,
+                "http_pools": len(self._http_pools),
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    def _take_http_pools(self) -> List[HttpPool]:
+        with self._lock:
+            self._clients.clear()
+            pools = list(self._http_pools.values())
+            self._http_pools.clear()
+            self.hits = self.misses = self.evictions = 0
+            return pools
+
+    def clear(self) -> None:
+        for pool in self._take_http_pools():
+            pool.close()
+
+    async def aclose(self) -> None:
+        """Drops the clients and closes their HTTP pools, called at shutdown."""
+        for pool in self._take_http_pools():
+            await pool.aclose()
+
+
+_registry: Optional[LlmClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_client_registry() -> LlmClientRegistry:
+    """Returns the process-wide client registry, created on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = LlmClientRegistry()
+    return _registry
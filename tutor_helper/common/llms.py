@@ -4,15 +4,141 @@ from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 from langchain_community.llms import OpenAI, AzureOpenAI
 
+from tutor_helper.callbacks.metrics import MetricsCallbackHandler
 from tutor_helper.callbacks.stdout_all import StdOutAllCallbackHandler
+from tutor_helper.callbacks.structured_log import StructuredLogCallbackHandler
+from tutor_helper.common.cache import get_llm_cache
+from tutor_helper.common.llm_pool import callbacks_key, get_client_registry
+from tutor_helper.common.retry import acall_with_retry, call_with_retry
 
-from typing import Optional
+from pydantic import PrivateAttr
+from typing import Any, Callable, Dict, Optional
+
+import contextvars
+import json
+import threading
 
 import os
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Handlers attached to every client, comma separated: metrics, log, stdout
+LLM_CALLBACKS = os.getenv("LLM_CALLBACKS", "metrics,log")
+CALLBACK_HANDLERS = {
+    "metrics": MetricsCallbackHandler,
+    "log": StructuredLogCallbackHandler,
+    "stdout": StdOutAllCallbackHandler,
+}
+# One instance per handler, so that clients with the default callbacks are pooled together
+_default_handlers: Dict[str, Any] = {}
+_default_handlers_lock = threading.Lock()
+# Calls that keep failing go to a sibling deployment, see tutor_helper.common.retry
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "true").lower() == "true"
+
+
+def _fallback_deployments() -> Dict[str, str]:
+    # Overrides of the sibling deployments, as JSON: {"gpt-35-turbo": "gpt-35-turbo-16k"}
+    try:
+        deployments = json.loads(os.getenv("LLM_FALLBACK_DEPLOYMENTS", "{}"))
+    except ValueError as e:
+        logger.error(f"[llms] - Invalid LLM_FALLBACK_DEPLOYMENTS, ignored: {e}")
+        return {}
+    if not isinstance(deployments, dict):
+        logger.error("[llms] - LLM_FALLBACK_DEPLOYMENTS is not a JSON object, ignored")
+        return {}
+    return deployments
+
+
+LLM_FALLBACK_DEPLOYMENTS = _fallback_deployments()
+
+
+class _StreamProgress:
+    """Whether the streamed call of the current generate has emitted a chunk."""
+
+    def __init__(self):
+        self.started = False
+
+
+_stream_progress: contextvars.ContextVar[Optional[_StreamProgress]] = contextvars.ContextVar(
+    "tutor_helper_stream_progress", default=None
+)
+
+
+class RetryingLlmMixin:
+    """Routes the generate calls of an Azure client through the retry layer.
+
+    The client itself is created with `max_retries=0`, the retries of the
+    OpenAI SDK would otherwise run first, in lockstep. A streamed call is
+    only retried, or sent to the fallback, before its first chunk: the
+    callbacks have seen the tokens of that chunk already, a new stream under
+    the same run would repeat them.
+    """
+
+    def _fallback_call(self, method: str, *args, **kwargs) -> Optional[Callable]:
+        if self._fallback_factory is None:
+            return None
+        return lambda: getattr(self._fallback_factory(), method)(*args, **kwargs)
+
+    # `run_manager` is named, langchain only passes it to the methods declaring it
+    def _generate(self, *args, run_manager=None, **kwargs):
+        kwargs["run_manager"] = run_manager
+        progress = _StreamProgress()
+        token = _stream_progress.set(progress)
+        try:
+            return call_with_retry(
+                self.deployment_name,
+                lambda: super(RetryingLlmMixin, self)._generate(*args, **kwargs),
+                self._max_retries,
+                fallback=self._fallback_call("_generate", *args, **kwargs),
+                fallback_name=self._fallback_deployment,
+                restartable=lambda: not progress.started,
+            )
+        finally:
+            _stream_progress.reset(token)
+
+    async def _agenerate(self, *args, run_manager=None, **kwargs):
+        kwargs["run_manager"] = run_manager
+        progress = _StreamProgress()
+        token = _stream_progress.set(progress)
+        try:
+            return await acall_with_retry(
+                self.deployment_name,
+                lambda: super(RetryingLlmMixin, self)._agenerate(*args, **kwargs),
+                self._max_retries,
+                fallback=self._fallback_call("_agenerate", *args, **kwargs),
+                fallback_name=self._fallback_deployment,
+                restartable=lambda: not progress.started,
+            )
+        finally:
+            _stream_progress.reset(token)
+
+    def _stream(self, *args, **kwargs):
+        progress = _stream_progress.get()
+        for chunk in super()._stream(*args, **kwargs):
+            if progress is not None:
+                progress.started = True
+            yield chunk
+
+    async def _astream(self, *args, **kwargs):
+        progress = _stream_progress.get()
+        async for chunk in super()._astream(*args, **kwargs):
+            if progress is not None:
+                progress.started = True
+            yield chunk
+
+
+class RetryingAzureChatOpenAI(RetryingLlmMixin, AzureChatOpenAI):
+    _max_retries: int = PrivateAttr(default=2)
+    _fallback_deployment: str = PrivateAttr(default="")
+    _fallback_factory: Optional[Callable[[], Any]] = PrivateAttr(default=None)
+
+
+class RetryingAzureOpenAI(RetryingLlmMixin, AzureOpenAI):
+    _max_retries: int = PrivateAttr(default=2)
+    _fallback_deployment: str = PrivateAttr(default="")
+    _fallback_factory: Optional[Callable[[], Any]] = PrivateAttr(default=None)
+
 
 class LlmLoader:
     
@@ -35,7 +161,12 @@ class LlmLoader:
         "gpt-4-32k": 32000,
     }
 
-    """Creates an instance to communicate with LLM API."""
+    """Creates an instance to communicate with LLM API.
+
+    Instances are memoized by their configuration and share one keep-alive HTTP
+    pool per endpoint, see `tutor_helper.common.llm_pool`. They are shared by
+    callers, so per-request callbacks go in the invoke config.
+    """
 
     @staticmethod
     def create_llm(
@@ -45,33 +176,63 @@ class LlmLoader:
         request_timeout_seconds: Optional[int] = 40,
         max_retries: Optional[int] = 2,
         api_version="2024-02-01",
-        callbacks: Callbacks = [StdOutAllCallbackHandler()],
+        callbacks: Callbacks = None,
         verbose=False,
+        cache: Optional[bool] = None,
+        fallback: Optional[bool] = None,
     ):
 
+        callbacks = LlmLoader.default_callbacks() if callbacks is None else callbacks
+        fallback_model = LlmLoader.sibling_deployment(model) if fallback is not False else None
+        # Responses are cached unless cache=False, see tutor_helper.common.cache
+        llm_cache = None if cache is False else get_llm_cache()
+
         # Creating LLM instance based on configurations
         if os.getenv("OPENAI_API_TYPE") == "azure":
             random_openai_api_base, random_openai_api_key = os.getenv(f"OPENAI_API_BASE"), os.getenv(f"OPENAI_API_KEY")
-            logger.info( f"[llms.create_llm] - Using Azure API: {random_openai_api_base}" )
-            print( f"[llms.create_llm] - Using Azure API: {random_openai_api_base} with model [{model}]" )
-            return AzureOpenAI(
-                callbacks=callbacks,
-                azure_deployment=model,
-                azure_endpoint=random_openai_api_base,
-                max_retries=max_retries,
-                openai_api_key=random_openai_api_key,
-                openai_api_version=api_version,
-                request_timeout=request_timeout_seconds,
-                temperature=temperature,
-                verbose=verbose,
-                model_kwargs={
-                    "top_p": top_p,
-                },
+            key = (
+                "llm", random_openai_api_base, model, temperature, top_p,
+                request_timeout_seconds, max_retries, api_version, verbose,
+                callbacks_key(callbacks), llm_cache is None, fallback_model,
             )
+
+            def factory():
+                logger.info( f"[llms.create_llm] - Using Azure API: {random_openai_api_base} with model [{model}]" )
+                llm = RetryingAzureOpenAI(
+                    callbacks=callbacks,
+                    azure_deployment=model,
+                    azure_endpoint=random_openai_api_base,
+                    max_retries=0,
+                    openai_api_key=random_openai_api_key,
+                    openai_api_version=api_version,
+                    request_timeout=request_timeout_seconds,
+                    temperature=temperature,
+                    verbose=verbose,
+                    cache=llm_cache,
+                    model_kwargs={
+                        "top_p": top_p,
+                    },
+                )
+                llm._max_retries = max_retries
+                if fallback_model:
+                    llm._fallback_deployment = fallback_model
+                    llm._fallback_factory = lambda: LlmLoader.create_llm(
+                        model=fallback_model, temperature=temperature, top_p=top_p,
+                        request_timeout_seconds=request_timeout_seconds, max_retries=max_retries,
+                        api_version=api_version, callbacks=callbacks, verbose=verbose,
+                        cache=cache, fallback=False,
+                    )
+                return get_client_registry().share_http_pool(llm, random_openai_api_base)
         else:
-            return OpenAI(
-                temperature=temperature, callbacks=callbacks, request_timeout=1200
-            )
+            key = ("llm", "openai", temperature, callbacks_key(callbacks), llm_cache is None)
+
+            def factory():
+                llm = OpenAI(
+                    temperature=temperature, callbacks=callbacks, request_timeout=1200, cache=llm_cache
+                )
+                return get_client_registry().share_http_pool(llm, "openai")
+
+        return get_client_registry().get_or_create(key, factory)
 
     """Creates a instance to communicate with LLM API."""
 
@@ -83,34 +244,108 @@ class LlmLoader:
         request_timeout_seconds: Optional[int] = 40,
         max_retries: Optional[int] = 2,
         api_version="2024-02-01",
-        callbacks: Callbacks = [StdOutAllCallbackHandler()],
+        callbacks: Callbacks = None,
         verbose=False,
+        cache: Optional[bool] = None,
+        fallback: Optional[bool] = None,
         **kwargs,
     ):
+        callbacks = LlmLoader.default_callbacks() if callbacks is None else callbacks
+        fallback_model = LlmLoader.sibling_deployment(model) if fallback is not False else None
+        # Responses are cached unless cache=False, see tutor_helper.common.cache
+        llm_cache = None if cache is False else get_llm_cache()
+
         # Creating LLM instance based on configurations
         if os.getenv("OPENAI_API_TYPE") == "azure":
-            random_openai_api_base, random_openai_api_key = os.getenv(f"OPENAI_API_BASE"), os.getenv(f"OPENAI_API_KEY")            
-            logger.info( f"[llms.create_chat_llm] - Using Azure API: {random_openai_api_base}" )
-            print( f"[llms.create_llm] - Using Azure API: {random_openai_api_base} with model [{model}]" )
-            return AzureChatOpenAI(
-                callbacks=callbacks,
-                azure_deployment=model,
-                azure_endpoint=random_openai_api_base,
-                max_retries=max_retries,
-                openai_api_key=random_openai_api_key,
-                openai_api_version=api_version,
-                request_timeout=request_timeout_seconds,
-                temperature=temperature,
-                verbose=verbose,
-                model_kwargs={
-                    "top_p": top_p,
-                },
-                **(kwargs or {}),
+            random_openai_api_base, random_openai_api_key = os.getenv(f"OPENAI_API_BASE"), os.getenv(f"OPENAI_API_KEY")
+            key = (
+                "chat", random_openai_api_base, model, temperature, top_p,
+                request_timeout_seconds, max_retries, api_version, verbose,
+                callbacks_key(callbacks), llm_cache is None, repr(sorted(kwargs.items())),
+                fallback_model,
             )
+
+            def factory():
+                logger.info( f"[llms.create_chat_llm] - Using Azure API: {random_openai_api_base} with model [{model}]" )
+                llm = RetryingAzureChatOpenAI(
+                    callbacks=callbacks,
+                    azure_deployment=model,
+                    azure_endpoint=random_openai_api_base,
+                    max_retries=0,
+                    openai_api_key=random_openai_api_key,
+                    openai_api_version=api_version,
+                    request_timeout=request_timeout_seconds,
+                    temperature=temperature,
+                    verbose=verbose,
+                    cache=llm_cache,
+                    model_kwargs={
+                        "top_p": top_p,
+                    },
+                    **(kwargs or {}),
+                )
+                llm._max_retries = max_retries
+                if fallback_model:
+                    llm._fallback_deployment = fallback_model
+                    llm._fallback_factory = lambda: LlmLoader.create_chat_llm(
+                        model=fallback_model, temperature=temperature, top_p=top_p,
+                        request_timeout_seconds=request_timeout_seconds, max_retries=max_retries,
+                        api_version=api_version, callbacks=callbacks, verbose=verbose,
+                        cache=cache, fallback=False, **kwargs,
+                    )
+                return get_client_registry().share_http_pool(llm, random_openai_api_base)
         else:
-            return OpenAI(
-                temperature=temperature, callbacks=callbacks, request_timeout=request_timeout_seconds
-            )
+            key = ("chat", "openai", temperature, request_timeout_seconds, callbacks_key(callbacks), llm_cache is None)
+
+            def factory():
+                llm = OpenAI(
+                    temperature=temperature, callbacks=callbacks, request_timeout=request_timeout_seconds, cache=llm_cache
+                )
+                return get_client_registry().share_http_pool(llm, "openai")
+
+        return get_client_registry().get_or_create(key, factory)
+
+    @staticmethod
+    def sibling_deployment(model: Optional[str]) -> Optional[str]:
+        """The deployment calls to `model` fall back to.
+
+        `LLM_FALLBACK_DEPLOYMENTS` first, otherwise the deployment of
+        `TOKEN_LIMITS_` with the smallest token limit that still fits the
+        prompts of `model`.
+        """
+        if not LLM_FALLBACK_ENABLED or model is None:
+            return None
+        if model in LLM_FALLBACK_DEPLOYMENTS:
+            return LLM_FALLBACK_DEPLOYMENTS[model] or None
+        limit = LlmLoader.TOKEN_LIMITS_.get(model)
+        if limit is None:
+            return None
+        siblings = sorted(
+            (sibling_limit, name)
+            for name, sibling_limit in LlmLoader.TOKEN_LIMITS_.items()
+            if name != model and sibling_limit >= limit
+        )
+        return siblings[0][1] if siblings else None
+
+    @staticmethod
+    def default_callbacks() -> list:
+        """Handlers selected by `LLM_CALLBACKS`, used when no callbacks are given."""
+        names = [name.strip() for name in LLM_CALLBACKS.split(",") if name.strip()]
+        with _default_handlers_lock:
+            for name in names:
+                if name in CALLBACK_HANDLERS and name not in _default_handlers:
+                    _default_handlers[name] = CALLBACK_HANDLERS[name]()
+            return [_default_handlers[name] for name in names if name in CALLBACK_HANDLERS]
+
+    @staticmethod
+    def client_stats() -> dict:
+        """Hit/miss and pool statistics of the shared LLM client registry."""
+        return get_client_registry().stats()
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Hit/miss statistics of the LLM response cache."""
+        llm_cache = get_llm_cache()
+        return llm_cache.stats() if llm_cache else {"backend": "none"}
 
     @staticmethod
     def create_chain(
@@ -0,0 +1,171 @@
+"""Bounded worker pool to run blocking work off the event loop.
+
+The FastAPI endpoints are `async def`, so any synchronous chain, search or
+LLM call made directly in them stalls every other connection of the worker.
+Blocking calls are submitted here instead and awaited. The pool is bounded:
+once `max_workers` calls are running and `max_queue` more are waiting, new
+calls are rejected with `OffloadQueueFull` rather than piling up.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+OFFLOAD_EXECUTOR = os.getenv("OFFLOAD_EXECUTOR", "thread")  # thread | process
+OFFLOAD_MAX_WORKERS = int(os.getenv("OFFLOAD_MAX_WORKERS", "16"))
+OFFLOAD_MAX_QUEUE = int(os.getenv("OFFLOAD_MAX_QUEUE", "64"))
+
+
+class OffloadQueueFull(RuntimeError):
+    """Raised when the pool has no free worker and its queue is full."""
+
+
+def _timed_call(func: Callable, args: Tuple, kwargs: Dict) -> Tuple[Any, float, float]:
+    # Module level so that it can be pickled by the process pool
+    started_at = time.time()
+    result = func(*args, **kwargs)
+    return result, started_at, time.time()
+
+
+class OffloadPool:
+    def __init__(
+        self,
+        max_workers: int = OFFLOAD_MAX_WORKERS,
+        max_queue: int = OFFLOAD_MAX_QUEUE,
+        kind: str = OFFLOAD_EXECUTOR,
+    ):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        if kind == "process":
+            self._executor: Executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="offload"
+            )
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    def _run_in_thread(self, func: Callable, args: Tuple, kwargs: Dict):
+        with self._lock:
+            self.running += 1
+        try:
+            return _timed_call(func, args, kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def _on_done(self, submitted_at: float, future: Future) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+                return
+            _, started_at, finished_at = future.result()
+            wait_seconds = max(started_at - submitted_at, 0.0)
+            self.completed += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self.run_seconds_total += finished_at - started_at
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """Submits `func(*args, **kwargs)` to the pool.
+
+        Raises:
+            OffloadQueueFull: if all workers are busy and the queue is full
+        """
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise OffloadQueueFull(
+                    f"Offload pool is full ({self.in_flight} calls in flight)"
+                )
+            self.in_flight += 1
+            self.submitted += 1
+
+        submitted_at = time.time()
+        try:
+            if self.kind == "process":
+                future = self._executor.submit(_timed_call, func, args, kwargs)
+            else:
+                # Keep context variables (request ids, tracing) in the worker thread
+                context = contextvars.copy_context()
+                future = self._executor.submit(
+                    context.run, self._run_in_thread, func, args, kwargs
+                )
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(functools.partial(self._on_done, submitted_at))
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Runs `func(*args, **kwargs)` in the pool and awaits its result."""
+        result, _, _ = await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.kind == "process":
+                # Process workers do not report when they pick up a call
+                queue_depth = max(self.in_flight - self.max_workers, 0)
+            else:
+                queue_depth = self.in_flight - self.running
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_avg": self.wait_seconds_total / self.completed
+                if self.completed
+                else 0.0,
+                "wait_seconds_max": self.wait_seconds_max,
+                "run_seconds_avg": self.run_seconds_total / self.completed
+                if self.completed
+                else 0.0,
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pool: Optional[OffloadPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_offload_pool() -> OffloadPool:
+    """Returns the process-wide offload pool, created on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OffloadPool()
+                logger.info(f"[offload] - Created pool: {_pool.stats()}")
+    return _pool
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Runs a blocking call in the shared offload pool."""
+    return await get_offload_pool().run(func, *args, **kwargs)
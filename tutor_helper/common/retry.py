@@ -0,0 +1,309 @@
+"""Rate limit aware retries, circuit breakers and fallbacks of the LLM calls.
+
+The OpenAI SDK retries on its own with a short, nearly fixed delay, so a fan-out
+hitting a 429 retries in lockstep and hits it again. The LLM clients created by
+`LlmLoader` disable those retries and go through `call_with_retry` instead:
+
+- a retryable error (429, 408, 409, 5xx, timeouts, connection errors) is
+  retried after the `Retry-After` of the response, or after a full-jitter
+  exponential backoff when there is none;
+- consecutive retryable failures of a deployment open its circuit breaker,
+  further calls fail fast until `LLM_BREAKER_COOLDOWN_SECONDS` have passed and
+  a trial call succeeds;
+- when the retries are exhausted, the wait would exceed the deadline or the
+  breaker is open, the call falls back to a sibling deployment, if any.
+"""
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+import openai
+
+from tutor_helper.common import telemetry
+
+import logging
+logger = logging.getLogger(__name__)
+
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+# Retries stop, and the call falls back, once this much time has been spent
+LLM_RETRY_DEADLINE_SECONDS = float(os.getenv("LLM_RETRY_DEADLINE_SECONDS", "60"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+RETRIES = telemetry.get_metrics_registry().counter(
+    "tutor_helper_llm_retries_total", "LLM calls retried by deployment and reason."
+)
+FALLBACKS = telemetry.get_metrics_registry().counter(
+    "tutor_helper_llm_fallbacks_total", "LLM calls sent to a sibling deployment."
+)
+BREAKER_OPENED = telemetry.get_metrics_registry().counter(
+    "tutor_helper_llm_circuit_opened_total", "Circuit breakers opened by deployment."
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a deployment's circuit breaker is open and there is no fallback."""
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code
+    return None
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why `error` is worth retrying, None if it is not."""
+    status_code = _status_code(error)
+    if status_code is not None:
+        return f"status_{status_code}" if status_code in RETRYABLE_STATUS_CODES else None
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException)):
+        return "timeout"
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return "connection"
+    return None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """The delay the server asked for in the `Retry-After` headers of the response."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                # An HTTP date
+                return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def backoff_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Delay before retry `attempt` (from 0), jittered so that parallel calls spread out."""
+    if retry_after is not None:
+        # Not before the server asked, with some jitter on top
+        return retry_after + random.uniform(0, LLM_RETRY_BASE_SECONDS)
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Consecutive failure breaker: closed, open for a cooldown, then half open."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = LLM_BREAKER_FAILURES,
+        cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def acquire(self) -> Tuple[bool, bool]:
+        """Whether a call may go to the deployment, and whether it is the half open trial."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True, False
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True, True
+            return False, False
+
+    def allow(self) -> bool:
+        """Whether a call may go to the deployment, only one trial call when half open."""
+        return self.acquire()[0]
+
+    def release_trial(self) -> None:
+        """Ends a trial call that neither succeeded nor failed, e.g. it was cancelled."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            trial_failed = self.trial_in_flight
+            self.trial_in_flight = False
+            if trial_failed or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                BREAKER_OPENED.inc(deployment=self.name)
+                logger.warning(f"[retry] - Circuit opened for {self.name} after {self.failures} failures")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(deployment: str) -> CircuitBreaker:
+    breaker = _breakers.get(deployment)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(deployment, CircuitBreaker(deployment))
+    return breaker
+
+
+def retry_stats() -> Dict[str, Any]:
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
+
+
+class _Attempts:
+    """The retry decisions shared by the sync and the async loop."""
+
+    def __init__(self, deployment: str, max_retries: int, has_fallback: bool):
+        self.deployment = deployment
+        self.max_retries = max_retries
+        self.has_fallback = has_fallback
+        self.breaker = get_breaker(deployment)
+        self.started_at = time.monotonic()
+        self.attempt = 0
+        self.trial = False
+
+    def allow(self) -> bool:
+        allowed, self.trial = self.breaker.acquire()
+        return allowed
+
+    def interrupted(self) -> None:
+        """The call was cancelled, it tells nothing about the deployment."""
+        if self.trial:
+            self.breaker.release_trial()
+
+    def next_delay(self, error: BaseException, restartable: bool = True) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, None to give up on the deployment.
+
+        A call that is not `restartable` any more, e.g. its stream was partly
+        emitted, is neither retried nor sent to the fallback.
+        """
+        reason = retry_reason(error)
+        if reason is None:
+            # The deployment answered, the request itself is wrong
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure()
+        if not restartable:
+            raise error
+        if self.attempt >= self.max_retries or self.breaker.state != "closed":
+            return None
+        delay = backoff_seconds(self.attempt, retry_after_seconds(error))
+        if time.monotonic() - self.started_at + delay > LLM_RETRY_DEADLINE_SECONDS:
+            # Waiting that long only makes the tail worse, use the fallback instead
+            if self.has_fallback:
+                return None
+            delay = max(LLM_RETRY_DEADLINE_SECONDS - (time.monotonic() - self.started_at), 0.0)
+        self.attempt += 1
+        RETRIES.inc(deployment=self.deployment, reason=reason)
+        logger.info(f"[retry] - {self.deployment} failed with {reason}, retry {self.attempt} in {delay:.2f}s")
+        return delay
+
+    def fallback(self, fallback: Optional[Callable], error: Optional[BaseException]):
+        if fallback is None:
+            if error is not None:
+                raise error
+            raise CircuitOpenError(f"Circuit breaker of {self.deployment} is open")
+        telemetry.add_to_span(fallbacks=1)
+        logger.warning(f"[retry] - Falling back from {self.deployment}: {error or 'circuit open'}")
+        return fallback()
+
+
+def call_with_retry(
+    deployment: str,
+    call: Callable[[], Any],
+    max_retries: int,
+    fallback: Optional[Callable[[], Any]] = None,
+    fallback_name: str = "",
+    restartable: Callable[[], bool] = lambda: True,
+) -> Any:
+    """Calls `call()` with retries, then `fallback()` if the deployment keeps failing.
+
+    `restartable()` tells whether a failed call can still be made again, see
+    `_Attempts.next_delay`.
+    """
+    attempts = _Attempts(deployment, max_retries, fallback is not None)
+    error: Optional[BaseException] = None
+    while attempts.allow():
+        try:
+            result = call()
+        except Exception as e:
+            error = e
+            delay = attempts.next_delay(e, restartable())
+            if delay is None:
+                break
+            time.sleep(delay)
+        except BaseException:
+            # Interrupted, the half open trial must not stay in flight
+            attempts.interrupted()
+            raise
+        else:
+            attempts.breaker.record_success()
+            return result
+
+    if fallback is not None:
+        FALLBACKS.inc(source=deployment, target=fallback_name)
+    return attempts.fallback(fallback, error)
+
+
+async def acall_with_retry(
+    deployment: str,
+    call: Callable[[], Awaitable[Any]],
+    max_retries: int,
+    fallback: Optional[Callable[[], Awaitable[Any]]] = None,
+    fallback_name: str = "",
+    restartable: Callable[[], bool] = lambda: True,
+) -> Any:
+    """Async version of `call_with_retry`, waits without blocking the event loop."""
+    attempts = _Attempts(deployment, max_retries, fallback is not None)
+    error: Optional[BaseException] = None
+    while attempts.allow():
+        try:
+            result = await call()
+        except Exception as e:
+            error = e
+            delay = attempts.next_delay(e, restartable())
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled, e.g. by an extract deadline or a closed websocket
+            attempts.interrupted()
+            raise
+        else:
+            attempts.breaker.record_success()
+            return result
+
+    if fallback is not None:
+        FALLBACKS.inc(source=deployment, target=fallback_name)
+    return await attempts.fallback(fallback, error)
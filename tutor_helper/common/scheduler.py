@@ -0,0 +1,398 @@
+"""Process-wide scheduler of the LLM and search calls fanned out per request.
+
+Every call names the resource it uses (an LLM deployment, or `search:<tool>`)
+and an estimate of the tokens it will spend. A call starts once:
+
+- fewer than `SCHEDULER_MAX_IN_FLIGHT` scheduled calls are running,
+- its resource is under its own `max_in_flight`, and
+- the requests-per-minute and tokens-per-minute buckets of the resource can
+  pay for it.
+
+Waiting calls are queued per request (the trace id of the current span) and
+the queues are served round-robin, so one request fanning out fifty extracts
+does not hold back the next request behind all of them. Budgets are set per
+resource in `SCHEDULER_BUDGETS`, as JSON:
+
+    {"gpt-35-turbo-16k": {"rpm": 300, "tpm": 120000, "max_in_flight": 8}}
+
+Resources without an entry get `SCHEDULER_DEFAULT_RPM` and
+`SCHEDULER_DEFAULT_TPM` (0 is unlimited).
+"""
+import asyncio
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+
+from tutor_helper.common import telemetry
+
+import logging
+logger = logging.getLogger(__name__)
+
+SCHEDULER_MAX_IN_FLIGHT = int(os.getenv("SCHEDULER_MAX_IN_FLIGHT", "32"))
+SCHEDULER_DEFAULT_RPM = int(os.getenv("SCHEDULER_DEFAULT_RPM", "0"))
+SCHEDULER_DEFAULT_TPM = int(os.getenv("SCHEDULER_DEFAULT_TPM", "0"))
+SCHEDULER_BUDGETS = os.getenv("SCHEDULER_BUDGETS", "{}")
+# Completion tokens assumed for a call, before its usage is known
+SCHEDULER_COMPLETION_TOKENS = int(os.getenv("SCHEDULER_COMPLETION_TOKENS", "256"))
+
+WAIT_SECONDS = telemetry.get_metrics_registry().histogram(
+    "tutor_helper_scheduler_wait_seconds", "Time the scheduled calls waited to start."
+)
+DEPLOYMENT_ATTRIBUTES = ("deployment_name", "model_name", "model")
+
+_current_grant: contextvars.ContextVar[Optional["Grant"]] = contextvars.ContextVar(
+    "tutor_helper_grant", default=None
+)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Token count of a prompt plus the expected completion.
+
+    Counts come from the shared token cache, so the reservation matches what
+    the call later settles with `report_usage`.
+    """
+    # Imported here, tutor_helper.tools imports the LLM clients that use the scheduler
+    from tutor_helper.tools.utilities import tokens
+
+    try:
+        prompt_tokens = sum(tokens.count_tokens_batch(texts))
+    except Exception as e:
+        # The encoding may be unavailable, fall back to 4 characters a token
+        logger.debug(f"[scheduler] - Could not count tokens: {e}")
+        prompt_tokens = sum(len(text) for text in texts) // 4
+    return prompt_tokens + SCHEDULER_COMPLETION_TOKENS
+
+
+def llm_resource(llm: Any) -> str:
+    """The deployment an LLM client calls, used as its scheduler resource."""
+    for attribute in DEPLOYMENT_ATTRIBUTES:
+        value = getattr(llm, attribute, None)
+        if isinstance(value, str) and value:
+            return value
+    return type(llm).__name__
+
+
+def report_usage(tokens: int) -> None:
+    """Reports the tokens the current scheduled call actually spent."""
+    grant = _current_grant.get()
+    if grant is not None and tokens > 0:
+        grant.used_tokens = tokens
+
+
+def _request_key() -> str:
+    current = telemetry.current_span()
+    if current is not None:
+        return current.trace_id
+    try:
+        return f"task-{id(asyncio.current_task())}"
+    except RuntimeError:
+        return f"thread-{threading.get_ident()}"
+
+
+class RateBucket:
+    """Token bucket refilled continuously with `per_minute` units a minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be paid, 0 if it can be now."""
+        self._refill(now)
+        # A call larger than the whole budget waits for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing * 60 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        # May go below 0 when a call spent more than estimated
+        self.level -= amount
+
+
+class Resource:
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0, max_in_flight: int = 0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.requests = RateBucket(rpm) if rpm else None
+        self.tokens = RateBucket(tpm) if tpm else None
+        self.in_flight = 0
+        self.granted = 0
+        self.delayed = 0
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Seconds until a call can start, `inf` while the resource is at its concurrency limit."""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return math.inf
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.delay(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    def take(self, tokens: int) -> None:
+        self.in_flight += 1
+        self.granted += 1
+        if self.requests is not None:
+            self.requests.consume(1)
+        if self.tokens is not None:
+            self.tokens.consume(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "rpm_available": round(self.requests.level, 1) if self.requests else None,
+            "tpm_available": round(self.tokens.level, 1) if self.tokens else None,
+        }
+
+
+class Grant:
+    """Permission for one call to run, released back to the scheduler when it is done."""
+
+    def __init__(self, resource: str, tokens: int, request_key: str):
+        self.resource = resource
+        self.tokens = tokens
+        self.request_key = request_key
+        self.used_tokens: Optional[int] = None
+        self.enqueued_at = time.monotonic()
+        self.future: Future = Future()
+
+
+class LlmScheduler:
+    def __init__(
+        self,
+        max_in_flight: int = SCHEDULER_MAX_IN_FLIGHT,
+        budgets: Optional[Dict[str, Dict[str, int]]] = None,
+        default_rpm: int = SCHEDULER_DEFAULT_RPM,
+        default_tpm: int = SCHEDULER_DEFAULT_TPM,
+    ):
+        self.max_in_flight = max_in_flight
+        self.budgets = budgets or {}
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.in_flight = 0
+        # request key -> calls waiting, in round-robin order
+        self._queues: "OrderedDict[str, Deque[Grant]]" = OrderedDict()
+        self._resources: Dict[str, Resource] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._timer_at = math.inf
+        # Only granted calls are submitted, so its workers never wait on the scheduler
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="scheduler")
+
+    def _resource(self, name: str) -> Resource:
+        resource = self._resources.get(name)
+        if resource is None:
+            budget = self.budgets.get(name, {})
+            resource = self._resources[name] = Resource(
+                name,
+                rpm=budget.get("rpm", self.default_rpm),
+                tpm=budget.get("tpm", self.default_tpm),
+                max_in_flight=budget.get("max_in_flight", 0),
+            )
+        return resource
+
+    def acquire(self, resource: str, tokens: int = 0, request_key: Optional[str] = None) -> Grant:
+        """Queues a call, its `future` resolves to the grant once the call may start."""
+        grant = Grant(resource, tokens, request_key or _request_key())
+        with self._lock:
+            self._resource(resource)
+            self._queues.setdefault(grant.request_key, deque()).append(grant)
+        self._dispatch()
+        return grant
+
+    def release(self, grant: Grant) -> None:
+        with self._lock:
+            resource = self._resource(grant.resource)
+            resource.in_flight -= 1
+            self.in_flight -= 1
+            if grant.used_tokens is not None and resource.tokens is not None:
+                # Settle the difference between the estimate and the actual usage
+                resource.tokens.consume(grant.used_tokens - grant.tokens)
+        self._dispatch()
+
+    def _next(self, now: float):
+        """The first startable call of the queues in round-robin order, and the shortest budget wait."""
+        shortest_delay = math.inf
+        for request_key in list(self._queues):
+            queue = self._queues[request_key]
+            while queue and queue[0].future.cancelled():
+                queue.popleft()
+            if not queue:
+                del self._queues[request_key]
+                continue
+            grant = queue[0]
+            delay = self._resources[grant.resource].delay(grant.tokens, now)
+            if delay == 0:
+                queue.popleft()
+                # Served, move the request to the back of the round
+                if queue:
+                    self._queues.move_to_end(request_key)
+                else:
+                    del self._queues[request_key]
+                return grant, shortest_delay
+            shortest_delay = min(shortest_delay, delay)
+        return None, shortest_delay
+
+    def _dispatch(self) -> None:
+        granted = []
+        with self._lock:
+            now = time.monotonic()
+            shortest_delay = math.inf
+            while self.in_flight < self.max_in_flight:
+                grant, shortest_delay = self._next(now)
+                if grant is None:
+                    break
+                if not grant.future.set_running_or_notify_cancel():
+                    continue
+                self._resources[grant.resource].take(grant.tokens)
+                self.in_flight += 1
+                granted.append(grant)
+
+            if shortest_delay != math.inf and now + shortest_delay < self._timer_at:
+                # Calls are only waiting for a budget to refill, dispatch again then
+                if self._timer is not None:
+                    self._timer.cancel()
+                self._timer_at = now + shortest_delay
+                self._timer = threading.Timer(shortest_delay, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+        # Resolved outside of the lock, the callbacks may acquire again
+        for grant in granted:
+            waited = time.monotonic() - grant.enqueued_at
+            WAIT_SECONDS.observe(waited, resource=grant.resource)
+            if waited > 0.001:
+                self._resources[grant.resource].delayed += 1
+            grant.future.set_result(grant)
+
+    def _on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+            self._timer_at = math.inf
+        self._dispatch()
+
+    @contextmanager
+    def slot(self, resource: str, tokens: int = 0, request_key: Optional[str] = None):
+        """Blocks until the call may start and releases its slot when the block exits."""
+        grant = self.acquire(resource, tokens, request_key).future.result()
+        token = _current_grant.set(grant)
+        try:
+            yield grant
+        finally:
+            _current_grant.reset(token)
+            self.release(grant)
+
+    @asynccontextmanager
+    async def aslot(self, resource: str, tokens: int = 0, request_key: Optional[str] = None):
+        """Async version of `slot`, waits without blocking the event loop."""
+        future = self.acquire(resource, tokens, request_key).future
+        try:
+            grant = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Granted, or being granted by another thread, as the waiting task was
+            # cancelled: give the slot back once the grant resolves
+            if not future.cancel():
+                future.add_done_callback(lambda granted: self.release(granted.result()))
+            raise
+        token = _current_grant.set(grant)
+        try:
+            yield grant
+        finally:
+            _current_grant.reset(token)
+            self.release(grant)
+
+    def submit(
+        self,
+        func: Callable,
+        *args,
+        resource: str,
+        tokens: int = 0,
+        request_key: Optional[str] = None,
+        **kwargs,
+    ) -> Future:
+        """Runs `func(*args, **kwargs)` in the scheduler workers once it is granted.
+
+        Cancelling the returned future before the call starts takes it out of
+        the queue, or gives its slot back if it was just granted.
+        """
+        # Keep context variables (spans, request ids) in the worker thread
+        context = contextvars.copy_context()
+        result: Future = Future()
+
+        def run(grant: Grant) -> None:
+            if not result.set_running_or_notify_cancel():
+                self.release(grant)
+                return
+
+            def call():
+                _current_grant.set(grant)
+                return func(*args, **kwargs)
+
+            try:
+                value = context.run(call)
+            except BaseException as e:
+                result.set_exception(e)
+            else:
+                result.set_result(value)
+            finally:
+                self.release(grant)
+
+        def start(granted: Future) -> None:
+            if not granted.cancelled():
+                self._executor.submit(run, granted.result())
+
+        grant = self.acquire(resource, tokens, request_key)
+        grant.future.add_done_callback(start)
+        result.add_done_callback(lambda done: done.cancelled() and grant.future.cancel())
+        return result
+
+    async def run(self, func: Callable, *args, resource: str, tokens: int = 0, **kwargs) -> Any:
+        """Runs a blocking call in the scheduler workers and awaits its result."""
+        return await asyncio.wrap_future(
+            self.submit(func, *args, resource=resource, tokens=tokens, **kwargs)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "requests_waiting": len(self._queues),
+                "resources": {name: r.stats() for name, r in self._resources.items()},
+            }
+
+
+_scheduler: Optional[LlmScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LlmScheduler:
+    """Returns the process-wide scheduler, created on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                try:
+                    budgets = json.loads(SCHEDULER_BUDGETS)
+                except ValueError as e:
+                    logger.error(f"[scheduler] - Invalid SCHEDULER_BUDGETS, ignored: {e}")
+                    budgets = {}
+                _scheduler = LlmScheduler(budgets=budgets)
+                logger.info(f"[scheduler] - Created scheduler: max_in_flight={_scheduler.max_in_flight}, budgets={budgets}")
+    return _scheduler
@@ -0,0 +1,81 @@
+"""Coalescing of identical in-flight calls.
+
+While a call for a key is running, other callers asking for the same key wait
+for its result instead of starting their own call. Nothing is kept once the
+call finishes, caching is left to the caller.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Runs `func()` unless a call for `key` is already running, then waits for it."""
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of `do`, calls are coalesced within the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get((id(loop), key))
+            if task is None:
+                task = loop.create_task(func())
+                self._tasks[(id(loop), key)] = task
+                task.add_done_callback(
+                    lambda _, task_key=(id(loop), key): self._tasks.pop(task_key, None)
+                )
+                self.executions += 1
+            else:
+                self.shared += 1
+        # A cancelled caller must not cancel the call shared with the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "in_flight": len(self._calls) + len(self._tasks),
+                "calls": self.calls,
+                "executions": self.executions,
+                "shared": self.shared,
+                "dedup_rate": self.shared / self.calls if self.calls else 0.0,
+            }
@@ -0,0 +1,350 @@
+"""Spans and Prometheus metrics of the research pipeline.
+
+Stages are wrapped in `span(name)`. Spans nest through a context variable, so
+the LLM calls, cache lookups and HTTP requests made inside a stage are counted
+on it (`prompt_tokens`, `completion_tokens`, `cache_hits`, `retries`, ...) and
+rolled up to its parents. Finished spans feed the stage histograms served by
+`/metrics` in the Prometheus text format and, when the `opentelemetry` package
+is installed and `OTEL_TRACES_ENABLED` is set, are exported as OpenTelemetry
+spans too.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+OTEL_TRACES_ENABLED = os.getenv("OTEL_TRACES_ENABLED", "false").lower() == "true"
+TELEMETRY_RECENT_SPANS = int(os.getenv("TELEMETRY_RECENT_SPANS", "200"))
+
+# Seconds, sized for calls that take from a few milliseconds to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Span counters that are added to the parent span when a span ends
+ROLLUP_COUNTERS = (
+    "llm_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "cache_hits",
+    "cache_misses",
+    "http_requests",
+    "retries",
+    "fallbacks",
+)
+
+try:
+    if OTEL_TRACES_ENABLED:
+        from opentelemetry import trace as otel_trace
+    else:
+        otel_trace = None
+except ImportError:
+    logger.warning("[telemetry] - OTEL_TRACES_ENABLED is set but opentelemetry is not installed")
+    otel_trace = None
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(tuple(sorted((k, str(v)) for k, v in labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (bucket counts, sum, count)
+        self._values: Dict[Tuple[Tuple[str, str], ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = [counts, total + value, count + 1]
+
+    def count(self, **labels: Any) -> int:
+        entry = self._values.get(tuple(sorted((k, str(v)) for k, v in labels.items())))
+        return entry[2] if entry else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                bucket_labels = _format_labels(labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def register_collector(self, collector: Callable[[], Dict[str, float]]) -> None:
+        """Registers a callable returning gauge values, read on every scrape."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                gauges = collector()
+            except Exception as e:
+                logger.warning(f"[telemetry] - Metrics collector failed: {e}")
+                continue
+            for name, value in gauges.items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+STAGE_DURATION = _registry.histogram(
+    "tutor_helper_stage_duration_seconds", "Duration of the pipeline stages."
+)
+STAGE_ERRORS = _registry.counter(
+    "tutor_helper_stage_errors_total", "Pipeline stages that raised an error."
+)
+LLM_TOKENS = _registry.counter(
+    "tutor_helper_llm_tokens_total", "Prompt and completion tokens of the LLM calls."
+)
+LLM_CACHE = _registry.counter(
+    "tutor_helper_llm_cache_lookups_total", "LLM response cache lookups by result."
+)
+LLM_HTTP_REQUESTS = _registry.counter(
+    "tutor_helper_llm_http_requests_total", "HTTP requests sent to the LLM endpoints, retries included."
+)
+
+
+class Span:
+    """A timed stage with counters and attributes, shaped like an OpenTelemetry span."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes: Any):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.counters: Dict[str, float] = {}
+        self.status = "ok"
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self._started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self.otel_span = None
+        if otel_trace is not None:
+            context = (
+                otel_trace.set_span_in_context(parent.otel_span)
+                if parent is not None and parent.otel_span is not None
+                else None
+            )
+            self.otel_span = otel_trace.get_tracer("tutor_helper").start_span(
+                name, context=context
+            )
+
+    @property
+    def duration(self) -> float:
+        end = self.end_time or time.time()
+        return end - self.start_time
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        duration = time.perf_counter() - self._started_at
+        self.end_time = self.start_time + duration
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = type(error).__name__
+            STAGE_ERRORS.inc(stage=self.name)
+        STAGE_DURATION.observe(duration, stage=self.name)
+
+        if self.parent is not None:
+            for key in ROLLUP_COUNTERS:
+                if key in self.counters:
+                    self.parent.add(key, self.counters[key])
+        _recent_spans.append(self.to_dict())
+
+        if self.otel_span is not None:
+            for key, value in {**self.attributes, **self.counters}.items():
+                if isinstance(value, (str, bool, int, float)):
+                    self.otel_span.set_attribute(key, value)
+            if error is not None:
+                self.otel_span.record_exception(error)
+            self.otel_span.end()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent.span_id if self.parent else None,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_seconds": round(self.duration, 6),
+            "status": self.status,
+            "attributes": dict(self.attributes),
+            "counters": dict(self.counters),
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "tutor_helper_span", default=None
+)
+_recent_spans: deque = deque(maxlen=TELEMETRY_RECENT_SPANS)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, **attributes: Any) -> Tuple[Span, contextvars.Token]:
+    """Starts a child of the current span, end it with `end_span`."""
+    new_span = Span(name, _current_span.get(), **attributes)
+    return new_span, _current_span.set(new_span)
+
+
+def end_span(ended: Span, token: contextvars.Token, error: Optional[BaseException] = None) -> None:
+    ended.end(error)
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Ended from another context than it was started in
+        _current_span.set(ended.parent)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """Times the enclosed block as a stage of the pipeline."""
+    current, token = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        end_span(current, token, e)
+        raise
+    else:
+        end_span(current, token)
+
+
+def traced(name: str) -> Callable:
+    """Decorator running each call of a function or coroutine function in a span."""
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_to_span(**amounts: float) -> None:
+    """Adds to the counters of the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        for key, amount in amounts.items():
+            current.add(key, amount)
+
+
+def record_cache_lookup(hit: bool) -> None:
+    LLM_CACHE.inc(result="hit" if hit else "miss")
+    add_to_span(**({"cache_hits": 1} if hit else {"cache_misses": 1}))
+
+
+def record_http_response(status_code: int) -> None:
+    LLM_HTTP_REQUESTS.inc(status=status_code)
+    add_to_span(http_requests=1)
+
+
+def recent_spans() -> List[Dict[str, Any]]:
+    """The most recently finished spans, oldest first."""
+    return list(_recent_spans)
+
+
+def bind_context(func: Callable) -> Callable:
+    """Binds `func` to the current span context, for calls submitted to thread pools."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, run each call in a copy
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
@@ -0,0 +1,145 @@
+"""On-disk vector index of documents, searched by cosine similarity.
+
+`FlatVectorIndex` keeps the normalized vectors in one NumPy matrix, so a
+search is a single matrix-vector product; at the corpus sizes seen here (tens
+of thousands of documents) that takes a few milliseconds and needs no training,
+unlike an IVF index. Other implementations can be swapped in behind
+`VectorIndex`.
+"""
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex(ABC):
+    @abstractmethod
+    def add(self, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[Dict[str, Any]]) -> None:
+        """Adds or replaces the documents `ids`."""
+
+    @abstractmethod
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        """The `k` documents closest to `vector`, as (similarity, payload), closest first."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class FlatVectorIndex(VectorIndex):
+    """Exhaustive cosine search over a NumPy matrix, oldest documents evicted first.
+
+    Saved to `path` as `vectors.npy` and `payloads.json`, next to a
+    `meta.json` recording the embedder; an index built with another embedder
+    is not loaded.
+    """
+
+    def __init__(self, dim: int, embedder: str, path: Optional[str] = None, max_docs: int = 50000):
+        self.dim = dim
+        self.embedder = embedder
+        self.path = path
+        self.max_docs = max_docs
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray, payloads: Sequence[Dict[str, Any]]) -> None:
+        vectors = self._normalize(vectors).reshape(-1, self.dim)
+        # The last entry of an id wins
+        batch = {doc_id: (vector, payload) for doc_id, vector, payload in zip(ids, vectors, payloads)}
+        with self._lock:
+            new_rows = []
+            for doc_id, (vector, payload) in batch.items():
+                position = self._positions.get(doc_id)
+                if position is not None:
+                    self._vectors[position] = vector
+                    self._payloads[position] = payload
+                else:
+                    self._positions[doc_id] = len(self._ids) + len(new_rows)
+                    new_rows.append((doc_id, vector, payload))
+            if new_rows:
+                self._ids.extend(doc_id for doc_id, _, _ in new_rows)
+                self._payloads.extend(payload for _, _, payload in new_rows)
+                self._vectors = np.vstack([self._vectors, np.stack([v for _, v, _ in new_rows])])
+            if len(self._ids) > self.max_docs:
+                self._evict(len(self._ids) - self.max_docs)
+
+    def _evict(self, count: int) -> None:
+        self._vectors = self._vectors[count:]
+        self._ids = self._ids[count:]
+        self._payloads = self._payloads[count:]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[float, Dict[str, Any]]]:
+        with self._lock:
+            if not self._ids or k <= 0:
+                return []
+            similarities = self._vectors @ self._normalize(vector).reshape(self.dim)
+            k = min(k, len(self._ids))
+            # Partial sort of the k best, then order them
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top], kind="stable")]
+            return [(float(similarities[i]), dict(self._payloads[i])) for i in top]
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            vectors, payloads = self._vectors.copy(), list(zip(self._ids, self._payloads))
+        os.makedirs(self.path, exist_ok=True)
+        # Written aside and moved in place, a crash never leaves a partial index
+        for name, write in (
+            ("vectors.npy", lambda f: np.save(f, vectors)),
+            ("payloads.json", lambda f: f.write(json.dumps(payloads).encode("utf-8"))),
+            ("meta.json", lambda f: f.write(json.dumps({"dim": self.dim, "embedder": self.embedder}).encode("utf-8"))),
+        ):
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, os.path.join(self.path, name))
+
+    def load(self) -> None:
+        try:
+            with open(os.path.join(self.path, "meta.json")) as f:
+                meta = json.load(f)
+            if meta != {"dim": self.dim, "embedder": self.embedder}:
+                logger.warning(f"[vector_index] - Index at {self.path} was built with {meta}, starting empty")
+                return
+            vectors = np.load(os.path.join(self.path, "vectors.npy"))
+            with open(os.path.join(self.path, "payloads.json")) as f:
+                entries = json.load(f)
+            if len(vectors) != len(entries):
+                raise ValueError(f"{len(vectors)} vectors for {len(entries)} documents")
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"[vector_index] - Could not load the index at {self.path}: {e}")
+            return
+        with self._lock:
+            self._vectors = vectors.astype(np.float32).reshape(-1, self.dim)
+            self._ids = [doc_id for doc_id, _ in entries]
+            self._payloads = [payload for _, payload in entries]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        logger.info(f"[vector_index] - Loaded {len(self)} documents from {self.path}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"documents": len(self), "max_docs": self.max_docs, "dim": self.dim, "embedder": self.embedder}
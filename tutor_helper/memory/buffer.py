@@ -0,0 +1,30 @@
+"""Conversation memory for the tutor assistant agents."""
+import json
+from typing import Any, Dict, Tuple
+
+from langchain.memory import ConversationBufferMemory as ConversationBufferMemory_
+
+
+def message_text(value: Any) -> str:
+    """Returns the text to store in memory for an agent input or output.
+
+    The agent is called with dict inputs and returns dict outputs
+    (e.g. {"content": ...}), chat messages only accept strings.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict) and "content" in value:
+        return str(value["content"])
+    if isinstance(value, dict) and "request_raw_question_input" in value:
+        return str(value["request_raw_question_input"])
+    return json.dumps(value, default=str)
+
+
+class ConversationBufferMemory(ConversationBufferMemory_):
+    """Buffer memory accepting the dict inputs and outputs of the agents."""
+
+    def _get_input_output(
+        self, inputs: Dict[str, Any], outputs: Dict[str, Any]
+    ) -> Tuple[str, str]:
+        input_value, output_value = super()._get_input_output(inputs, outputs)
+        return message_text(input_value), message_text(output_value)
@@ -0,0 +1,271 @@
+"""Token-bounded conversation memory, stored per session.
+
+The chat history of a session lives in a store rather than in the memory
+object: `memory` keeps it in the process (LRU), `sqlite` on disk, so that the
+workers of a deployment share it. Only the most recent messages that fit in
+`MEMORY_MAX_TOKENS` are sent to the agent, counted with the shared token
+counter. The older ones are summarized in the background, the summary is
+sent in front of the recent messages. Sessions idle for longer than
+`MEMORY_IDLE_TIMEOUT_SECONDS` and, past `MEMORY_MAX_SESSIONS`, the least
+recently used ones are evicted from the store.
+
+The backend is selected with `MEMORY_BACKEND` (memory | sqlite).
+"""
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import (
+    BaseMessage,
+    SystemMessage,
+    get_buffer_string,
+    messages_from_dict,
+    messages_to_dict,
+)
+from langchain_core.prompts import BasePromptTemplate
+from pydantic import PrivateAttr
+
+from tutor_helper.common.cache import MemoryStore, SQLiteStore
+from tutor_helper.common.offload import OffloadQueueFull, get_offload_pool
+from tutor_helper.common.scheduler import estimate_tokens, get_scheduler, llm_resource
+from tutor_helper.common.telemetry import get_metrics_registry
+from tutor_helper.memory.buffer import ConversationBufferMemory
+from tutor_helper.tools.utilities import tokens
+
+import logging
+logger = logging.getLogger(__name__)
+
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")  # memory | sqlite
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+MEMORY_SUMMARIZE = os.getenv("MEMORY_SUMMARIZE", "true").lower() == "true"
+MEMORY_IDLE_TIMEOUT_SECONDS = int(os.getenv("MEMORY_IDLE_TIMEOUT_SECONDS", "86400"))
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+MEMORY_SQLITE_PATH = os.getenv(
+    "MEMORY_SQLITE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "tutor_helper", "memory.sqlite"),
+)
+# Evicted messages waiting for a summary, the oldest are dropped past this
+MAX_PENDING_MESSAGES = 40
+
+SUMMARIES = get_metrics_registry().counter(
+    "tutor_helper_memory_summaries_total",
+    "Background summaries of the evicted conversation messages, by outcome.",
+)
+
+
+def _empty_state() -> Dict[str, Any]:
+    return {"summary": "", "messages": [], "pending": []}
+
+
+class StoredChatMessageHistory(BaseChatMessageHistory):
+    """Chat history of one session, read from and written to a store.
+
+    The store holds a JSON document per session: the messages in the window,
+    the evicted messages not yet summarized and the summary of the older ones.
+    """
+
+    def __init__(self, session_id: str, store: Any = None):
+        self.session_id = session_id
+        self.store = store if store is not None else get_memory_store()
+        # Keeps the read-modify-write of a session whole within the process
+        self.lock = threading.RLock()
+
+    def load(self) -> Dict[str, Any]:
+        value = self.store.get(self.session_id)
+        if value is None:
+            return _empty_state()
+        try:
+            state = json.loads(value)
+            return {
+                "summary": state.get("summary", ""),
+                "messages": messages_from_dict(state.get("messages", [])),
+                "pending": messages_from_dict(state.get("pending", [])),
+            }
+        except Exception as e:
+            logger.warning(f"[StoredChatMessageHistory] - Ignoring unreadable memory of {self.session_id}: {e}")
+            return _empty_state()
+
+    def save(self, state: Dict[str, Any]) -> None:
+        self.store.set(
+            self.session_id,
+            json.dumps(
+                {
+                    "summary": state["summary"],
+                    "messages": messages_to_dict(state["messages"]),
+                    "pending": messages_to_dict(state["pending"][-MAX_PENDING_MESSAGES:]),
+                }
+            ),
+        )
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.load()["messages"]
+
+    @property
+    def summary(self) -> str:
+        return self.load()["summary"]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with self.lock:
+            state = self.load()
+            state["messages"].extend(messages)
+            self.save(state)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.save(_empty_state())
+
+
+class SummaryWindowMemory(ConversationBufferMemory):
+    """Buffer memory keeping the recent messages within `max_token_limit` tokens.
+
+    Messages that no longer fit are summarized by `llm` in the background,
+    in the shared offload pool, and the summary is returned in front of the
+    recent messages. Without `llm`, or when `summarize` is off, the evicted
+    messages are dropped.
+    """
+
+    max_token_limit: int = MEMORY_MAX_TOKENS
+    summarize: bool = MEMORY_SUMMARIZE
+    llm: Optional[BaseLanguageModel] = None
+    summary_prompt: BasePromptTemplate = SUMMARY_PROMPT
+    encoding_name: str = tokens.DEFAULT_ENCODING
+    _summary_future: Optional[Future] = PrivateAttr(default=None)
+
+    @classmethod
+    def for_session(cls, session_id: str, store: Any = None, **kwargs: Any) -> "SummaryWindowMemory":
+        return cls(chat_memory=StoredChatMessageHistory(session_id, store), **kwargs)
+
+    @property
+    def summary(self) -> str:
+        return getattr(self.chat_memory, "summary", "")
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = self.chat_memory.messages
+        summary = self.summary
+        if summary:
+            messages = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + messages
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {
+            self.memory_key: get_buffer_string(
+                messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+            )
+        }
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        self.prune()
+
+    def prune(self) -> None:
+        """Moves the oldest messages out of the window until it fits the token limit."""
+        if not isinstance(self.chat_memory, StoredChatMessageHistory):
+            return
+        with self.chat_memory.lock:
+            state = self.chat_memory.load()
+            messages = state["messages"]
+            texts = [get_buffer_string([message]) for message in messages]
+            # A token is at least a byte, short histories fit without counting them
+            if len(messages) <= 2 or sum(
+                len(text.encode("utf-8")) for text in [state["summary"], *texts]
+            ) <= self.max_token_limit:
+                return
+            budget = self.max_token_limit - tokens.count_tokens(state["summary"], self.encoding_name)
+            counts = tokens.count_tokens_batch(texts, self.encoding_name)
+            # The last exchange is always kept
+            keep = 2
+            used = sum(counts[len(messages) - keep :])
+            while keep < len(messages) and used + counts[-keep - 1] <= budget:
+                keep += 1
+                used += counts[-keep]
+            if keep == len(messages):
+                return
+            evicted, state["messages"] = messages[: len(messages) - keep], messages[len(messages) - keep :]
+            if self.summarize:
+                state["pending"].extend(evicted)
+            self.chat_memory.save(state)
+        logger.debug(f"[SummaryWindowMemory] - Evicted {len(evicted)} messages of {self.chat_memory.session_id}")
+        if self.summarize:
+            self._schedule_summary()
+
+    def _schedule_summary(self) -> None:
+        if self._summary_future is not None and not self._summary_future.done():
+            # The running summary picks the new messages up
+            return
+        try:
+            self._summary_future = get_offload_pool().submit(self._summarize_pending)
+        except OffloadQueueFull:
+            # Summarized with the next evicted messages
+            logger.info("[SummaryWindowMemory] - Offload pool full, summary postponed")
+
+    def _summary_llm(self) -> BaseLanguageModel:
+        if self.llm is None:
+            from tutor_helper.common.llms import LlmLoader
+
+            self.llm = LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO_LG, temperature=0)
+        return self.llm
+
+    def _summarize_pending(self) -> None:
+        while True:
+            state = self.chat_memory.load()
+            pending = state["pending"]
+            if not pending:
+                return
+            prompt = self.summary_prompt.format(
+                summary=state["summary"],
+                new_lines=get_buffer_string(pending, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix),
+            )
+            llm = self._summary_llm()
+            try:
+                with get_scheduler().slot(llm_resource(llm), estimate_tokens(prompt)):
+                    summary = llm.invoke(prompt)
+            except Exception as e:
+                SUMMARIES.inc(outcome="failed")
+                logger.warning(f"[SummaryWindowMemory] - Could not summarize {self.chat_memory.session_id}: {e}")
+                return
+            summary = getattr(summary, "content", summary).strip()
+            with self.chat_memory.lock:
+                state = self.chat_memory.load()
+                # Messages evicted while summarizing stay pending for the next round
+                if messages_to_dict(state["pending"][: len(pending)]) != messages_to_dict(pending):
+                    SUMMARIES.inc(outcome="stale")
+                    continue
+                state["summary"] = summary
+                state["pending"] = state["pending"][len(pending) :]
+                self.chat_memory.save(state)
+            SUMMARIES.inc(outcome="summarized")
+
+    def wait_for_summary(self, timeout: Optional[float] = None) -> None:
+        """Blocks until the background summary, if any, is done."""
+        if self._summary_future is not None:
+            self._summary_future.result(timeout=timeout)
+
+
+_store: Optional[Any] = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store():
+    """Returns the process-wide conversation memory store, created on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if MEMORY_BACKEND == "sqlite":
+                    _store = SQLiteStore(
+                        path=MEMORY_SQLITE_PATH,
+                        max_entries=MEMORY_MAX_SESSIONS,
+                        ttl_seconds=MEMORY_IDLE_TIMEOUT_SECONDS,
+                        table="conversation_memory",
+                    )
+                else:
+                    _store = MemoryStore(
+                        max_entries=MEMORY_MAX_SESSIONS, ttl_seconds=MEMORY_IDLE_TIMEOUT_SECONDS
+                    )
+                logger.info(f"[memory] - Created conversation memory store: {_store.stats()}")
+    return _store
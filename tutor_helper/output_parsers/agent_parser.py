@@ -1,21 +1,23 @@
 # from langchain.schema import BaseOutputParser, AgentAction, AgentFinish
 from tutor_helper.schema.agent import AgentAction, AgentFinish
 from typing import Any, List, Dict, Union
-import re
-import json
-from langchain.chains.router.llm_router import RouterOutputParser
 from langchain.agents.agent import AgentOutputParser
 from langchain.agents.structured_chat.prompt import FORMAT_INSTRUCTIONS
-from tutor_helper.output_parsers.json import parse_and_check_json_markdown
+from tutor_helper.common.telemetry import get_metrics_registry
+from tutor_helper.output_parsers.json import FENCE_PATTERN, parse_json_markdown
 from langchain.schema import BaseOutputParser, OutputParserException
 from langchain.output_parsers import OutputFixingParser
 from tutor_helper.common.llms import LlmLoader
-from tutor_helper.callbacks.stdout_all import StdOutAllCallbackHandler
 
 # Initialize the logger module
 import logging
 logger = logging.getLogger(__name__)
 
+AGENT_OUTPUT_PARSES = get_metrics_registry().counter(
+    "tutor_helper_agent_output_parse_total",
+    "Agent outputs parsed, by outcome: local, llm_fallback or failed.",
+)
+
 
 class NewAgentOutputParser(AgentOutputParser):
     def get_format_instructions(self) -> str:
@@ -25,16 +27,9 @@ class NewAgentOutputParser(AgentOutputParser):
         logger.debug("text: %s", text)
 
         try:
-            action_match = re.search(
-                r"(?:.*)```(?:json|JSON)?\s*(.*?)```", text, re.DOTALL | re.MULTILINE
-            )
-            if action_match is not None:
-                # replace boolean in json
-                text2parse = action_match.group(1).strip()
-                text2parse = text2parse.replace("True", "true")
-                text2parse = text2parse.replace("False", "false")
-                # logger.info(text2parse)
-                response = json.loads(text2parse, strict=False)
+            if FENCE_PATTERN.search(text) is not None:
+                # Malformed or truncated JSON is repaired locally
+                response = parse_json_markdown(text)
                 if isinstance(response, list):
                     # gpt turbo frequently ignores the directive to emit a single action
                     logger.warning("Got multiple action responses: %s", response)
@@ -54,16 +49,45 @@ class NewAgentOutputParser(AgentOutputParser):
 
 
 class NewAgentOutputFixingParser(NewAgentOutputParser):
-    def parse(self, text: str) -> Union[AgentAction, AgentFinish]:
-
-        old_parser = NewAgentOutputParser()
+    """Parses locally and asks an LLM to fix the output only when that fails."""
 
-        llm_kwargs = dict()
-        llm = LlmLoader.create_chat_llm(
-            callbacks=[StdOutAllCallbackHandler()],
-            **(llm_kwargs or {}),
+    @staticmethod
+    def _fixing_parser() -> OutputFixingParser:
+        # LLM clients are memoized, this does not open a new connection per step
+        return OutputFixingParser.from_llm(
+            parser=NewAgentOutputParser(), llm=LlmLoader.create_chat_llm()
         )
-        parser_ = OutputFixingParser.from_llm(parser=old_parser, llm=llm)
-        return parser_.parse(text)
 
+    def parse(self, text: str) -> Union[AgentAction, AgentFinish]:
+        try:
+            parsed = super().parse(text)
+        except OutputParserException as e:
+            logger.warning(f"[agent_parser] - Local parsing failed, fixing with the LLM: {e}")
+        else:
+            AGENT_OUTPUT_PARSES.inc(outcome="local")
+            return parsed
+
+        try:
+            parsed = self._fixing_parser().parse(text)
+        except Exception:
+            AGENT_OUTPUT_PARSES.inc(outcome="failed")
+            raise
+        AGENT_OUTPUT_PARSES.inc(outcome="llm_fallback")
+        return parsed
 
+    async def aparse(self, text: str) -> Union[AgentAction, AgentFinish]:
+        try:
+            parsed = super().parse(text)
+        except OutputParserException as e:
+            logger.warning(f"[agent_parser] - Local parsing failed, fixing with the LLM: {e}")
+        else:
+            AGENT_OUTPUT_PARSES.inc(outcome="local")
+            return parsed
+
+        try:
+            parsed = await self._fixing_parser().aparse(text)
+        except Exception:
+            AGENT_OUTPUT_PARSES.inc(outcome="failed")
+            raise
+        AGENT_OUTPUT_PARSES.inc(outcome="llm_fallback")
+        return parsed
@@ -2,29 +2,212 @@ from __future__ import annotations
 
 import json
 import re
-from typing import List
+from typing import Any, List, Optional
 
 from langchain.schema import OutputParserException
 
+from tutor_helper.common.telemetry import get_metrics_registry
 
-def parse_json_markdown(json_string: str) -> dict:
-    # Try to find JSON string within triple backticks
-    # TODO: to review later, if there is an alternative for code snippet
-    match = re.search(r"```(json)?(.*)```", json_string, flags=re.DOTALL)
+JSON_PARSES = get_metrics_registry().counter(
+    "tutor_helper_json_parse_total",
+    "LLM outputs parsed as JSON, by outcome: valid, repaired or failed.",
+)
 
-    # If no match found, assume the entire string is a JSON string
-    if match is None:
-        json_str = json_string
-    else:
-        # If match found, use the content within the backticks
-        json_str = match.group(2)
+# The opening fence of the first markdown code block
+FENCE_PATTERN = re.compile(r"```(?:json|JSON)?")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+VALID_ESCAPES = set('"\\/bfnrtu')
+CLOSING = {"{": "}", "[": "]"}
+
+
+class JsonRepairer:
+    """Rewrites the first JSON value of a text into valid JSON, as it is fed.
+
+    Text before the first `{` or `[` is skipped and the value ends when its
+    brackets balance, text after it is ignored. On the way, trailing commas
+    are dropped, raw newlines and invalid escapes in strings are escaped,
+    single quoted strings are double quoted and Python literals are
+    converted. `close` completes a truncated value: the open string, a
+    dangling key and the open brackets are closed.
+
+    Feed the text at once, or chunk by chunk while it is streamed, `done`
+    tells when the value is complete.
+    """
+
+    def __init__(self):
+        self.output: List[str] = []
+        self.stack: List[str] = []
+        self.quote: Optional[str] = None
+        self.escaped = False
+        self.word: List[str] = []
+        self.done = False
+        self.repaired = False
+        # The string being read is an object key, or the last one is still without a value
+        self.in_key = False
+        self.key_pending = False
+
+    def _emit_word(self) -> None:
+        if self.word:
+            word = "".join(self.word)
+            if word in PYTHON_LITERALS:
+                word = PYTHON_LITERALS[word]
+                self.repaired = True
+            self.output.append(word)
+            self.word = []
+
+    def _last_significant(self) -> str:
+        for chunk in reversed(self.output):
+            if not chunk.isspace():
+                return chunk[-1]
+        return ""
+
+    def _after_string(self) -> None:
+        self.key_pending = self.in_key
+        self.in_key = False
+
+    def _drop_trailing_comma(self) -> None:
+        for i in range(len(self.output) - 1, -1, -1):
+            if self.output[i].isspace():
+                continue
+            if self.output[i] == ",":
+                del self.output[i]
+                self.repaired = True
+            return
+
+    def _string_char(self, char: str) -> None:
+        if self.escaped:
+            self.escaped = False
+            if char not in VALID_ESCAPES and char != "'":
+                # An escape JSON does not know, keep the backslash itself
+                self.output.append("\\\\")
+                self.repaired = True
+            if char == "'":
+                self.output.append("'")
+            else:
+                self.output.append("\\" + char if char in VALID_ESCAPES else char)
+            return
+        if char == "\\":
+            self.escaped = True
+        elif char == self.quote:
+            self.output.append('"')
+            self.quote = None
+            self._after_string()
+        elif char == '"':
+            # Inside a single quoted string
+            self.output.append('\\"')
+        elif char in ESCAPES or ord(char) < 0x20:
+            self.output.append(ESCAPES.get(char, f"\\u{ord(char):04x}"))
+            self.repaired = True
+        else:
+            self.output.append(char)
 
-    # Strip whitespace and newlines from the start and end
-    json_str = json_str.strip()
+    def feed(self, text: str) -> bool:
+        """Processes the next chunk of text, returns `done`."""
+        for char in text:
+            if self.done:
+                break
+            if self.quote is not None:
+                self._string_char(char)
+                continue
+            if not self.stack and not self.output:
+                # Before the value
+                if char in CLOSING:
+                    self.stack.append(char)
+                    self.output.append(char)
+                continue
+            if char.isalnum() or char in "_.+-":
+                self.word.append(char)
+                continue
+            self._emit_word()
+            if char in "\"'":
+                if char == "'":
+                    self.repaired = True
+                self.in_key = self.stack[-1] == "{" and self._last_significant() in ("{", ",")
+                self.quote = char
+                self.output.append('"')
+            elif char in CLOSING:
+                self.stack.append(char)
+                self.output.append(char)
+            elif char in "}]":
+                self._drop_trailing_comma()
+                if self.stack and CLOSING[self.stack[-1]] == char:
+                    self.stack.pop()
+                    self.output.append(char)
+                    self.done = not self.stack
+            elif char == ":":
+                self.key_pending = False
+                self.output.append(char)
+            elif char == "`":
+                # The end of a markdown code block, the value was cut short
+                self.close()
+            else:
+                self.output.append(char)
+        return self.done
 
-    # Parse the JSON string into a Python dictionary
-    parsed = json.loads(json_str)
+    def close(self) -> str:
+        """Completes the value if it was cut short and returns the repaired JSON."""
+        if self.done:
+            return "".join(self.output)
+        self._emit_word()
+        if self.quote is not None:
+            if self.escaped:
+                self.output.append("\\\\")
+            self.output.append('"')
+            self.quote = None
+            self._after_string()
+        if self.stack:
+            self.repaired = True
+            self._drop_trailing_comma()
+            if self.key_pending:
+                self.output.append(": null")
+            elif self._last_significant() == ":":
+                self.output.append(" null")
+            while self.stack:
+                self._drop_trailing_comma()
+                self.output.append(CLOSING[self.stack.pop()])
+        self.done = True
+        return "".join(self.output)
 
+
+def _json_start(text: str) -> str:
+    # Prefer the content of the first code block, the value may follow some prose
+    match = FENCE_PATTERN.search(text)
+    return text[match.end():] if match else text
+
+
+def repair_json(text: str) -> str:
+    """The first JSON value of `text`, repaired, see `JsonRepairer`."""
+    repairer = JsonRepairer()
+    repairer.feed(_json_start(text))
+    return repairer.close()
+
+
+def parse_json_markdown(json_string: str) -> Any:
+    """Parses the first JSON value of `json_string`, in a code block or not.
+
+    Valid JSON is parsed as is, anything else is repaired locally first.
+
+    Raises:
+        json.JSONDecodeError: when the text holds no JSON value that can be repaired
+    """
+    json_str = _json_start(json_string).strip()
+    if json_str.endswith("```"):
+        json_str = json_str[:-3].rstrip()
+    try:
+        parsed = json.loads(json_str, strict=False)
+    except json.JSONDecodeError:
+        pass
+    else:
+        JSON_PARSES.inc(outcome="valid")
+        return parsed
+
+    try:
+        parsed = json.loads(repair_json(json_string), strict=False)
+    except json.JSONDecodeError:
+        JSON_PARSES.inc(outcome="failed")
+        raise
+    JSON_PARSES.inc(outcome="repaired")
     return parsed
 
 
@@ -0,0 +1,61 @@
+"""Static-first layout of the prompts, for provider-side prompt caching.
+
+Providers reuse the work done on the longest prompt prefix they have seen
+recently, which cuts the time to first token, but only for an identical
+prefix. The instructions, tool descriptions and format instructions go
+first, the content that changes with each request or document last, so that
+the parallel calls of a request, and the requests themselves, share it.
+"""
+import string
+from typing import List, Sequence
+
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import BasePromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+
+SENTINEL = "\x00"
+
+
+def template_variables(template: str) -> List[str]:
+    """The variables of an f-string template, escaped braces excluded."""
+    return [name for _, name, _, _ in string.Formatter().parse(template) if name is not None]
+
+
+def static_first(
+    static: Sequence[str],
+    variable: Sequence[str],
+    partials: Sequence[str] = (),
+    separator: str = "\n",
+) -> str:
+    """Assembles a template from its static sections followed by its variable ones.
+
+    Args:
+        static (List[str]): sections that are the same for every call
+        variable (List[str]): sections holding the per-call variables
+        partials (List[str]): variables rendered once per process, allowed in the static
+            sections, see `tutor_helper.prompts.registry.get_prompt`
+        separator (str): joins the sections
+
+    Raises:
+        ValueError: when a static section holds another variable
+    """
+    for section in static:
+        dynamic = [name for name in template_variables(section) if name not in partials]
+        if dynamic:
+            raise ValueError(f"Static prompt section holds the variables {dynamic}")
+    return separator.join([*static, *variable])
+
+
+def static_prefix(prompt: BasePromptTemplate) -> str:
+    """The rendered text of `prompt` up to its first variable, the part providers can cache.
+
+    Chat prompts are rendered as their messages, one per line.
+    """
+    values = {name: f"{SENTINEL}{name}{SENTINEL}" for name in prompt.input_variables}
+    if isinstance(prompt, ChatPromptTemplate):
+        for message in prompt.messages:
+            if isinstance(message, MessagesPlaceholder):
+                values[message.variable_name] = [HumanMessage(content=values[message.variable_name])]
+        text = "\n".join(f"{message.type}: {message.content}" for message in prompt.format_messages(**values))
+    else:
+        text = prompt.format(**values)
+    return text.split(SENTINEL, 1)[0]
@@ -0,0 +1,117 @@
+"""Prompt templates and chains compiled once per process.
+
+Templates are parsed once per template string, static segments such as the
+format instructions of an output parser are rendered into them once, and
+`LLMChain`s are built once per client and prompt. Chains hold no state of
+their own, callbacks go in the invoke config, so they are shared by every
+request and thread.
+"""
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.prompts.chat import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+from langchain_core.prompts import BasePromptTemplate
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Chains are few, one per client and prompt, the bound only guards against leaks
+MAX_CHAINS = 256
+
+
+def render_static(template: str, **values: str) -> str:
+    """Renders `values` into an f-string `template`, leaving the other variables in it.
+
+    Braces of the values are escaped, so that the rendered template can be
+    formatted again with the remaining variables.
+    """
+    for name, value in values.items():
+        template = template.replace(
+            "{" + name + "}", value.replace("{", "{{").replace("}", "}}")
+        )
+    return template
+
+
+@functools.lru_cache(maxsize=None)
+def _prompt(template: str, static: Tuple[Tuple[str, str], ...]) -> PromptTemplate:
+    return PromptTemplate.from_template(render_static(template, **dict(static)))
+
+
+@functools.lru_cache(maxsize=None)
+def _chat_prompt(system: str, human: str, static: Tuple[Tuple[str, str], ...]) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate.from_template(render_static(system, **dict(static))),
+            HumanMessagePromptTemplate.from_template(render_static(human, **dict(static))),
+        ]
+    )
+
+
+def get_prompt(template: str, **static: str) -> PromptTemplate:
+    """The compiled `template`, with the `static` variables rendered in.
+
+    The same template and values always give the same, shared, object.
+    """
+    return _prompt(template, tuple(sorted(static.items())))
+
+
+def get_chat_prompt(system: str, human: str, **static: str) -> ChatPromptTemplate:
+    """The compiled system and human message templates, see `get_prompt`."""
+    return _chat_prompt(system, human, tuple(sorted(static.items())))
+
+
+class ChainRegistry:
+    """`LLMChain`s built once per client, prompt and chain settings, least recently used evicted."""
+
+    def __init__(self, max_chains: int = MAX_CHAINS):
+        self.max_chains = max_chains
+        self._chains: "OrderedDict[Tuple, Tuple[Any, BasePromptTemplate, LLMChain]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, llm: Any, prompt: BasePromptTemplate, **kwargs: Any) -> LLMChain:
+        key = (id(llm), id(prompt), tuple(sorted(kwargs.items())))
+        with self._lock:
+            entry = self._chains.get(key)
+            # Ids of collected objects are reused, the entry keeps its own ones alive
+            if entry is not None and entry[0] is llm and entry[1] is prompt:
+                self._chains.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            chain = LLMChain(llm=llm, prompt=prompt, **kwargs)
+            self._chains[key] = (llm, prompt, chain)
+            while len(self._chains) > self.max_chains:
+                self._chains.popitem(last=False)
+            return chain
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "chains": len(self._chains),
+                "max_chains": self.max_chains,
+                "hits": self.hits,
+                "misses": self.misses,
+                "prompts": _prompt.cache_info().currsize + _chat_prompt.cache_info().currsize,
+            }
+
+
+_chains = ChainRegistry()
+
+
+def get_chain(llm: Any, prompt: BasePromptTemplate, **kwargs: Any) -> LLMChain:
+    """The shared `LLMChain` of `llm` and `prompt`, `kwargs` are the chain settings."""
+    return _chains.get(llm, prompt, **kwargs)
+
+
+def prompt_registry_stats() -> Dict[str, Any]:
+    return _chains.stats()
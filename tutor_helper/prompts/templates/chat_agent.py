@@ -1,6 +1,8 @@
 from langchain.prompts import PromptTemplate
 from typing import List, Dict
 
+from tutor_helper.prompts.layout import static_first
+
 class ChatResponseWithKB:
     """Prompt template.
     Reference from https://www.reddit.com/r/bing/comments/132ccog/approximate_but_supposedly_full_bing_chat_new/
@@ -75,27 +77,37 @@ class ChatResponseWithKB:
     You do not bold expressions in LaTeX.
     You include the numerical references to the URLs where you cite the content.
 
-    User:
+    Here the list of available tools:
+    """
+
+    # The user input goes after the static system message and the chat history,
+    # see `tutor_helper.prompts.layout`
+    HUMAN_MESSAGE_TEMPLATE = """User:
     ```
     {input}
     ```
 
-    Here the list of available tools:
-    """
-
-    HUMAN_MESSAGE_WITH_CONTENT = """
-    -------------- QUESTION START --------------
-    QUESTION: ```{question}```
-    -------------- QUESTION END --------------
+    {agent_scratchpad}"""
 
+    HUMAN_MESSAGE_WITH_CONTENT = static_first(
+        [
+            """
     Use the following "KNOWLEDGE" to extract knowledge in relation to the "QUESTION" to compose the answer.
     Include the numerical references to the URLs where you cite the content.
+    Ensure that no personal information is included, such as names, addresses, phone numbers, ip adresses, email addresses, and activation code.
+    ```{format_instructions}```""",
+        ],
+        [
+            """    -------------- QUESTION START --------------
+    QUESTION: ```{question}```
+    -------------- QUESTION END --------------
     ------------ KNOWLEDGE START ------------
     {content}
     ------------ KNOWLEDGE END ------------
-    ```{format_instructions}```
-    Ensure that no personal information is included, such as names, addresses, phone numbers, ip adresses, email addresses, and activation code.
-    """
+    """,
+        ],
+        partials=["format_instructions"],
+    )
 
     FORMAT_INSTRUCTIONS_FOR_AGENT = """Use a json blob to specify a tool by providing an action key (tool name) and an action_input key (tool input).
 
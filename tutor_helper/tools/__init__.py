@@ -2,6 +2,7 @@ from langchain.tools import BaseTool
 from .contracts.document_picker import DocumentPickerTool
 from typing import List, Dict, Any, Union
 from .search.search import DuckDuckGoSearch
+from .search.local_index import LOCAL_INDEX_ENABLED, LocalIndexSearch
 import logging
 logger = logging.getLogger(__name__)
 TOOL_MAPPING = {
@@ -11,8 +12,9 @@ TOOL_MAPPING = {
 }
 
 DEFAULT_TOOLKITS = {
+    # The local index searches DuckDuckGo itself when it has no close matches
     "english": [
-        DuckDuckGoSearch
+        LocalIndexSearch if LOCAL_INDEX_ENABLED else DuckDuckGoSearch
     ],
     "japanese": [
     ],
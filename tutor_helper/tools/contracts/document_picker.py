@@ -4,7 +4,11 @@ from langchain.output_parsers import ResponseSchema
 from langchain.tools import BaseTool
 
 
+from tutor_helper.common.cache import MemoryStore, SQLiteStore, TieredStore, cache_key
 from tutor_helper.common.llms import LlmLoader
+from tutor_helper.common.single_flight import SingleFlight
+from tutor_helper.prompts.registry import get_chain, get_prompt
+from tutor_helper.tools.utilities.utils import normalize
 
 from tutor_helper.output_parsers.json import parse_and_check_json_markdown
 from abc import ABC, abstractmethod
@@ -12,13 +16,63 @@ from typing import Dict, List, Any, Optional
 import os
 from langchain.tools.base import create_schema_from_function
 import json
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import threading
+from langchain.load import dumps, loads
 import logging
 logger = logging.getLogger(__name__)
 
 DEFALT_LANGUAGE = os.getenv("DEFALT_LANGUAGE", "English")
 
+RELATED_DOC_IDS_PROMPT = """
+You are a tutor assistant.
+Your task is to provide the list of document ID's that might be related to the provided description.
+DESCRIPTION: {description}
+DOCS
+---
+{formated_docs}
+---
+EXPECTED ANSWER FORMAT: list of document ids comma separated (e.g. fd7e1b4893e0453f3412bc45bbf697ed,1ea9b5ad6a32192e80ebe9ce5b7b4b89). Reply empty if no document is related.
+        """
+
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+# On-disk tier, disabled when empty
+SEARCH_CACHE_SQLITE_PATH = os.getenv("SEARCH_CACHE_SQLITE_PATH", "")
+
+_search_cache: Optional[TieredStore] = None
+_search_cache_lock = threading.Lock()
+_search_flight = SingleFlight("search")
+
+
+def get_search_cache() -> TieredStore:
+    """Returns the process-wide cache of search results, created on first use."""
+    global _search_cache
+    if _search_cache is None:
+        with _search_cache_lock:
+            if _search_cache is None:
+                disk = None
+                if SEARCH_CACHE_SQLITE_PATH:
+                    disk = SQLiteStore(
+                        path=SEARCH_CACHE_SQLITE_PATH,
+                        max_entries=SEARCH_CACHE_MAX_ENTRIES,
+                        ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+                        table="search_cache",
+                    )
+                _search_cache = TieredStore(
+                    MemoryStore(
+                        max_entries=SEARCH_CACHE_MAX_ENTRIES,
+                        ttl_seconds=SEARCH_CACHE_TTL_SECONDS,
+                    ),
+                    disk,
+                    serialize=lambda docs: json.dumps([dumps(doc) for doc in docs]),
+                    deserialize=lambda value: [loads(doc) for doc in json.loads(value)],
+                )
+    return _search_cache
+
+
+def search_cache_stats() -> Dict[str, Any]:
+    return {**get_search_cache().stats(), "coalescing": _search_flight.stats()}
+
 
 class StructuredOutputParser(StructuredOutputParser_):
     def parse(self, text: str) -> Any:
@@ -80,22 +134,38 @@ class DocumentPickerTool(BaseTool, ABC):
     ) -> List[Document]:
         pass
     
+    def get_matching_docs(
+        self, search_term: str, num_results: Optional[int] = None, **kwargs
+    ) -> List[Document]:
+        """Cached `_get_matching_docs`, use this instead of calling the tool directly.
+
+        Results are cached by tool, normalized search term and number of results,
+        and identical searches running at the same time are made only once.
+        """
+        num_results = self.num_results if num_results is None else num_results
+        key = cache_key(
+            self.name, normalize(search_term), str(num_results), repr(sorted(kwargs.items()))
+        )
+        cache = get_search_cache()
+        docs = cache.get(key)
+        if docs is None:
+
+            def search():
+                docs = self._get_matching_docs(search_term, num_results, **kwargs)
+                # Empty results are often a throttled search engine, do not keep them
+                if docs:
+                    cache.set(key, docs)
+                return docs
+
+            docs = _search_flight.do(key, search)
+        # Callers may edit the documents, never hand out the cached ones
+        return [doc.model_copy(deep=True) for doc in docs]
+
     @abstractmethod
     def _transform_docs(self, docs: List) -> List:
         pass
     
     def _get_related_doc_ids(self, description: str, docs: List[Document]) -> List:
-        prompt = """
-You are a tutor assistant.
-Your task is to provide the list of document ID's that might be related to the provided description.
-DESCRIPTION: {description}
-DOCS
----
-{formated_docs}
----
-EXPECTED ANSWER FORMAT: list of document ids comma separated (e.g. fd7e1b4893e0453f3412bc45bbf697ed,1ea9b5ad6a32192e80ebe9ce5b7b4b89). Reply empty if no document is related.
-        """
-
         # Remove duplicated based on doc.metadata[self.id_key]
         docs = list({doc.metadata[self.id_key]: doc for doc in docs}.values())
 
@@ -111,10 +181,7 @@ EXPECTED ANSWER FORMAT: list of document ids comma separated (e.g. fd7e1b4893e04
         logger.info(f"FORMATED DOCS:\n{formated_docs}")
 
         llm = LlmLoader.create_chat_llm(model=LlmLoader.DEPLOYMENT_35_TURBO)
-        chain = LLMChain(
-            llm=llm,
-            prompt=PromptTemplate.from_template(prompt),
-        )
+        chain = get_chain(llm, get_prompt(RELATED_DOC_IDS_PROMPT))
 
         selected_ids = chain(
             {"description": description, "formated_docs": formated_docs}
@@ -131,7 +198,7 @@ EXPECTED ANSWER FORMAT: list of document ids comma separated (e.g. fd7e1b4893e04
         language = request.get("language", DEFALT_LANGUAGE)
 
         # Getting top N matching documents
-        matching_docs = self._get_matching_docs(
+        matching_docs = self.get_matching_docs(
             search_term, self.num_results
         )
 
@@ -155,8 +222,17 @@ EXPECTED ANSWER FORMAT: list of document ids comma separated (e.g. fd7e1b4893e04
 
         return '```json{"docs":' + json.dumps(transformed_docs) + "}```"
     
+    def format_reference(self, reference: Dict) -> Dict:
+        """Formats a used document as an entry of the references section."""
+        return {
+            "source": reference["id"],
+            "title": reference["title"],
+            "url": reference["url"],
+            "tool": self.display_name,
+        }
+
     def from_description(self, description: str) -> List[Dict]:
-        docs = self._get_matching_docs(description, self.num_results)
+        docs = self.get_matching_docs(description, self.num_results)
         docs =  self._transform_docs(docs)
         docs = [dict(i,**{"id": i[self.id_key], "content": i["description"]}) for i in docs]
         return docs
@@ -0,0 +1,202 @@
+"""Search tool answering from a local vector index of the documents seen before.
+
+Documents fetched by the search tools are added to the index as they go
+through `SearchToolsParallel` and `ParallelSearch`. `LocalIndexSearch` answers
+from the index when it holds enough close matches and otherwise searches its
+live tools, indexing their results, so repeat topics do not reach the network.
+
+Embeddings come from the `RELEVANCE_EMBEDDING_MODEL` sentence-transformers
+model when it is available, and from hashed word counts otherwise.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+import atexit
+import json
+import os
+import threading
+import zlib
+
+from langchain.schema import Document
+import numpy as np
+
+from tutor_helper.common.vector_index import FlatVectorIndex
+from tutor_helper.tools.contracts.document_picker import DocumentPickerTool
+from tutor_helper.tools.utilities.relevance import RELEVANCE_EMBEDDING_MODEL, encode_texts, tokenize
+
+import logging
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_ENABLED = os.getenv("LOCAL_INDEX_ENABLED", "false").lower() == "true"
+LOCAL_INDEX_PATH = os.getenv(
+    "LOCAL_INDEX_PATH", os.path.join(os.path.expanduser("~"), ".cache", "tutor_helper", "local_index")
+)
+LOCAL_INDEX_MAX_DOCS = int(os.getenv("LOCAL_INDEX_MAX_DOCS", "50000"))
+# Cosine similarity a document needs to count as a match
+LOCAL_INDEX_MIN_SCORE = float(os.getenv("LOCAL_INDEX_MIN_SCORE", "0.35"))
+# Matches needed to answer without the live tools
+LOCAL_INDEX_MIN_HITS = int(os.getenv("LOCAL_INDEX_MIN_HITS", "3"))
+LOCAL_INDEX_SAVE_EVERY = int(os.getenv("LOCAL_INDEX_SAVE_EVERY", "50"))
+HASHING_DIM = 1024
+
+_index: Optional[FlatVectorIndex] = None
+_index_lock = threading.Lock()
+# Embedding and saving happen off the request path, one batch at a time
+_index_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local_index")
+_unsaved = 0
+
+
+def hashing_embeddings(texts: Sequence[str], dim: int = HASHING_DIM) -> np.ndarray:
+    """Embeds the texts as signed, log-scaled counts of their hashed words."""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for token in tokenize(text):
+            bucket = zlib.crc32(token.encode("utf-8"))
+            vectors[i, bucket % dim] += 1.0 if bucket & 0x80000000 else -1.0
+    return np.sign(vectors) * np.log1p(np.abs(vectors))
+
+
+def embed(texts: Sequence[str]) -> np.ndarray:
+    embeddings = encode_texts(texts)
+    return hashing_embeddings(texts) if embeddings is None else embeddings
+
+
+def _embedder_name() -> str:
+    return RELEVANCE_EMBEDDING_MODEL if encode_texts(["dimension"]) is not None else f"hashing-{HASHING_DIM}"
+
+
+def get_local_index() -> FlatVectorIndex:
+    """Returns the process-wide document index, loaded from disk on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FlatVectorIndex(
+                    dim=embed(["dimension"]).shape[1],
+                    embedder=_embedder_name(),
+                    path=LOCAL_INDEX_PATH,
+                    max_docs=LOCAL_INDEX_MAX_DOCS,
+                )
+                atexit.register(_index.save)
+    return _index
+
+
+def _index_text(doc: Dict[str, Any]) -> str:
+    return f"{doc.get('title', '')}\n{doc.get('description', '')}"
+
+
+def _add_documents(docs: List[Dict[str, Any]]) -> None:
+    global _unsaved
+    index = get_local_index()
+    index.add(
+        [doc["url"] for doc in docs],
+        embed([_index_text(doc) for doc in docs]),
+        [{key: doc.get(key, "") for key in ("title", "description", "url")} for doc in docs],
+    )
+    _unsaved += len(docs)
+    if _unsaved >= LOCAL_INDEX_SAVE_EVERY:
+        _unsaved = 0
+        index.save()
+
+
+def index_documents(docs: List[Dict[str, Any]], wait: bool = False) -> None:
+    """Adds transformed search results to the local index, in the background.
+
+    Documents without a url, and those served by the index itself, are skipped.
+    """
+    if not LOCAL_INDEX_ENABLED:
+        return
+    docs = [doc for doc in docs if doc.get("url") and doc.get("tool") != "LocalIndexSearch"]
+    if not docs:
+        return
+    future = _index_writer.submit(_add_documents, docs)
+    future.add_done_callback(
+        lambda f: f.exception() and logger.error(f"[local_index] - Could not index documents: {f.exception()}")
+    )
+    if wait:
+        future.result()
+
+
+def local_index_stats() -> Dict[str, Any]:
+    return {"enabled": LOCAL_INDEX_ENABLED, **(_index.stats() if _index is not None else {})}
+
+
+class LocalIndexSearch(DocumentPickerTool):
+    DocumentPickerTool.initialize_formats()
+
+    id_key: str = "url"
+    display_name: str = "LocalIndexSearch"
+    name: str = "LocalIndexSearch"
+    description: str = (
+        "Searches the documents retrieved for previous questions, and the web when none match."
+        f"\nInput Format: {DocumentPickerTool.input_format}. "
+        f"\nOutput format: {DocumentPickerTool.output_format}"
+    )
+    num_results: int = 8
+    is_displayable: bool = True
+    index_fields: dict = {
+        "title": "title",
+        "description": "snippet",
+        "url": "url",
+    }
+    # Searched when the index has too few matches, by TOOL_MAPPING name
+    live_tools: List[str] = ["DuckDuckGoSearch"]
+    min_score: float = LOCAL_INDEX_MIN_SCORE
+    min_hits: int = LOCAL_INDEX_MIN_HITS
+
+    def _get_matching_docs(
+        self, search_term: str, num_results: int = 8, **kwargs
+    ) -> List[Document]:
+        hits = [
+            (score, payload)
+            for score, payload in get_local_index().search(embed([search_term])[0], num_results)
+            if score >= self.min_score
+        ]
+        if len(hits) >= min(self.min_hits, num_results):
+            logger.info(f"[LocalIndexSearch] - {len(hits)} local matches for: {search_term}")
+            return [
+                Document(
+                    page_content=payload["description"],
+                    metadata={
+                        "title": payload["title"],
+                        "url": payload["url"],
+                        "snippet": payload["description"],
+                        "score": round(score, 4),
+                    },
+                )
+                for score, payload in hits
+            ]
+        return self._get_live_docs(search_term, num_results)
+
+    def _get_live_docs(self, search_term: str, num_results: int) -> List[Document]:
+        # Imported here, tutor_helper.tools registers this tool
+        from tutor_helper.tools import get_tool_instances_by_config
+
+        docs = []
+        for tool in get_tool_instances_by_config(self.live_tools):
+            live_docs = tool._transform_docs(tool.get_matching_docs(search_term, num_results))
+            index_documents(live_docs)
+            docs.extend(
+                Document(
+                    page_content=doc["description"],
+                    metadata={"title": doc["title"], "url": doc["url"], "snippet": doc["description"]},
+                )
+                for doc in live_docs
+            )
+        return docs
+
+    def _transform_docs(self, docs: List) -> List[Dict]:
+        return [
+            {
+                "tool": self.name,
+                "display_name": self.display_name,
+                "title": doc.metadata[self.index_fields["title"]],
+                "description": doc.page_content,
+                "url": doc.metadata[self.index_fields["url"]],
+            }
+            for doc in docs
+        ]
+
+    def _run(self, description: str, product: Optional[str] = None) -> str:
+        return super()._run(
+            json.dumps({"description": description, "product": product})
+        )
@@ -1,7 +1,13 @@
 import concurrent.futures
+import copy
 from typing import Any, Dict, List
+from tutor_helper.common.cache import cache_key
+from tutor_helper.common.single_flight import SingleFlight
 from tutor_helper.schema.payload import SearchPayload
-from tutor_helper.tools.utilities.llm_utilities import LlmUtilities
+from tutor_helper.tools.search.local_index import index_documents
+from tutor_helper.tools.utilities.utils import normalize
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.trimming import trim_batch
 from tutor_helper.tools import get_tool_instances_by_config, DEFAULT_TOOLKITS
 
 # Initialize the logger module
@@ -10,30 +16,37 @@ logger = logging.getLogger(__name__)
 
 TOOLS_MAP = DEFAULT_TOOLKITS
 
+# Identical searches running at the same time are made once
+search_flight = SingleFlight("parallel_search")
+
 
 class ParallelSearch(object):
     def __init__(self, language="english"):
         self.language = language
         self.max_description_token_count = 250
-        self.trim_iter_size = 250
 
     def _assure_max_doc_description_length(self, docs: List) -> List:
-        for doc in docs:
-            token_count = LlmUtilities.count_tokens(str(doc["description"]))
-            if token_count > self.max_description_token_count:
-                # Shorten the description until the max token size it matched
+        descriptions = [str(doc["description"]) for doc in docs]
+        # Shorten all descriptions exceeding the max token size in one batch
+        trimmed_descriptions = trim_batch(descriptions, self.max_description_token_count)
+        # Cached by trim_batch, counting again is a lookup
+        counts = tokens.count_tokens_batch(descriptions)
+        for doc, description, trimmed, count in zip(docs, descriptions, trimmed_descriptions, counts):
+            if trimmed != description:
                 logger.warning(
-                    f"[ParallelSearch]: Description exceeds max token count: {token_count} ({doc['title']})"
-                )
-                doc["description"] = LlmUtilities.trim_string_to_token_count(
-                    str(doc["description"]),
-                    self.max_description_token_count,
-                    self.trim_iter_size,
+                    f"[ParallelSearch]: Description exceeds max token count: {count} ({doc['title']})"
                 )
+                doc["description"] = trimmed
 
         return docs
 
     def search(self, search_term, tools=None) -> List:
+        key = cache_key(self.language, normalize(search_term), repr(tools))
+        docs = search_flight.do(key, lambda: self._search(search_term, tools))
+        # Every caller gets its own copy of the shared docs
+        return copy.deepcopy(docs)
+
+    def _search(self, search_term, tools=None) -> List:
         logger.info(f"Tools: {tools}")
         if tools:
             tools = get_tool_instances_by_config(tools)
@@ -73,10 +86,11 @@ class ParallelSearch(object):
 
     def executor_wrapper(self, tool, search_term):
 
-        docs = tool._get_matching_docs(
+        docs = tool.get_matching_docs(
             search_term,
             tool.num_results
         )
         transformed_docs = tool._transform_docs(docs)
+        index_documents(transformed_docs)
 
         return transformed_docs
@@ -1,8 +1,24 @@
+from langchain.callbacks.manager import Callbacks
 from langchain.tools import StructuredTool
 from tutor_helper.chains.knowledge_research import (
     KnowledgeResearch,
 )
+from tutor_helper.common.cache import cache_key
+from tutor_helper.common.single_flight import SingleFlight
+from tutor_helper.tools.utilities.utils import normalize
 from pydantic import BaseModel
+import copy
+
+# Identical questions asked at the same time are researched once
+research_flight = SingleFlight("knowledge_research")
+
+
+def _research_key(similarity_search_term: str, request_raw_question_input: str, notes: str) -> str:
+    return cache_key(
+        normalize(similarity_search_term),
+        normalize(request_raw_question_input),
+        normalize(notes or ""),
+    )
 
 
 def knowledge_research(
@@ -12,17 +28,50 @@ def knowledge_research(
 ):
     """Researches and returns content from Trend Micro knowledge base articles and technical product documentation."""
 
-    internal_knowledge_research_chain = KnowledgeResearch()
-    answer = internal_knowledge_research_chain(
-        {
-            "description": similarity_search_term,
-            "revised_question": request_raw_question_input,
-            "notes": notes,
-        }
+    def research():
+        internal_knowledge_research_chain = KnowledgeResearch()
+        return internal_knowledge_research_chain(
+            {
+                "description": similarity_search_term,
+                "revised_question": request_raw_question_input,
+                "notes": notes,
+            }
+        )
+
+    answer = research_flight.do(
+        _research_key(similarity_search_term, request_raw_question_input, notes), research
     )
+    # Every caller gets its own copy of the shared answer
+    return copy.deepcopy(answer)
 
-    return answer
+
+async def aknowledge_research(
+    similarity_search_term: str,
+    request_raw_question_input: str,
+    notes: str = "",
+    callbacks: Callbacks = None,
+):
+    """Researches and returns content from Trend Micro knowledge base articles and technical product documentation."""
+
+    async def research():
+        internal_knowledge_research_chain = KnowledgeResearch()
+        # Progress is reported to the callbacks of the call that runs the research
+        return await internal_knowledge_research_chain.ainvoke(
+            {
+                "description": similarity_search_term,
+                "revised_question": request_raw_question_input,
+                "notes": notes,
+            },
+            config={"callbacks": callbacks},
+        )
+
+    answer = await research_flight.ado(
+        _research_key(similarity_search_term, request_raw_question_input, notes), research
+    )
+    return copy.deepcopy(answer)
 
 
 def knowledge_research_tool():
-    return StructuredTool.from_function(knowledge_research)
+    return StructuredTool.from_function(
+        func=knowledge_research, coroutine=aknowledge_research
+    )
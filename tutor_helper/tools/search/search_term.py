@@ -1,8 +1,7 @@
 from langchain.output_parsers import StructuredOutputParser, ResponseSchema
 from langchain.tools import BaseTool
 from tutor_helper.common.llms import LlmLoader
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
+from tutor_helper.prompts.registry import get_chain, get_prompt
 from langchain.chains import LLMChain
 from langchain.schema import Generation, LLMResult
 
@@ -39,18 +38,8 @@ class SearchTerm(BaseTool):
 Create a search term based on the description provided. The search term should be in {language} and constructed in such a way that it is optimized for use with Web Search keyword and vector search functionalities to find relevant documents or troubleshooting guides. The search term must capture the essence of the issue described, using key technical terms and context cues to ensure accurate and helpful search results. Respond with the search term only!
 INPUT: ```{description}```
 """
-    def _run(self, query: str) -> str:
-        # Parsing input query/product json
-        request = self.input_parser.parse(query)
+    def _build_chain(self) -> LLMChain:
         model_name = LlmLoader.DEPLOYMENT_35_TURBO
-
-        # To filter responses generated by specific LLM model (e.g. gpt-4)
-        params = {}
-        params["llm"] = model_name
-        params["tm_tool"] = self.name
-        prompts = [request["description"]]
-
-        problem_description = prompts[0]            
         llm = LlmLoader.create_chat_llm(
             model=model_name,
             temperature=0.4,
@@ -58,21 +47,31 @@ INPUT: ```{description}```
             verbose=True,
         )
 
-        search_query_chain = LLMChain(
-            verbose=False,
-            llm=llm,
-            prompt=PromptTemplate.from_template(self.prompt),
-        )
+        # The client is shared, so is the chain built on it
+        return get_chain(llm, get_prompt(self.prompt), verbose=False)
+
+    def _parse_request(self, query: str) -> dict:
+        # Parsing input query/product json
+        request = self.input_parser.parse(query)
         language = "english"
         request.update({"language": language})
+        return request
+
+    def _run(self, query: str) -> str:
+        request = self._parse_request(query)
+        search_query_chain = self._build_chain()
         search_term = search_query_chain(request)
         logger.info(f"Search Term: {search_term}")
 
         return '```json{"search_term":' + json.dumps(search_term) + "}```"
-    
-    def _arun(self, query: str) -> str:
-        logger.info("arun and QUIT")
-        quit()
+
+    async def _arun(self, query: str) -> str:
+        request = self._parse_request(query)
+        search_query_chain = self._build_chain()
+        search_term = await search_query_chain.ainvoke(request)
+        logger.info(f"Search Term: {search_term}")
+
+        return '```json{"search_term":' + json.dumps(search_term) + "}```"
 
     def from_description(self, description: str):
         """Input and output are in raw strings"""
@@ -81,3 +80,11 @@ INPUT: ```{description}```
         )
         response_json = self.output_parser.parse(response)
         return response_json["search_term"]
+
+    async def afrom_description(self, description: str):
+        """Async version of `from_description`"""
+        response = await self._arun(
+            '```json{"description":' + json.dumps(description) + "}```"
+        )
+        response_json = self.output_parser.parse(response)
+        return response_json["search_term"]
@@ -1,7 +1,8 @@
-import tiktoken
 import json
 import re
 from tutor_helper.common.llms import LlmLoader
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.trimming import trim_to_token_count
 
 
 class LlmUtilities:
@@ -9,60 +10,34 @@ class LlmUtilities:
         pass
 
     def count_tokens(*_args):
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        tokens_total = 0
-
-        for arg in _args:
-            token_count = len(encoding.encode(str(arg)))
-            tokens_total += token_count
+        encoding_name = tokens.encoding_name_for("gpt-3.5-turbo")
+        tokens_total = sum(tokens.count_tokens_batch(_args, encoding_name))
 
         return int(tokens_total)
 
-    def trim_string_to_token_count(string, max_token_count, trim_iter_size=1750):
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        string_original_length = len(encoding.encode(str(string)))
-
-        if string_original_length > max_token_count:
-            print(
-                f"Trimming original string with {string_original_length} token to max {max_token_count}."
-            )
-            while len(encoding.encode(str(string))) > max_token_count:
-                # TOASK: Why trim_iter_size is 1750?
-                # This is to trim the last trim_iter_size characters from the string
-                string = string[:-trim_iter_size]  # Trim the last N characters
-
-            # Replace last "cut" word with "..."
-            string = re.sub(r"\s+\S+$", "...", string)
-
-            new_length = len(encoding.encode(str(string)))
-            print(f"New string token count: {new_length}")
-
-        return string
-
-    def trim_string_to_token_count_new(string: str, max_token_count: int) -> str:
+    def trim_string_to_token_count(string, max_token_count, trim_iter_size=None):
         """To trim token count to max_token_count
 
+        The string is encoded once and cut at the token budget, then moved back
+        to the last full word. `trim_iter_size` is kept for backward compatibility
+        and is no longer used.
+
         Args:
             string (str): the original string
             max_token_count (int): maximum token count
 
         Returns:
-            str: _description_
+            str: the trimmed string, ending with "..." if it was trimmed
         """
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        string_original_length = len(encoding.encode(str(string)))
+        return trim_to_token_count(
+            str(string),
+            max_token_count,
+            encoding_name=tokens.encoding_name_for("gpt-3.5-turbo"),
+        )
 
-        if string_original_length > max_token_count:
-            print(
-                f"Trimming original string with {string_original_length} token to max {max_token_count}."
-            )
-            string = encoding.decode(encoding.encode(string)[:max_token_count])
-            string = re.sub(r"\s+\S+$", "...", string)
-
-            new_length = len(encoding.encode(str(string)))
-            print(f"New string token count: {new_length}")
-
-        return string
+    def trim_string_to_token_count_new(string: str, max_token_count: int) -> str:
+        """Alias of `trim_string_to_token_count`, kept for existing callers."""
+        return LlmUtilities.trim_string_to_token_count(string, max_token_count)
 
     def verify_content_is_json(response):
         response_content = response.content
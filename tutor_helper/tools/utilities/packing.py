@@ -0,0 +1,135 @@
+"""Packing of several texts into one token budget.
+
+Instead of giving every text an equal share and cutting each one, the texts
+are counted once and the budget is water-filled: short texts are kept whole,
+and what they leave is shared by the longer ones in proportion to their
+weight, the relevance of each text. Passages repeated across the texts are
+kept only once, in the most relevant text, and texts whose share would be too
+small to be useful are dropped, least relevant first.
+"""
+import os
+import re
+from typing import List, Optional, Sequence, Set, Tuple
+
+from tutor_helper.tools.utilities import tokens
+from tutor_helper.tools.utilities.trimming import trim_batch
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Passages sharing at least this share of their shingles are duplicates
+PACKING_DEDUPE_THRESHOLD = float(os.getenv("PACKING_DEDUPE_THRESHOLD", "0.8"))
+# Texts that would get fewer tokens than this are dropped instead of cut
+PACKING_MIN_TOKENS = int(os.getenv("PACKING_MIN_TOKENS", "48"))
+# Texts without relevance still get a share of the budget
+MIN_WEIGHT = 0.05
+SHINGLE_SIZE = 5
+
+PASSAGE_SEPARATOR = re.compile(r"\n\s*\n")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def water_fill(lengths: Sequence[int], weights: Sequence[float], budget: int) -> List[int]:
+    """Splits `budget` in proportion to `weights`, never giving more than the length.
+
+    What a text does not need is shared again by the others, so the whole
+    budget is used as long as the texts do not fit.
+    """
+    allocation = [0] * len(lengths)
+    remaining = [i for i, length in enumerate(lengths) if length > 0]
+    while remaining and budget > 0:
+        total_weight = sum(weights[i] for i in remaining)
+        shares = {i: budget * weights[i] / total_weight for i in remaining}
+        satisfied = [i for i in remaining if lengths[i] <= shares[i]]
+        if not satisfied:
+            for i in remaining:
+                allocation[i] = int(shares[i])
+            break
+        for i in satisfied:
+            allocation[i] = lengths[i]
+            budget -= lengths[i]
+        remaining = [i for i in remaining if i not in satisfied]
+    return allocation
+
+
+def _shingles(passage: str) -> Set[Tuple[str, ...]]:
+    words = WORD_PATTERN.findall(passage.lower())
+    return {tuple(words[i : i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def dedupe_passages(texts: Sequence[str], threshold: float = PACKING_DEDUPE_THRESHOLD) -> List[str]:
+    """Removes the passages nearly identical to one in an earlier text.
+
+    Passages are the paragraphs of each text, compared by the Jaccard
+    similarity of their word shingles. Passages too short to shingle are kept.
+    """
+    seen: List[Set[Tuple[str, ...]]] = []
+    deduped = []
+    for text in texts:
+        passages = []
+        for passage in PASSAGE_SEPARATOR.split(text):
+            shingles = _shingles(passage)
+            if shingles and any(
+                len(shingles & other) >= threshold * len(shingles | other) for other in seen
+            ):
+                continue
+            if shingles:
+                seen.append(shingles)
+            passages.append(passage)
+        deduped.append("\n\n".join(passages).strip())
+    return deduped
+
+
+def pack(
+    texts: Sequence[str],
+    budget: int,
+    weights: Optional[Sequence[float]] = None,
+    overheads: Optional[Sequence[int]] = None,
+    min_tokens: int = PACKING_MIN_TOKENS,
+    dedupe_threshold: float = PACKING_DEDUPE_THRESHOLD,
+    encoding_name: str = tokens.DEFAULT_ENCODING,
+) -> List[Tuple[int, str]]:
+    """Fits the texts into `budget` tokens, favouring the most relevant ones.
+
+    Args:
+        texts (List[str]): the texts to pack
+        budget (int): tokens available for the texts and their overheads
+        weights (List[float], optional): relevance of each text. Defaults to equal weights.
+        overheads (List[int], optional): tokens each kept text adds around its content
+        min_tokens (int): texts that would get fewer tokens are dropped
+        dedupe_threshold (float): shingle similarity above which passages are duplicates
+        encoding_name (str, optional): tiktoken encoding. Defaults to cl100k_base.
+
+    Returns:
+        List[Tuple[int, str]]: (index, packed text) of the kept texts, most relevant first,
+        then (index, "") of the texts left empty by deduplication, their content
+        being in a kept text
+    """
+    weights = [max(weight, MIN_WEIGHT) for weight in weights] if weights else [1.0] * len(texts)
+    overheads = list(overheads) if overheads else [0] * len(texts)
+    # Stable, so that ties keep the given order
+    order = sorted(range(len(texts)), key=lambda i: -weights[i])
+
+    deduped = dict(zip(order, dedupe_passages([texts[i] for i in order], dedupe_threshold)))
+    counts = dict(zip(order, tokens.count_tokens_batch([deduped[i] for i in order], encoding_name)))
+
+    kept = [i for i in order if counts[i] > 0]
+    duplicates = [i for i in order if counts[i] == 0 and texts[i].strip()]
+    allocation: List[int] = []
+    while kept:
+        available = max(budget - sum(overheads[i] for i in kept), 0)
+        allocation = water_fill([counts[i] for i in kept], [weights[i] for i in kept], available)
+        starved = [i for i, share in zip(kept, allocation) if share < min(min_tokens, counts[i])]
+        if not starved:
+            break
+        # The least relevant of the texts left without a useful share
+        kept.remove(starved[-1])
+    if not kept:
+        allocation = []
+
+    packed = trim_batch([deduped[i] for i in kept], allocation, encoding_name, boundary="sentence")
+    logger.debug(
+        f"[packing] - Packed {len(kept)} of {len(texts)} texts from {sum(counts.values())} "
+        f"into {sum(allocation)} of {budget} tokens"
+    )
+    return list(zip(kept, packed)) + [(i, "") for i in duplicates]
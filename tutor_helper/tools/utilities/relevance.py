@@ -0,0 +1,159 @@
+"""Local relevance scoring of the chunks, before they are sent to the extract LLM.
+
+Chunks are scored against the question with BM25, vectorized with NumPy over
+the whole chunk set. Optionally, when `RELEVANCE_EMBEDDING_MODEL` names a
+sentence-transformers model and the package is installed, the cosine
+similarity of the chunk and question embeddings is blended in. The chunks are
+then ranked, and those below `RELEVANCE_MIN_SCORE_RATIO` of the best score or
+beyond `RELEVANCE_TOP_K` are dropped, so that only likely relevant chunks cost
+an extract call.
+"""
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+RELEVANCE_PREFILTER = os.getenv("RELEVANCE_PREFILTER", "true").lower() == "true"
+RELEVANCE_TOP_K = int(os.getenv("RELEVANCE_TOP_K", "12"))
+RELEVANCE_MIN_SCORE_RATIO = float(os.getenv("RELEVANCE_MIN_SCORE_RATIO", "0.2"))
+# Never keep fewer chunks than this, whatever their score
+RELEVANCE_MIN_KEEP = int(os.getenv("RELEVANCE_MIN_KEEP", "3"))
+RELEVANCE_EMBEDDING_MODEL = os.getenv("RELEVANCE_EMBEDDING_MODEL", "")
+# Weight of the embedding similarity when blended with BM25
+RELEVANCE_EMBEDDING_WEIGHT = float(os.getenv("RELEVANCE_EMBEDDING_WEIGHT", "0.5"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    """a an and are as at be but by can do does for from how i if in into is it
+    its me my of on or should so that the their them then there these they this
+    to use used using was what when where which who why will with would you your""".split()
+)
+
+try:
+    if RELEVANCE_EMBEDDING_MODEL:
+        from sentence_transformers import SentenceTransformer
+    else:
+        SentenceTransformer = None
+except ImportError:
+    logger.warning("[relevance] - RELEVANCE_EMBEDDING_MODEL is set but sentence-transformers is not installed")
+    SentenceTransformer = None
+
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def bm25_scores(query: str, texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B) -> np.ndarray:
+    """BM25 score of each text for the query, the texts are the corpus."""
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    if not texts or not query_terms:
+        return np.zeros(len(texts))
+
+    term_index = {term: j for j, term in enumerate(query_terms)}
+    # Counts of the query terms only, one row per text
+    tf = np.zeros((len(texts), len(query_terms)))
+    lengths = np.zeros(len(texts))
+    for i, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths[i] = len(tokens)
+        for term, count in Counter(token for token in tokens if token in term_index).items():
+            tf[i, term_index[term]] = count
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((len(texts) - df + 0.5) / (df + 0.5) + 1.0)
+    average_length = lengths.mean() or 1.0
+    norm = k1 * (1 - b + b * lengths / average_length)
+    return (idf * tf * (k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+
+def _get_embedding_model():
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                logger.info(f"[relevance] - Loading embedding model {RELEVANCE_EMBEDDING_MODEL}")
+                _embedding_model = SentenceTransformer(RELEVANCE_EMBEDDING_MODEL)
+    return _embedding_model
+
+
+def encode_texts(texts: Sequence[str]) -> Optional[np.ndarray]:
+    """Normalized embeddings of the texts, None without an embedding model."""
+    if SentenceTransformer is None:
+        return None
+    return _get_embedding_model().encode(
+        list(texts), normalize_embeddings=True, convert_to_numpy=True
+    )
+
+
+def embedding_scores(query: str, texts: Sequence[str]) -> Optional[np.ndarray]:
+    """Cosine similarity of each text to the query, None without an embedding model."""
+    if not texts:
+        return None
+    embeddings = encode_texts([query, *texts])
+    if embeddings is None:
+        return None
+    return embeddings[1:] @ embeddings[0]
+
+
+def relevance_scores(query: str, texts: Sequence[str]) -> np.ndarray:
+    """BM25 scores scaled to [0, 1], blended with the embedding similarity if available."""
+    scores = bm25_scores(query, texts)
+    if scores.size and scores.max() > 0:
+        scores = scores / scores.max()
+    similarities = embedding_scores(query, texts)
+    if similarities is not None:
+        weight = RELEVANCE_EMBEDDING_WEIGHT
+        scores = (1 - weight) * scores + weight * np.clip(similarities, 0, 1)
+    return scores
+
+
+def prefilter_docs(
+    docs: List[Any],
+    query: str,
+    top_k: int = RELEVANCE_TOP_K,
+    min_score_ratio: float = RELEVANCE_MIN_SCORE_RATIO,
+    min_keep: int = RELEVANCE_MIN_KEEP,
+    keep_sources: Sequence[str] = (),
+) -> List[Any]:
+    """Ranks the chunks by relevance to `query` and drops the unlikely ones.
+
+    Args:
+        docs (List): the chunks, as transformed by `SearchToolsParallel.transform`
+        query (str): the question and search term
+        top_k (int): the most chunks kept, 0 for no limit
+        min_score_ratio (float): chunks scoring below this share of the best score are dropped
+        min_keep (int): the fewest chunks kept, whatever their score
+        keep_sources (List[str]): sources that are always kept, like the docs added by id
+
+    Returns:
+        List: the kept chunks, most relevant first, with their `relevance_score` in the metadata
+    """
+    if not docs:
+        return docs
+    scores = relevance_scores(query, [doc.page_content for doc in docs])
+    best = scores.max()
+    # Stable, so that ties keep the order of the search results
+    ranking = np.argsort(-scores, kind="stable")
+
+    kept = []
+    for rank, i in enumerate(ranking):
+        doc = docs[i]
+        doc.metadata["relevance_score"] = round(float(scores[i]), 4)
+        forced = doc.metadata.get("source") in keep_sources
+        within_top_k = not top_k or len(kept) < top_k
+        relevant = scores[i] > 0 and scores[i] >= best * min_score_ratio
+        if forced or rank < min_keep or (within_top_k and relevant):
+            kept.append(doc)
+    return kept
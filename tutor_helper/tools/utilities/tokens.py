@@ -0,0 +1,172 @@
+"""Process-wide token accounting.
+
+Encoders are loaded once per process and token counts are memoized by a hash of
+the content, so a snippet that is counted by the search, chunking and summary
+steps of the same request is only encoded once.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import tiktoken
+from tiktoken.model import encoding_name_for_model
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+DEFAULT_MODEL = "gpt-3.5-turbo"
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "20000"))
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    """Returns the shared encoder for `encoding_name`, loading it on first use."""
+    encoding = _encodings.get(encoding_name)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(encoding_name)
+            if encoding is None:
+                encoding = tiktoken.get_encoding(encoding_name)
+                _encodings[encoding_name] = encoding
+    return encoding
+
+
+def encoding_name_for(model_name: str = DEFAULT_MODEL) -> str:
+    """Maps a model or Azure deployment name to its encoding name."""
+    try:
+        return encoding_name_for_model(model_name)
+    except KeyError:
+        # Azure deployment names ("gpt-35-turbo-16k") are not always known to tiktoken
+        return DEFAULT_ENCODING
+
+
+def encoding_for_model(model_name: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+    """Returns the shared encoder used by `model_name`."""
+    return get_encoding(encoding_name_for(model_name))
+
+
+class TokenCounter:
+    """Counts tokens with a bounded LRU of counts keyed by content hash."""
+
+    def __init__(
+        self, encoding_name: str = DEFAULT_ENCODING, max_size: int = TOKEN_CACHE_SIZE
+    ):
+        self.encoding_name = encoding_name
+        self.max_size = max_size
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        return get_encoding(self.encoding_name)
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def encode(self, text: str) -> List[int]:
+        """Encodes `text`, treating special tokens in retrieved content as plain text."""
+        tokens = self.encoding.encode(text, disallowed_special=())
+        self._store(self._key(text), len(tokens))
+        return tokens
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        tokens_list = self.encoding.encode_batch(texts, disallowed_special=())
+        for text, tokens in zip(texts, tokens_list):
+            self._store(self._key(text), len(tokens))
+        return tokens_list
+
+    def count(self, text: str) -> int:
+        """Returns the number of tokens in `text`."""
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: Iterable[str]) -> List[int]:
+        """Returns the token count of each text, encoding only the cache misses."""
+        texts = [str(text) for text in texts]
+        keys = [self._key(text) for text in texts]
+        counts: List[Optional[int]] = [None] * len(texts)
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                count = self._counts.get(key)
+                if count is not None:
+                    self._counts.move_to_end(key)
+                    counts[i] = count
+            missing = [i for i, count in enumerate(counts) if count is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # Identical texts in the same batch are encoded once
+            unique = {keys[i]: texts[i] for i in missing}
+            encoded = self.encoding.encode_batch(
+                list(unique.values()), disallowed_special=()
+            )
+            new_counts = {key: len(tokens) for key, tokens in zip(unique, encoded)}
+            for key, count in new_counts.items():
+                self._store(key, count)
+            for i in missing:
+                counts[i] = new_counts[keys[i]]
+
+        return counts
+
+    def _store(self, key: bytes, count: int) -> None:
+        with self._lock:
+            self._counts[key] = count
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_size:
+                self._counts.popitem(last=False)
+
+    def cache_info(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._counts),
+            "max_size": self.max_size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> TokenCounter:
+    """Returns the process-wide counter for `encoding_name`."""
+    counter = _counters.get(encoding_name)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(encoding_name, TokenCounter(encoding_name))
+    return counter
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """Returns the number of tokens in a text string."""
+    return get_token_counter(encoding_name).count(text)
+
+
+def count_tokens_batch(
+    texts: Iterable[str], encoding_name: str = DEFAULT_ENCODING
+) -> List[int]:
+    """Returns the number of tokens of each text string, in order."""
+    return get_token_counter(encoding_name).count_batch(texts)
+
+
+def encode(text: str, encoding_name: str = DEFAULT_ENCODING) -> List[int]:
+    return get_token_counter(encoding_name).encode(text)
+
+
+def decode(tokens: List[int], encoding_name: str = DEFAULT_ENCODING) -> str:
+    return get_encoding(encoding_name).decode(tokens)
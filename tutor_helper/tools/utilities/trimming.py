@@ -0,0 +1,198 @@
+"""Token-bounded trimming and chunking.
+
+Every text is encoded once. The cut is made directly at the token budget and
+then moved back to the closest sentence or word boundary, so no re-encoding loop
+is needed. Descriptions, summaries and document chunks all go through here so
+they are truncated the same way.
+"""
+from typing import List, Optional, Sequence, Union
+
+from tutor_helper.tools.utilities import tokens
+
+import logging
+logger = logging.getLogger(__name__)
+
+TRIM_SUFFIX = "..."
+SENTENCE_ENDINGS = (b".", b"!", b"?", b":", "。".encode("utf-8"))
+# Never move the cut back by more than this share of the budget
+MAX_SNAP_BACK_RATIO = 0.3
+
+
+def _is_word_start(token_bytes: bytes) -> bool:
+    return token_bytes[:1].isspace()
+
+
+def _is_sentence_start(token_bytes: List[bytes], index: int) -> bool:
+    return _is_word_start(token_bytes[index]) and token_bytes[index - 1].rstrip().endswith(
+        SENTENCE_ENDINGS
+    )
+
+
+def _is_char_start(token_bytes: List[bytes], index: int) -> bool:
+    # A token starting with a UTF-8 continuation byte ends the previous character
+    return index >= len(token_bytes) or not 0x80 <= token_bytes[index][0] < 0xC0
+
+
+def _char_boundary(token_bytes: List[bytes], start: int, index: int) -> int:
+    """The closest token index to `index` that does not split a character.
+
+    Moves back first, without reaching `start`, and forward only when the
+    whole span is a single character, so that a chunk is never empty.
+    """
+    for candidate in range(index, start, -1):
+        if _is_char_start(token_bytes, candidate):
+            return candidate
+    while not _is_char_start(token_bytes, index):
+        index += 1
+    return index
+
+
+def _cut_index(
+    token_bytes: List[bytes], start: int, end: int, boundary: Optional[str]
+) -> int:
+    """Returns the token index in `(start, end]` at which a text should be cut.
+
+    Cutting right before a token that starts with whitespace keeps whole words,
+    so the snapped prefix is still exactly `index - start` tokens long.
+    """
+    if end >= len(token_bytes):
+        return end
+    if boundary is None:
+        return _char_boundary(token_bytes, start, end)
+
+    lowest = max(start + 1, end - int((end - start) * MAX_SNAP_BACK_RATIO))
+    if boundary == "sentence":
+        for index in range(end, lowest - 1, -1):
+            if _is_sentence_start(token_bytes, index):
+                return index
+    if boundary in ("sentence", "word"):
+        for index in range(end, lowest - 1, -1):
+            if _is_word_start(token_bytes[index]):
+                return index
+    # No whitespace nearby, e.g. CJK text, cut between two characters
+    return _char_boundary(token_bytes, start, end)
+
+
+def _decode(token_bytes: List[bytes]) -> str:
+    # Cuts are made between characters, the bytes always decode
+    return b"".join(token_bytes).decode("utf-8", errors="replace")
+
+
+def _trim_encoded(
+    encoded: List[int],
+    max_token_count: int,
+    encoding_name: str,
+    boundary: Optional[str],
+    suffix: str,
+) -> str:
+    counter = tokens.get_token_counter(encoding_name)
+    token_bytes = counter.encoding.decode_tokens_bytes(encoded)
+    if suffix and counter.count(suffix) >= max_token_count:
+        suffix = ""
+    budget = max_token_count - (counter.count(suffix) if suffix else 0)
+
+    cut = _cut_index(token_bytes, 0, budget, boundary)
+    trimmed = _decode(token_bytes[:cut]).rstrip() + suffix
+    if counter.count(trimmed) <= max_token_count:
+        return trimmed
+
+    # Re-encoding the joined suffix may add a token, search the largest cut that fits
+    low, high = 0, cut
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count(_decode(token_bytes[:middle]).rstrip() + suffix) <= max_token_count:
+            low = middle
+        else:
+            high = middle - 1
+    while low > 0 and not _is_char_start(token_bytes, low):
+        low -= 1
+    return _decode(token_bytes[:low]).rstrip() + suffix
+
+
+def trim_to_token_count(
+    text: str,
+    max_token_count: int,
+    encoding_name: str = tokens.DEFAULT_ENCODING,
+    boundary: Optional[str] = "word",
+    suffix: str = TRIM_SUFFIX,
+) -> str:
+    """Trims `text` to at most `max_token_count` tokens.
+
+    Args:
+        text (str): the original string
+        max_token_count (int): maximum token count, including the suffix
+        encoding_name (str, optional): tiktoken encoding. Defaults to cl100k_base.
+        boundary (str, optional): "sentence", "word" or None for a hard token cut.
+        suffix (str, optional): appended to trimmed strings. Defaults to "...".
+
+    Returns:
+        str: the original string if it fits, otherwise the trimmed string
+    """
+    return trim_batch([text], max_token_count, encoding_name, boundary, suffix)[0]
+
+
+def trim_batch(
+    texts: List[str],
+    max_token_count: Union[int, Sequence[int]],
+    encoding_name: str = tokens.DEFAULT_ENCODING,
+    boundary: Optional[str] = "word",
+    suffix: str = TRIM_SUFFIX,
+) -> List[str]:
+    """Trims every text to at most `max_token_count` tokens in one batch.
+
+    `max_token_count` is either one budget for all the texts or one per text.
+    Counts come from the shared token cache and only the texts over budget are
+    encoded, all in a single `encode_batch` call.
+    """
+    texts = [str(text) for text in texts]
+    if isinstance(max_token_count, int):
+        budgets = [max_token_count] * len(texts)
+    else:
+        budgets = list(max_token_count)
+    counter = tokens.get_token_counter(encoding_name)
+    counts = counter.count_batch(texts)
+
+    over_budget = [i for i, count in enumerate(counts) if count > budgets[i]]
+    if not over_budget:
+        return texts
+
+    trimmed = list(texts)
+    encoded = counter.encode_batch([texts[i] for i in over_budget])
+    for i, text_tokens in zip(over_budget, encoded):
+        trimmed[i] = (
+            _trim_encoded(text_tokens, budgets[i], encoding_name, boundary, suffix)
+            if budgets[i] > 0
+            else ""
+        )
+        logger.debug(
+            f"[trimming] - Trimmed text from {counts[i]} to max {budgets[i]} tokens"
+        )
+    return trimmed
+
+
+def split_to_token_chunks(
+    text: str,
+    chunk_length: int,
+    encoding_name: str = tokens.DEFAULT_ENCODING,
+    boundary: Optional[str] = "sentence",
+) -> List[str]:
+    """Splits `text` into chunks of at most `chunk_length` tokens.
+
+    The text is encoded once and each chunk ends on a sentence or word boundary
+    when one is close to the budget, the remainder starts the next chunk.
+    """
+    counter = tokens.get_token_counter(encoding_name)
+    if counter.count(text) <= chunk_length:
+        return [text]
+
+    token_bytes = counter.encoding.decode_tokens_bytes(counter.encode(text))
+    chunks = []
+    start = 0
+    while start < len(token_bytes):
+        end = _cut_index(
+            token_bytes, start, min(start + chunk_length, len(token_bytes)), boundary
+        )
+        chunks.append(_decode(token_bytes[start:end]))
+        start = end
+    return chunks
+
@@ -3,7 +3,7 @@ import jsonschema
 from typing import Any, Dict, List, Optional, Union
 from pathlib import Path
 import re
-import tiktoken
+from tutor_helper.tools.utilities import tokens
 
 default_format = "%(asctime)s\t%(levelname)s\tP%(process)d\tT%(thread)d\t%(filename)s:%(lineno)d\t%(funcName)s: %(message)s"
 
@@ -16,9 +16,14 @@ JsonDict = Dict[str, Any]
 
 def num_tokens_from_string(string: str, encoding_name: str = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
-    return num_tokens
+    return tokens.count_tokens(string, encoding_name)
+
+
+def num_tokens_from_strings(
+    strings: List[str], encoding_name: str = "cl100k_base"
+) -> List[int]:
+    """Returns the number of tokens of each text string, counted in one batch."""
+    return tokens.count_tokens_batch(strings, encoding_name)
 
 
 def split_by_token(
@@ -28,11 +33,10 @@ def split_by_token(
 
     if num_tokens <= chunk_length:
         return [string]
-    encoding = tiktoken.get_encoding(encoding_name)
-    string_encoding = encoding.encode(string)
+    string_encoding = tokens.encode(string, encoding_name)
 
     return [
-        encoding.decode(string_encoding[i : i + chunk_length])
+        tokens.decode(string_encoding[i : i + chunk_length], encoding_name)
         for i in range(0, num_tokens, chunk_length)
     ]
 
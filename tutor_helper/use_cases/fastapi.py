@@ -1,4 +1,5 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from tutor_helper.schema.payload import (
     SearchPayload,
     SearchTermPayload,
@@ -6,33 +7,73 @@ from tutor_helper.schema.payload import (
 from tutor_helper.tools.search.parallel_search import ParallelSearch
 from tutor_helper.tools.search.search_term import SearchTerm
 
-from tutor_helper.agents.tutor_assistant.base import (
-    chat_agent,
-)
-from tutor_helper.agents.tutor_assistant.toolkit import SimplifiedToolkit
+from tutor_helper.agents.tutor_assistant.session import get_session_registry
+from tutor_helper.callbacks.structured_log import log_writer_stats
+from tutor_helper.callbacks.websocket_stream import WebsocketStreamCallbackHandler
+from tutor_helper.common.llm_pool import get_client_registry
 from tutor_helper.common.llms import LlmLoader
-from tutor_helper.prompts.templates.chat_agent import ChatResponseWithKB
-from tutor_helper.output_parsers.agent_parser import NewAgentOutputFixingParser
+from tutor_helper.common.offload import OffloadQueueFull, get_offload_pool
+from tutor_helper.common.retry import retry_stats
+from tutor_helper.common.scheduler import get_scheduler
+from tutor_helper.common.telemetry import get_metrics_registry, recent_spans
+from tutor_helper.tools.contracts.document_picker import search_cache_stats
+from tutor_helper.tools.search.local_index import local_index_stats
+from tutor_helper.tools.search.parallel_search import search_flight
+from tutor_helper.tools.search.search_for_chain import research_flight
 
 
+import asyncio
+from contextlib import asynccontextmanager
 import json
 import logging
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Close the keep-alive connections of the shared LLM clients on their loop
+    await get_client_registry().aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _runtime_gauges():
+    offload = get_offload_pool().stats()
+    llm_clients = LlmLoader.client_stats()
+    llm_log = log_writer_stats()
+    scheduler = get_scheduler().stats()
+    return {
+        "tutor_helper_offload_in_flight": offload["in_flight"],
+        "tutor_helper_offload_queue_depth": offload["queue_depth"],
+        "tutor_helper_sessions": get_session_registry().stats()["sessions"],
+        "tutor_helper_llm_clients": llm_clients["clients"],
+        "tutor_helper_llm_log_queue_depth": llm_log["queue_depth"],
+        "tutor_helper_llm_log_dropped": llm_log["dropped"],
+        "tutor_helper_scheduler_in_flight": scheduler["in_flight"],
+        "tutor_helper_scheduler_queued": scheduler["queued"],
+    }
+
+
+get_metrics_registry().register_collector(_runtime_gauges)
 
 
 # @async_trace_decorator
 @app.post("/search/ts")
 async def search_ts(payload: SearchPayload):
-    results = ParallelSearch()(payload)
+    # ParallelSearch has no async path, run it in the offload pool
+    try:
+        results = await get_offload_pool().run(ParallelSearch(), payload)
+    except OffloadQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return results
 
 
 # @async_trace_decorator
 @app.post("/llm/actions/create_search_term")
 async def create_search_term_action(payload: SearchTermPayload):
-    return SearchTerm().from_description(payload.description)
+    return await SearchTerm().afrom_description(payload.description)
 
 
 # Create a /health endpoint that returns 200 OK
@@ -40,35 +81,94 @@ async def create_search_term_action(payload: SearchTermPayload):
 async def health():
     return {"status": "ok"}
 
+
+@app.get("/health/offload")
+async def offload_stats():
+    return get_offload_pool().stats()
+
+
+@app.get("/health/sessions")
+async def session_stats():
+    return get_session_registry().stats()
+
+
+@app.get("/health/llm_clients")
+async def llm_client_stats():
+    return LlmLoader.client_stats()
+
+
+@app.get("/health/llm_retry")
+async def llm_retry_stats():
+    return retry_stats()
+
+
+@app.get("/health/llm_cache")
+async def llm_cache_stats():
+    return LlmLoader.cache_stats()
+
+
+@app.get("/health/search_cache")
+async def search_cache():
+    return search_cache_stats()
+
+
+@app.get("/health/local_index")
+async def local_index():
+    return local_index_stats()
+
+
+@app.get("/health/coalescing")
+async def coalescing_stats():
+    return {
+        "knowledge_research": research_flight.stats(),
+        "parallel_search": search_flight.stats(),
+    }
+
+@app.get("/health/scheduler")
+async def scheduler_stats():
+    return get_scheduler().stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        get_metrics_registry().render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@app.get("/health/spans")
+async def spans():
+    return recent_spans()
+
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
+    """Answers the messages of a chat session.
+
+    For each message the client receives `tool_start`, `tool_end`, `progress`
+    and `token` events while the agent works, then a `final` event holding the
+    complete response.
+    """
     await websocket.accept()
+    # The agent and its memory are kept across messages and connections of the session
+    session = get_session_registry().get(session_id)
     try:
         while True:
             data = await websocket.receive_text()
             logger.info(f"Client sent: {data}")
-            # prepare tools
-            toolkit = SimplifiedToolkit()
-
-            # prepare llm
-            chat_model = LlmLoader.create_chat_llm(
-                model=LlmLoader.DEPLOYMENT_35_TURBO_LG, temperature=0.5, top_p=0.5
-            )
-            agent_kwargs = {
-                "prefix": ChatResponseWithKB.SYSTEM_MESSAGE_WITH_TOOLS_PREFIX,
-                "format_instructions": ChatResponseWithKB.FORMAT_INSTRUCTIONS_FOR_AGENT,
-                "output_parser": NewAgentOutputFixingParser(),
-                "input_variables": ChatResponseWithKB.INPUT_VARIABLES,
-                "return_intermediate_steps": True,
-            }
-            # Initialize the agent with the tools and language model
-            agent = chat_agent(
-                llm=chat_model, 
-                toolkit=toolkit, 
-                verbose=True, 
-                agent_kwargs=agent_kwargs
-            )
-            response = agent.run(input={"similarity_search_term": data, "request_raw_question_input": data})
-            await websocket.send_json(response)
+            async with session.lock:
+                session.touch()
+                handler = WebsocketStreamCallbackHandler()
+                # Plain research questions skip the agent loop
+                task = asyncio.create_task(session.arun(data, callbacks=[handler]))
+                try:
+                    async for event in handler.events(task):
+                        await websocket.send_json(event)
+                finally:
+                    # Whatever stopped the stream, nobody is left to receive the answer
+                    if not task.done():
+                        task.cancel()
+                response = await task
+            await websocket.send_json({"type": "final", "response": response})
     except WebSocketDisconnect:
-        logger.info("Client disconnected")
\ No newline at end of file
+        logger.info("Client disconnected")
@@ -8,20 +8,45 @@ import uuid
 import requests
 import json
 # Function to handle WebSocket communication with FastAPI
-async def send_message(session_id, message):
+# Events are passed to on_event as they arrive, the final response is returned
+async def send_message(session_id, message, on_event):
     uri = f"ws://{BACKEND_URL}/ws/{session_id}"  # Adjust the URL if needed
     try:
         async with websockets.connect(uri) as websocket:
             await websocket.send(message)  # Send the user message
-            response = await websocket.recv()  # Wait for the response
-            return response
+            while True:
+                event = json.loads(await websocket.recv())
+                if event.get("type") == "final":
+                    return event["response"]
+                on_event(event)
     except Exception as e:
         st.error(f"Error with WebSocket connection: {e}")
         return None
 
 # Run asyncio loop in a separate thread to be compatible with Streamlit
-def run_asyncio_loop(session_id, message):
-    return asyncio.run(send_message(session_id, message))
+def run_asyncio_loop(session_id, message, on_event):
+    return asyncio.run(send_message(session_id, message, on_event))
+
+# Renders the progress and the answer streamed by the backend
+def stream_renderer(status, answer):
+    tokens = []
+
+    def render(event):
+        if event["type"] == "token":
+            tokens.append(event["content"])
+            answer.markdown("".join(tokens) + "▌")
+        elif event["type"] == "tool_start":
+            status.info(f"Researching with {event['tool']}...")
+        elif event["type"] == "progress" and event.get("stage") == "extract":
+            status.info(f"Reading sources ({event.get('done', 0)}/{event.get('total', 0)})...")
+        elif event["type"] == "progress" and event.get("stage") == "reduce":
+            status.info(f"Combining sources ({event.get('total', 0)} groups)...")
+        elif event["type"] == "progress" and event.get("stage") == "combine":
+            status.info("Writing the answer...")
+        elif event["type"] == "tool_end":
+            status.empty()
+
+    return render
 
 # Streamlit app UI
 st.title("Welcome to Tutor Helper! 👋")
@@ -54,14 +79,18 @@ if user_message:
     # Display the user message
     st.chat_message("user").markdown(user_message)
     
-    # Send the user message to the WebSocket backend and get the response
-    bot_response = run_asyncio_loop(session_id, user_message)
-    bot_response = json.loads(bot_response)
-    # Add the bot response to the chat history
-    st.session_state['messages'].append({"role": "assistant", "content": bot_response["content"]})
-    
-    # Display the latest chat messages from asstistant
-    st.chat_message("assistant").markdown(bot_response["content"])
+    # Send the user message to the WebSocket backend and render the response as it streams
+    with st.chat_message("assistant"):
+        status = st.empty()
+        answer = st.empty()
+        bot_response = run_asyncio_loop(session_id, user_message, stream_renderer(status, answer))
+        status.empty()
+        if bot_response:
+            answer.markdown(bot_response["content"])
+
+    if bot_response:
+        # Add the bot response to the chat history
+        st.session_state['messages'].append({"role": "assistant", "content": bot_response["content"]})
 
 
 # Function to search for tutor terms via FastAPI